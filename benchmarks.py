@@ -0,0 +1,678 @@
+"""
+benchmarks.py
+-------------
+Benchmarks for the Database Work Log.
+
+Every benchmark runs against a throwaway database filled with
+synthetic tasks, never against tasks.db.
+
+    python benchmarks.py indexes --rows 1000000
+    python benchmarks.py search --rows 1000000
+    python benchmarks.py import --rows 1000000
+    python benchmarks.py export --rows 5000000
+    python benchmarks.py report --rows 10000000
+    python benchmarks.py contention --rows 20000
+    python benchmarks.py lookup --rows 1000000
+    python benchmarks.py writer --rows 20000
+    python benchmarks.py notes --rows 200000
+
+The suite times the finders, bulk inserts, result paging and exports
+at several sizes and saves the timings as JSON, to compare commits:
+
+    python benchmarks.py suite --output after.json --baseline before.json
+"""
+
+import argparse
+import contextlib
+import csv
+import datetime
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+
+import peewee
+from peewee import OperationalError, chunked
+try:
+    from playhouse._sqlite_ext import sqlite_get_db_status
+except ImportError:  # peewee built without its C extension
+    sqlite_get_db_status = None
+
+import models
+import query
+import reports
+import results
+import transfer
+import utils
+import writer
+
+
+EMPLOYEES = ['beth', 'ben', 'bg', 'jennifer', 'kenneth', 'maria', 'sam']
+TASKNAMES = ['python', 'segmentation', 'management', 'teach unittest',
+             'code review', 'meeting', 'deploy', 'support']
+WORDS = ['rods', 'screws', 'project', 'patching', 'mocking', 'leadership',
+         'database', 'index', 'query', 'release', 'bug', 'review']
+START_DATE = datetime.date(2015, 1, 1)
+DAYS = 1500
+# beyond the named few, a long tail of employees and task names; both
+# are drawn with Zipf's law, so the first few account for most tasks
+STAFF = EMPLOYEES + ['staff{:03d}'.format(number) for number in range(200)]
+TASKS = TASKNAMES + ['project {:04d}'.format(number)
+                     for number in range(2000)]
+
+
+def _zipf_weights(count, exponent=1.0):
+    """Cumulative weights making item k about k**exponent times rarer."""
+    return list(itertools.accumulate(
+        1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+@contextlib.contextmanager
+def scratch_database(pragmas=None):
+    """Point models.db at an empty temporary file for the duration."""
+    directory = tempfile.mkdtemp()
+    models.configure(os.path.join(directory, 'bench.db'), pragmas)
+    try:
+        models.initialize()
+        yield models.db
+    finally:
+        models.configure()
+        shutil.rmtree(directory)
+
+
+def synthetic_tasks(rows, seed=0):
+    """Yield rows of synthetic task data, the same ones for the same seed.
+
+    Employees and task names are skewed as in a real team's log: a
+    few people log most tasks, and most tasks go under a few names.
+    Notes run from a few words to a few hundred, dates over four years.
+    """
+    rand = random.Random(seed)
+    staff, tasks = _zipf_weights(len(STAFF)), _zipf_weights(len(TASKS))
+    for _ in range(rows):
+        words = min(400, max(1, int(rand.lognormvariate(2.7, 0.8))))
+        yield (rand.choices(STAFF, cum_weights=staff)[0],
+               rand.choices(TASKS, cum_weights=tasks)[0],
+               rand.randint(1, 480),
+               ' '.join([rand.choice(WORDS) for _ in range(words)] +
+                        ['ticket{:05d}'.format(rand.randint(0, 99999))]),
+               START_DATE + datetime.timedelta(days=rand.randint(0, DAYS)))
+
+
+# the task columns a synthetic row is inserted into, by _task_row()
+TASK_FIELDS = [models.Task.employee, models.Task.taskname,
+               models.Task.minutes, models.Task.notes,
+               models.Task.notes_zip, models.Task.date]
+
+
+def _task_row(row, employee, taskname):
+    """Turn a synthetic row into TASK_FIELDS values, notes packed."""
+    notes = models.pack_notes(row[3])
+    return (employee, taskname, row[2], notes['notes'], notes['notes_zip'],
+            row[4])
+
+
+def populate(rows, seed=0, chunk_size=10000, source=synthetic_tasks):
+    """Fill the current database with synthetic tasks from source."""
+    with models.db.atomic():
+        ids = models.Employee.ids(STAFF)
+        names = models.TaskName.ids(TASKS)
+        for chunk in chunked(source(rows, seed), chunk_size):
+            models.Task.insert_many(
+                [_task_row(row, ids[row[0]], names[row[1]])
+                 for row in chunk], fields=TASK_FIELDS).execute()
+        utils.index_notes()
+    models.db.execute_sql('ANALYZE')
+
+
+def timed(func, *args, **kwargs):
+    """Run func and return (seconds, result)."""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+class _SQLRecorder(logging.Handler):
+    """Collect the statements peewee logs while attached."""
+
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.statements = []
+
+    def emit(self, record):
+        if isinstance(record.msg, tuple):
+            self.statements.append(record.msg)
+
+
+@contextlib.contextmanager
+def recording_sql():
+    """Record every (sql, params) peewee executes inside the block."""
+    logger = logging.getLogger('peewee')
+    recorder = _SQLRecorder()
+    old_level = logger.level
+    logger.addHandler(recorder)
+    logger.setLevel(logging.DEBUG)
+    try:
+        yield recorder.statements
+    finally:
+        logger.removeHandler(recorder)
+        logger.setLevel(old_level)
+
+
+def query_plan(func, *args):
+    """Return the EXPLAIN QUERY PLAN details of the last query func runs."""
+    with recording_sql() as statements:
+        list(func(*args))
+    sql, params = statements[-1]
+    cursor = models.db.execute_sql('EXPLAIN QUERY PLAN ' + sql, params)
+    return [row[-1] for row in cursor.fetchall()]
+
+
+def finder_calls():
+    """Return (name, func, args) for every utils finder."""
+    day = START_DATE + datetime.timedelta(days=700)
+    return [
+        ('find_by_employee', utils.find_by_employee, ('beth',)),
+        ('find_by_date', utils.find_by_date, (day,)),
+        ('find_by_date_range', utils.find_by_date_range,
+         (day, day + datetime.timedelta(days=30))),
+        ('find_by_time_spent', utils.find_by_time_spent, (240,)),
+        ('minutes at least', lambda least: query.Search().minutes(
+            least).results(), (470,)),
+        ('longest', lambda count: query.Search().longest(
+            count).results(), (20,)),
+        # uncached, to see the queries behind the pickers
+        ('find_unique_employees',
+         utils.find_unique_employees.__wrapped__, ()),
+        ('find_unique_dates', utils.find_unique_dates.__wrapped__, ()),
+    ]
+
+
+def bench_indexes(rows):
+    """Time every indexed finder and show the plan SQLite picks."""
+    with scratch_database():
+        seconds, _ = timed(populate, rows)
+        print('populated {} rows in {:.2f}s'.format(rows, seconds))
+        for name, func, args in finder_calls():
+            seconds, result = timed(lambda: list(func(*args)))
+            plan = '; '.join(query_plan(func, *args))
+            print('{:<24}{:>9.4f}s {:>9} rows  {}'.format(
+                name, seconds, len(result), plan))
+
+
+def bench_search(rows):
+    """Compare the LIKE search with the FTS5 search."""
+    with scratch_database():
+        populate(rows)
+        for term in ['ticket0424', 'screws', 'leader', '"code review"']:
+            like_seconds, like = timed(
+                lambda: list(utils.find_by_search_term(term.strip('"'))))
+            fts_seconds, fts = timed(
+                lambda: list(utils.find_by_full_text(term)))
+            print('{:<16} LIKE {:>8.4f}s {:>8} rows   '
+                  'FTS {:>8.4f}s {:>8} rows'.format(
+                      term, like_seconds, len(like), fts_seconds, len(fts)))
+
+
+def bench_import(rows):
+    """Time importing a CSV file of synthetic tasks."""
+    with scratch_database() as database:
+        path = os.path.join(os.path.dirname(database.database), 'tasks.csv')
+        with open(path, 'w', newline='') as target:
+            writer = csv.writer(target)
+            writer.writerow(transfer.FIELDS)
+            for row in synthetic_tasks(rows):
+                writer.writerow(row[:4] + (row[4].strftime(utils.fmt),))
+        stats = transfer.import_file(path)
+        print('imported {imported} rows in {seconds:.2f}s '
+              '({rate:.0f} rows/sec)'.format(**stats))
+
+
+def bench_export(rows):
+    """Time exporting every task to each format and reading it back."""
+    with scratch_database() as database:
+        populate(rows)
+        directory = os.path.dirname(database.database)
+        for kind in sorted(transfer.WRITERS):
+            path = os.path.join(directory, 'tasks.' + kind)
+            stats = transfer.export_results(utils.find_all(), path)
+            seconds, read = timed(
+                lambda: sum(1 for _ in transfer.READERS[kind](path)))
+            print('{:<6} export {:>8.2f}s ({:>7.0f} rows/sec) {:>7.1f} MB  '
+                  'read back {} rows in {:.2f}s'.format(
+                      kind, stats['seconds'], stats['rate'],
+                      os.path.getsize(path) / 2 ** 20, read, seconds))
+
+
+def bench_report(rows):
+    """Time every report grouping, over all dates and over one year.
+
+    Totals alone come from the daily totals; with percentiles every
+    task in the dates is read.
+    """
+    year = (START_DATE, START_DATE.replace(year=START_DATE.year + 1))
+    with scratch_database():
+        seconds, _ = timed(populate, rows)
+        print('populated {} rows in {:.2f}s'.format(rows, seconds))
+        for by in reports.GROUPS:
+            all_seconds, groups = timed(reports.report, by)
+            year_seconds, _ = timed(reports.report, by, *year)
+            totals_seconds, _ = timed(reports.report, by, percentiles=False)
+            print('{:<10} all {:>8.2f}s {:>6} groups   '
+                  'one year {:>8.2f}s   totals only {:>8.4f}s'.format(
+                      by, all_seconds, len(groups), year_seconds,
+                      totals_seconds))
+        seconds, (expected, stored) = timed(reports.verify_daily_totals)
+        print('verified daily totals in {:.2f}s, {} mismatches'.format(
+            seconds, len(expected) + len(stored)))
+
+
+def bench_lookup(rows, employees=100000):
+    """Time employee prefix lookups among many distinct employees."""
+    rand = random.Random(0)
+    names = ['{}{}'.format(rand.choice(EMPLOYEES), number)
+             for number in range(employees)]
+    with scratch_database():
+        with models.db.atomic():
+            ids = list(models.Employee.ids(names).values())
+            tasknames = models.TaskName.ids(TASKS)
+            for chunk in chunked(synthetic_tasks(rows), 10000):
+                models.Task.insert_many(
+                    [_task_row(row, rand.choice(ids), tasknames[row[1]])
+                     for row in chunk], fields=TASK_FIELDS).execute()
+        models.db.execute_sql('ANALYZE')
+        for prefix in ['b', 'be', 'beth', 'beth12', 'beth12345', 'zz']:
+            latencies = _latencies(
+                lambda: utils.find_employees_by_prefix(prefix, 20), 200)
+            print('{:<10} {:>2} matches  mean {:>7.3f}ms  p95 {:>7.3f}ms'
+                  .format(prefix,
+                          len(utils.find_employees_by_prefix(prefix, 20)),
+                          1000 * sum(latencies) / len(latencies),
+                          1000 * latencies[int(len(latencies) * 0.95)]))
+        seconds, similar = timed(utils.find_similar_employees, 'bet1234')
+        print('similar to bet1234: {} in {:.3f}s'.format(similar, seconds))
+
+
+def _write_tasks(path, pragmas, rows, seed):
+    """Add rows tasks one transaction each; count the ones refused."""
+    models.configure(path, pragmas)
+    locked = 0
+    for row in synthetic_tasks(rows, seed):
+        try:
+            utils.create_task(dict(zip(transfer.FIELDS, row)))
+        except OperationalError:
+            locked += 1
+    models.db.close_all()
+    return locked
+
+
+# the journal and locking SQLite uses out of the box
+ROLLBACK_PRAGMAS = {'busy_timeout': 0, 'journal_mode': 'delete',
+                    'synchronous': 'full'}
+
+
+def bench_contention(rows, processes=8):
+    """Time processes writing at once, before and after tuning."""
+    context = multiprocessing.get_context('spawn')
+    for name, pragmas in [('rollback journal', ROLLBACK_PRAGMAS),
+                          ('tuned', models.PRAGMAS)]:
+        with scratch_database(pragmas) as database:
+            path = database.database
+            models.db.close_all()
+            with context.Pool(processes) as pool:
+                start = time.perf_counter()
+                locked = sum(pool.starmap(_write_tasks, [
+                    (path, pragmas, rows // processes, seed)
+                    for seed in range(processes)]))
+                seconds = time.perf_counter() - start
+            written = utils.count_tasks()
+            print('{:<17} {} processes  {:>7} written  {:>7} locked  '
+                  '{:>8.2f}s ({:.0f} writes/sec)'.format(
+                      name, processes, written, locked, seconds,
+                      written / seconds))
+
+
+def bench_writer(rows):
+    """Compare adding tasks one commit each with a buffered TaskWriter."""
+    tasks = [dict(zip(transfer.FIELDS, row)) for row in synthetic_tasks(rows)]
+    for name, pragmas in [('rollback journal', ROLLBACK_PRAGMAS),
+                          ('tuned', models.PRAGMAS)]:
+        for path in ['per call', 'buffered']:
+            with scratch_database(pragmas):
+                start = time.perf_counter()
+                if path == 'per call':
+                    for task in tasks:
+                        utils.create_task(task)
+                else:
+                    with writer.TaskWriter() as buffered:
+                        for task in tasks:
+                            buffered.add(task)
+                seconds = time.perf_counter() - start
+                print('{:<17} {:<9} {:>8} written  {:>8.2f}s '
+                      '({:.0f} inserts/sec)'.format(
+                          name, path, utils.count_tasks(), seconds,
+                          rows / seconds))
+
+
+def _latencies(draw, redraws):
+    latencies = []
+    for _ in range(redraws):
+        start = time.perf_counter()
+        draw()
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return latencies
+
+
+def bench_redraw(rows, redraws=500):
+    """Time redrawing the result menu, clearing in-process or by command."""
+    import dbworklog
+    import terminal
+
+    class CommandRenderer(terminal.Renderer):
+        """Clear the screen the old way, by running a command."""
+
+        def clear(self):
+            os.system("cls" if os.name == "nt" else "clear >/dev/null")
+
+    with scratch_database(), open(os.devnull, 'w') as devnull:
+        populate(rows)
+        menu = dbworklog.ResultMenu(utils.find_all())
+
+        def draw():
+            menu._print_heading()
+            terminal.renderer().line(str(menu))
+            menu._print_info()
+            menu.next()
+
+        for name, screen in [('ansi', terminal.AnsiRenderer(devnull)),
+                             ('clear command', CommandRenderer(devnull))]:
+            terminal.set_renderer(screen)
+            latencies = _latencies(draw, redraws)
+            print('{:<14} mean {:>8.3f}ms  p95 {:>8.3f}ms'.format(
+                name, 1000 * sum(latencies) / redraws,
+                1000 * latencies[int(redraws * 0.95)]))
+        terminal.set_renderer(None)
+
+
+LOG_LINE = '{} {} worker-{} request {:08x} {} after {}ms'
+LOG_EVENTS = ['INFO', 'INFO', 'INFO', 'WARN', 'ERROR']
+LOG_MESSAGES = ['served', 'retried', 'timed out', 'queued', 'cancelled']
+
+
+def tasks_with_logs(rows, seed=0, share=0.05):
+    """Yield synthetic_tasks rows, share of them with a log pasted in.
+
+    The logs run from fifty lines to eight hundred, a few kilobytes to
+    some tens of kilobytes each.
+    """
+    rand = random.Random(seed)
+    for row in synthetic_tasks(rows, seed):
+        if rand.random() < share:
+            start = datetime.datetime.combine(row[4], datetime.time(9))
+            log = '\n'.join(LOG_LINE.format(
+                start + datetime.timedelta(seconds=line),
+                rand.choice(LOG_EVENTS), rand.randint(1, 16),
+                rand.getrandbits(32), rand.choice(LOG_MESSAGES),
+                rand.randint(1, 5000))
+                for line in range(rand.randint(50, 800)))
+            row = row[:3] + (row[3] + '\n' + log,) + row[4:]
+        yield row
+
+
+# sqlite3_db_status() counters of page cache hits and misses
+CACHE_HIT, CACHE_MISS = 7, 8
+# a page cache far smaller than the file, and no memory mapping, so
+# what is read has to compete for the cache
+SMALL_CACHE_PRAGMAS = dict(models.PRAGMAS, cache_size=-2000, mmap_size=0)
+
+
+def _cache_counts():
+    """Return the page cache hits and misses on this thread's connection."""
+    if sqlite_get_db_status is None:
+        return 0, 0
+    connection = models.db.connection()
+    return (sqlite_get_db_status(connection, CACHE_HIT)[0],
+            sqlite_get_db_status(connection, CACHE_MISS)[0])
+
+
+def _table_size(table):
+    """Return the bytes table takes up in the file, or None if unknown."""
+    try:
+        return models.db.execute_sql(
+            'SELECT SUM(pgsize) FROM dbstat WHERE name = ?',
+            (table,)).fetchone()[0]
+    except OperationalError:  # SQLite built without dbstat
+        return None
+
+
+def bench_notes(rows):
+    """Compare storing pasted logs as text with storing them compressed.
+
+    Prints each database's size and its task table's, then the time and
+    page cache hit rate of reading it as the menus and reports do.
+    """
+    day = START_DATE + datetime.timedelta(days=700)
+    workload = [
+        ('report by month', lambda: reports.report('month')),
+        ('find_by_date_range', lambda: _first_screen(
+            utils.find_by_date_range(day, day + datetime.timedelta(
+                days=365)))),
+        ('find_by_employee', lambda: _first_screen(
+            utils.find_by_employee('beth'))),
+        ('find_by_full_text', lambda: _first_screen(
+            utils.find_by_full_text('timed out'))),
+        ('find_by_search_term', lambda: _first_screen(
+            utils.find_by_search_term('timed out'))),
+    ]
+    if sqlite_get_db_status is None:
+        print('no page cache counts: peewee has no C extension here')
+    original = models.COMPRESS_NOTES_AT
+    try:
+        for name, compress_at in [('text', 0),
+                                  ('compressed', original or 2048)]:
+            models.COMPRESS_NOTES_AT = compress_at
+            with scratch_database(SMALL_CACHE_PRAGMAS) as database:
+                seconds, _ = timed(populate, rows, source=tasks_with_logs)
+                database.execute_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+                table = _table_size('task')
+                print('{:<11} populated in {:>7.2f}s  file {:>8.1f} MB  '
+                      'task table {} MB'.format(
+                          name, seconds,
+                          os.path.getsize(database.database) / 2 ** 20,
+                          'unknown' if table is None else '{:.1f}'.format(
+                              table / 2 ** 20)))
+                for call, func in workload:
+                    hits, misses = _cache_counts()
+                    seconds, _ = timed(func)
+                    after_hits, after_misses = _cache_counts()
+                    hits, misses = after_hits - hits, after_misses - misses
+                    print('{:<11} {:<20} {:>8.3f}s {:>9} hits {:>9} misses'
+                          ' {:>5.1f}% hit'.format(
+                              name, call, seconds, hits, misses,
+                              100 * hits / max(1, hits + misses)))
+    finally:
+        models.COMPRESS_NOTES_AT = original
+
+
+SUITE_SIZES = (10000, 1000000, 10000000)
+# a timing this many times its baseline is reported as a regression,
+# unless it is under a millisecond slower, which is only noise
+REGRESSION = 1.25
+NOISE = 0.001
+
+
+def suite_calls():
+    """Return (name, func, args) for every utils finder, indexed or not."""
+    return [(name, func, args) for name, func, args in finder_calls()
+            if name.startswith('find_')] + [
+        ('find_all', utils.find_all, ()),
+        ('find_by_search_term', utils.find_by_search_term, ('screws',)),
+        ('find_by_full_text', utils.find_by_full_text, ('screws',)),
+        ('find_employees_by_prefix', utils.find_employees_by_prefix,
+         ('staff1', 20)),
+        ('find_similar_employees', utils.find_similar_employees,
+         ('stafff12',)),
+    ]
+
+
+def _first_screen(result):
+    """Do what a menu does with a finder's result: count, show a page."""
+    if isinstance(result, results.ResultSet):
+        return len(result), result.after()
+    return len(result), result
+
+
+def _median_seconds(func, *args, repeats=5):
+    """Return the median seconds of func's first screen, and its rows."""
+    latencies = _latencies(lambda: _first_screen(func(*args)), repeats)
+    return statistics.median(latencies), _first_screen(func(*args))[0]
+
+
+def _paging(steps=500):
+    """Time ResultMenu turning pages forward, then jumping to the end."""
+    import dbworklog
+
+    menu = dbworklog.ResultMenu(utils.find_all())
+
+    def step():
+        str(menu)
+        menu.next()
+
+    forward = _latencies(step, steps)
+    menu.index = 0
+    jump_seconds, _ = timed(lambda: (menu.prev(), str(menu)))
+    return {'paging mean': statistics.mean(forward),
+            'paging p95': forward[int(steps * 0.95)],
+            'paging jump to end': jump_seconds}
+
+
+def run_sizes(rows, seed=0):
+    """Time everything the suite covers at one size.
+
+    Returns (seconds, rows) dicts keyed alike, the rows being how many
+    each timing handled.
+    """
+    seconds, counts = {}, {}
+    with scratch_database() as database:
+        seconds['bulk insert'], _ = timed(populate, rows, seed)
+        counts['bulk insert'] = rows
+        for name, func, args in suite_calls():
+            seconds[name], counts[name] = _median_seconds(func, *args)
+        seconds.update(_paging())
+        directory = os.path.dirname(database.database)
+        for kind in sorted(transfer.WRITERS):
+            stats = transfer.export_results(
+                utils.find_all(), os.path.join(directory, 'tasks.' + kind))
+            seconds['export ' + kind] = stats['seconds']
+            counts['export ' + kind] = stats['exported']
+    return seconds, counts
+
+
+def _commit():
+    """Return the checked out commit, marked if the tree has changes."""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=directory, check=True,
+            capture_output=True, text=True).stdout.strip()
+        changes = subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'],
+            cwd=directory, check=True, capture_output=True,
+            text=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if changes else '')
+
+
+def compare(baseline, current):
+    """Yield lines comparing the timings of two suite runs.
+
+    Only sizes and timings both runs have are compared; the ones slower
+    than REGRESSION times their baseline are marked.
+    """
+    for size, timings in current['seconds'].items():
+        before = baseline['seconds'].get(size, {})
+        for name, seconds in timings.items():
+            if not before.get(name):
+                continue
+            ratio = seconds / before[name]
+            slower = ratio >= REGRESSION and seconds - before[name] > NOISE
+            yield '{:>9} {:<26} {:>11.3f}ms {:>11.3f}ms {:>6.2f}x{}'.format(
+                size, name, before[name] * 1000, seconds * 1000, ratio,
+                '  REGRESSION' if slower else '')
+
+
+def bench_suite(sizes=SUITE_SIZES, output=None, baseline=None, seed=0):
+    """Time the finders, bulk inserts, paging and exports at each size.
+
+    The results, and what they were run on, are written as JSON to
+    output and compared with the baseline file, when given.
+    """
+    run = {'commit': _commit(),
+           'date': datetime.datetime.now().isoformat(timespec='seconds'),
+           'python': platform.python_version(),
+           'sqlite': sqlite3.sqlite_version,
+           'peewee': peewee.__version__,
+           'seed': seed,
+           'seconds': {},
+           'rows': {}}
+    for rows in sizes:
+        seconds, counts = run_sizes(rows, seed)
+        run['seconds'][str(rows)], run['rows'][str(rows)] = seconds, counts
+        for name, value in seconds.items():
+            print('{:>9} {:<26} {:>11.3f}ms {:>9}'.format(
+                rows, name, value * 1000, counts.get(name, '')))
+    if output:
+        with open(output, 'w') as target:
+            json.dump(run, target, indent=2)
+    if baseline:
+        with open(baseline) as source:
+            for line in compare(json.load(source), run):
+                print(line)
+    return run
+
+
+BENCHMARKS = {
+    'indexes': bench_indexes,
+    'search': bench_search,
+    'import': bench_import,
+    'export': bench_export,
+    'report': bench_report,
+    'contention': bench_contention,
+    'lookup': bench_lookup,
+    'writer': bench_writer,
+    'redraw': bench_redraw,
+    'notes': bench_notes,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Database Work Log benchmarks.')
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS) + ['suite'])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--sizes', type=int, nargs='+', default=SUITE_SIZES,
+                        help="row counts the suite runs at")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the suite's results here")
+    parser.add_argument('--baseline',
+                        help="compare the suite with an earlier --output")
+    args = parser.parse_args(argv)
+    if args.benchmark == 'suite':
+        bench_suite(args.sizes, args.output, args.baseline, args.seed)
+    else:
+        BENCHMARKS[args.benchmark](args.rows)
+
+
+if __name__ == '__main__':
+    main()
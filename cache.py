@@ -0,0 +1,191 @@
+"""
+cache.py
+--------
+Caches that keep the menus from asking the database the same
+question twice.
+"""
+
+from collections import OrderedDict
+import functools
+import threading
+
+from peewee import DatabaseError
+
+import models
+
+
+class PageCache:
+    """Task rows of a results.ResultSet, loaded a window at a time.
+
+    A window is `size` consecutive results fetched with one query.  At
+    most `max_windows` stay cached; the least recently used goes first.
+    Reading near either edge of a window loads the neighbouring window
+    in a background thread so paging rarely waits on the database.
+    """
+
+    def __init__(self, results, size=50, max_windows=8, prefetch=True):
+        self.results = results
+        self.size = size
+        self.max_windows = max_windows
+        self.prefetch = prefetch
+        self._windows = OrderedDict()
+        self._loading = set()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._windows)
+
+    def _window_count(self):
+        return (len(self.results) + self.size - 1) // self.size
+
+    def _fetch(self, window):
+        """Query the rows of one window.
+
+        A cached neighbour gives a key to page from; only a jump into
+        the middle of the results needs an OFFSET.
+        """
+        with self._lock:
+            before = self._windows.get(window - 1)
+            after = self._windows.get(window + 1)
+        if before:
+            return self.results.after(before[-1].key, self.size)
+        if after:
+            return self.results.before(after[0].key, self.size)
+        if window == 0:
+            return self.results.after(None, self.size)
+        if window == self._window_count() - 1:
+            return self.results.before(
+                None, len(self.results) - window * self.size)
+        return self.results.at(window * self.size, self.size)
+
+    def _store(self, window, rows, generation):
+        with self._lock:
+            self._loading.discard(window)
+            if generation != self._generation:
+                return  # invalidated while loading
+            self._windows[window] = rows
+            self._windows.move_to_end(window)
+            while len(self._windows) > self.max_windows:
+                self._windows.popitem(last=False)
+
+    def _load(self, window):
+        with self._lock:
+            generation = self._generation
+        self._store(window, self._fetch(window), generation)
+
+    def _load_in_background(self, window):
+        try:
+            self._load(window)
+        except DatabaseError:
+            with self._lock:
+                self._loading.discard(window)  # read it on demand instead
+        finally:
+            if not models.db.is_closed():
+                models.db.close()
+
+    def _prefetch(self, window):
+        """Start loading window unless it is cached or on its way."""
+        window %= self._window_count()
+        with self._lock:
+            if window in self._windows or window in self._loading:
+                return
+            self._loading.add(window)
+        threading.Thread(target=self._load_in_background,
+                         args=(window,), daemon=True).start()
+
+    def get(self, index):
+        """Return the task at index in the results."""
+        window, offset = divmod(index, self.size)
+        with self._lock:
+            rows = self._windows.get(window)
+            if rows is not None:
+                self._windows.move_to_end(window)
+        if rows is None:
+            self._load(window)
+            with self._lock:
+                rows = self._windows.get(window)
+        margin = max(1, self.size // 4)
+        if self.prefetch and self._window_count() > 1:
+            if offset >= self.size - margin:
+                self._prefetch(window + 1)
+            elif offset < margin:
+                self._prefetch(window - 1)
+        if rows is None:  # edited while loading; read it uncached
+            rows = self._fetch(window)
+        try:
+            return rows[offset]
+        except IndexError:
+            raise IndexError('result index out of range') from None
+
+    def _drop(self, windows):
+        with self._lock:
+            self._generation += 1
+            for window in [w for w in self._windows if w in windows]:
+                del self._windows[window]
+
+    def refresh(self, index):
+        """Forget the window holding index after its row was edited."""
+        self._drop({index // self.size})
+
+    def remove(self, index):
+        """Forget windows from index on after its row was deleted.
+
+        Every later row shifts down one place, so their windows are stale.
+        """
+        self._drop(range(index // self.size, self._window_count() + 1))
+
+    def clear(self):
+        """Forget every cached window."""
+        self._drop(set(self._windows))
+
+
+class TaskValueCache:
+    """Values worked out from the task table, kept until it changes.
+
+    Every write to task bumps the 'task_writes' counter by trigger, in
+    the same transaction, whether utils, an import or another process
+    made it.  That counter is the cache's generation: one primary key
+    lookup tells whether the remembered values still hold.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, func):
+        """Return what func() returns, computing it once per generation."""
+        generation = models.Counter.value_of('task_writes')
+        with self._lock:
+            if generation != self._generation:
+                self._values.clear()
+                self._generation = generation
+            if func in self._values:
+                return self._values[func]
+        value = func()
+        with self._lock:
+            # a write while computing leaves this for the next generation
+            if generation == self._generation:
+                self._values[func] = value
+        return value
+
+    def clear(self):
+        """Forget every value."""
+        with self._lock:
+            self._values.clear()
+            self._generation = None
+
+    def __call__(self, func):
+        """Decorate func so it is answered from the cache."""
+        @functools.wraps(func)
+        def cached():
+            return self.get(func)
+        return cached
+
+
+# the employee and date pickers' lists
+task_values = TaskValueCache()
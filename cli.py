@@ -0,0 +1,356 @@
+"""
+cli.py
+------
+Command line interface for the Database Work Log.
+
+Every command calls utils directly and prints one JSON object per
+line, with no screen clearing or menus, so scripts and cron jobs can
+drive the work log.  Errors, and rows an import rejects, go to
+stderr.  dbworklog.main runs these commands.
+"""
+
+import argparse
+import datetime
+import json
+import sys
+
+import query
+import reports
+import transfer
+import utils
+
+from utils import fmt
+
+
+def emit(record):
+    """Print a record as a line of JSON."""
+    print(json.dumps(record))
+
+
+def task_record(task):
+    """Return a task as a record, id included."""
+    return dict(id=task.id, **transfer.record(task))
+
+
+def import_files(args):
+    """Import work log files given on the command line."""
+    for path in args.paths:
+        try:
+            stats = transfer.import_file(path, args.format, args.chunk_size,
+                                         args.restart)
+        except (OSError, ValueError) as err:
+            sys.exit("{}: {}".format(path, err))
+        emit(dict(path=path, **stats))
+
+
+def date_argument(value):
+    """Parse a YYYYMMDD command line date."""
+    try:
+        return datetime.datetime.strptime(value, fmt).date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "{!r} is not a YYYYMMDD date".format(value))
+
+
+def positive_argument(value):
+    """Parse a whole number of at least one."""
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            "{!r} is not a positive whole number".format(value))
+    return number
+
+
+def add_search_arguments(parser):
+    """Add the options that pick which entries a command works on.
+
+    Options combine: only entries matching all of them are picked.
+    """
+    parser.add_argument('--employee', help="entries by this employee")
+    dates = parser.add_mutually_exclusive_group()
+    dates.add_argument('--date', type=date_argument,
+                       help="entries on this YYYYMMDD date")
+    dates.add_argument('--range', nargs=2, type=date_argument,
+                       metavar=('START', 'END'),
+                       help="entries between two YYYYMMDD dates")
+    minutes = parser.add_mutually_exclusive_group()
+    minutes.add_argument('--minutes', type=int,
+                         help="entries that took exactly this long")
+    minutes.add_argument('--minutes-range', nargs=2, type=int,
+                         metavar=('LEAST', 'MOST'),
+                         help="entries that took from LEAST to MOST minutes")
+    minutes.add_argument('--at-least', type=int, metavar='MINUTES',
+                         help="entries that took at least this long")
+    minutes.add_argument('--at-most', type=int, metavar='MINUTES',
+                         help="entries that took at most this long")
+    parser.add_argument('--longest', type=int, metavar='COUNT',
+                        help="only the COUNT matching entries that took "
+                             "longest, longest first")
+    parser.add_argument('--term', help="entries whose task name or notes "
+                                       "match this search term")
+
+
+def search_query(args):
+    """Build the search the search options ask for; all entries if none."""
+    search = query.Search()
+    if args.employee is not None:
+        search = search.for_employee(args.employee)
+    if args.date is not None:
+        search = search.on(args.date)
+    if args.range is not None:
+        search = search.between(*args.range)
+    if args.minutes is not None:
+        search = search.minutes(args.minutes, args.minutes)
+    if args.minutes_range is not None:
+        search = search.minutes(*args.minutes_range)
+    if args.at_least is not None:
+        search = search.minutes(least=args.at_least)
+    if args.at_most is not None:
+        search = search.minutes(most=args.at_most)
+    if args.longest is not None:
+        search = search.longest(args.longest)
+    if args.term is not None:
+        search = search.matching(args.term)
+    return search
+
+
+def search_results(args):
+    """Run the search the search options ask for."""
+    return search_query(args).results()
+
+
+def export_file(args):
+    """Export the entries a search finds to a file."""
+    try:
+        stats = transfer.export_results(search_results(args), args.path,
+                                        args.format)
+    except (OSError, ValueError) as err:
+        sys.exit("{}: {}".format(args.path, err))
+    emit(dict(path=args.path, **stats))
+
+
+def add_task(args):
+    """Add an entry."""
+    try:
+        new_task = utils.clean_task(vars(args))
+    except ValueError as err:
+        sys.exit(str(err))
+    emit({'id': utils.create_task(new_task)})
+
+
+def search(args):
+    """Print the entries a search finds, or how it would find them."""
+    if args.explain:
+        planned = search_query(args)
+        path, estimates = planned.plan()
+        emit({'path': path, 'probes': estimates,
+              'plan': planned.explain()})
+        return
+    for number, task in enumerate(search_results(args).tasks()):
+        if number == args.limit:
+            break
+        emit(task_record(task))
+
+
+def edit_task(args):
+    """Change the given fields of an entry."""
+    try:
+        current = utils.get_task(args.id)
+    except utils.models.Task.DoesNotExist:
+        sys.exit("No entry {}".format(args.id))
+    task = transfer.record(current)
+    task.update((field, getattr(args, field)) for field in transfer.FIELDS
+                if getattr(args, field) is not None)
+    try:
+        new_task = utils.clean_task(task)
+    except ValueError as err:
+        sys.exit(str(err))
+    if args.employee is None:
+        # the same employee, not the first who shares their name
+        new_task['employee'] = current.employee
+    utils.save_task(args.id, new_task)
+    emit({'id': args.id})
+
+
+def delete_tasks(args):
+    """Delete entries by id."""
+    deleted = []
+    for task_id in args.ids:
+        try:
+            utils.delete_task(task_id)
+        except utils.models.Task.DoesNotExist:
+            continue
+        deleted.append(task_id)
+    emit({'deleted': deleted})
+
+
+def stats(args):
+    """Print totals for the whole work log."""
+    emit(utils.task_stats())
+
+
+def employees(args):
+    """Print the employees whose names start with a prefix."""
+    names = utils.find_employees_by_prefix(args.prefix, args.limit)
+    if not names and args.prefix:
+        names = utils.find_similar_employees(args.prefix, args.limit or 10)
+    for name in names:
+        emit({'employee': name})
+
+
+def tasknames(args):
+    """Print the task names in use starting with a prefix, most used first."""
+    catalog = utils.models.TaskName
+    names = utils.find_tasknames(args.prefix, args.limit)
+    used = {row.name: row for row in catalog.select().where(
+        catalog.name.in_(names))}
+    for name in names:
+        emit({'taskname': name, 'uses': used[name].uses,
+              'last_used': used[name].last_used.strftime(fmt)})
+
+
+def report(args):
+    """Print minutes totals, averages and percentiles per group."""
+    for row in reports.report(args.by, args.start, args.end,
+                              args.percentiles):
+        emit(row)
+
+
+def histogram(args):
+    """Print how many entries took how long, in bands of minutes."""
+    for row in reports.minutes_histogram(args.width, args.start, args.end):
+        emit(row)
+
+
+def daily_totals(args):
+    """Check the daily totals against the entries, or recompute them."""
+    if args.action == 'rebuild':
+        emit({'daily_totals': reports.rebuild_daily_totals()})
+        return
+    expected, stored = reports.verify_daily_totals()
+    for source, rows in [('entries', expected), ('daily_totals', stored)]:
+        for row in rows:
+            emit(dict(row, day=row['day'].strftime(fmt), source=source))
+    if expected or stored:
+        sys.exit("Daily totals do not match the entries; "
+                 "run 'daily-totals rebuild'")
+
+
+def _add_task_fields(parser, required):
+    parser.add_argument('--employee', required=required)
+    parser.add_argument('--taskname', required=required)
+    parser.add_argument('--minutes', required=required)
+    parser.add_argument('--notes', default='' if required else None)
+    parser.add_argument('--date', default=(
+        datetime.date.today().strftime(fmt) if required else None),
+                        help="YYYYMMDD (default: today)" if required
+                        else "YYYYMMDD")
+
+
+def parser():
+    """Build the command line parser."""
+    parser = argparse.ArgumentParser(
+        description="Database Work Log.  Without a command, "
+                    "start the interactive menus.")
+    parser.add_argument('--profile', action='store_true',
+                        help="time database calls, log slow ones and print "
+                             "a summary at the end")
+    commands = parser.add_subparsers(dest='command')
+
+    importer = commands.add_parser(
+        'import', help="import entries from CSV, JSON Lines or WLC files")
+    importer.add_argument('paths', nargs='+', metavar='path')
+    importer.add_argument('--format', choices=sorted(transfer.READERS),
+                          help="file format (default: from the extension)")
+    importer.add_argument('--chunk-size', type=int, default=10000,
+                          help="rows per transaction")
+    importer.add_argument('--restart', action='store_true',
+                          help="import from the top even if an earlier "
+                               "import of the file got part way")
+    importer.set_defaults(func=import_files)
+
+    exporter = commands.add_parser(
+        'export', help="export entries to a CSV, JSON Lines or WLC file")
+    exporter.add_argument('path')
+    exporter.add_argument('--format', choices=sorted(transfer.WRITERS),
+                          help="file format (default: from the extension)")
+    add_search_arguments(exporter)
+    exporter.set_defaults(func=export_file)
+
+    adder = commands.add_parser('add', help="add an entry")
+    _add_task_fields(adder, required=True)
+    adder.set_defaults(func=add_task)
+
+    searcher = commands.add_parser(
+        'search', help="print matching entries as JSON lines")
+    add_search_arguments(searcher)
+    searcher.add_argument('--limit', type=int,
+                          help="print at most this many entries")
+    searcher.add_argument('--explain', action='store_true',
+                          help="print the query plan instead of entries")
+    searcher.set_defaults(func=search)
+
+    editor = commands.add_parser('edit', help="change fields of an entry")
+    editor.add_argument('id', type=int)
+    _add_task_fields(editor, required=False)
+    editor.set_defaults(func=edit_task)
+
+    deleter = commands.add_parser('delete', help="delete entries by id")
+    deleter.add_argument('ids', nargs='+', type=int, metavar='id')
+    deleter.set_defaults(func=delete_tasks)
+
+    lookup = commands.add_parser(
+        'employees', help="print employees whose names start with a prefix, "
+                          "or failing that look like it")
+    lookup.add_argument('prefix', nargs='?', default='')
+    lookup.add_argument('--limit', type=int,
+                        help="print at most this many employees")
+    lookup.set_defaults(func=employees)
+
+    catalog = commands.add_parser(
+        'tasknames', help="print task names starting with a prefix, "
+                          "most used first")
+    catalog.add_argument('prefix', nargs='?', default='')
+    catalog.add_argument('--limit', type=int,
+                         help="print at most this many task names")
+    catalog.set_defaults(func=tasknames)
+
+    totals = commands.add_parser('stats', help="print work log totals")
+    totals.set_defaults(func=stats)
+
+    reporter = commands.add_parser(
+        'report', help="print minutes per employee, day, week, month or "
+                       "task name as JSON lines")
+    reporter.add_argument('--by', choices=list(reports.GROUPS),
+                          default='employee', help="what to group by")
+    reporter.add_argument('--from', dest='start', type=date_argument,
+                          help="only entries on or after this YYYYMMDD date")
+    reporter.add_argument('--to', dest='end', type=date_argument,
+                          help="only entries on or before this YYYYMMDD date")
+    reporter.add_argument('--no-percentiles', dest='percentiles',
+                          action='store_false',
+                          help="totals and averages only, added up from "
+                               "the daily totals where possible")
+    reporter.set_defaults(func=report)
+
+    histogrammer = commands.add_parser(
+        'histogram', help="print entries per band of minutes as JSON lines")
+    histogrammer.add_argument('--width', type=positive_argument, default=60,
+                              help="minutes per band (default: 60)")
+    histogrammer.add_argument('--from', dest='start', type=date_argument,
+                              help="only entries on or after this "
+                                   "YYYYMMDD date")
+    histogrammer.add_argument('--to', dest='end', type=date_argument,
+                              help="only entries on or before this "
+                                   "YYYYMMDD date")
+    histogrammer.set_defaults(func=histogram)
+
+    totaller = commands.add_parser(
+        'daily-totals', help="verify the daily totals reports add up "
+                             "against the entries, or rebuild them")
+    totaller.add_argument('action', choices=['verify', 'rebuild'])
+    totaller.set_defaults(func=daily_totals)
+    return parser
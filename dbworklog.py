@@ -6,17 +6,71 @@ Database Worklog
 
 from collections import OrderedDict
 import datetime
+import re
 import sys
 import time
 
+import cache
+import cli
+import instrument
 import models
+import query
+import reports
+import terminal
+import transfer
 import utils
 
 from utils import fmt
 
 
+class Navigate(Exception):
+    """Raised by a menu option to move to another menu.
+
+    Menu.menu_loop catches it and calls its apply(stack) to change its
+    stack of open menus, so going from menu to menu never nests calls.
+    Each kind of move is a subclass defining apply.
+    """
+
+
+class Open(Navigate):
+    """Open a menu on top of the current one."""
+
+    def __init__(self, menu):
+        super().__init__(menu)
+        self.menu = menu
+
+    def apply(self, stack):
+        stack.append(self.menu)
+
+
+class Back(Navigate):
+    """Go back to the nearest open menu of a class, or open a new one."""
+
+    def __init__(self, menu_class):
+        super().__init__(menu_class)
+        self.menu_class = menu_class
+
+    def apply(self, stack):
+        while stack and not isinstance(stack[-1], self.menu_class):
+            stack.pop()
+        if not stack:
+            stack.append(self.menu_class())
+
+
+class Restart(Navigate):
+    """Close every menu and start again from a new one."""
+
+    def __init__(self, menu):
+        super().__init__(menu)
+        self.menu = menu
+
+    def apply(self, stack):
+        stack[:] = [self.menu]
+
+
 class Menu:
     """Menu template"""
+    show_total = False
 
     def __init__(self, menu=None, heading=None):
         self.menu = menu
@@ -28,10 +82,13 @@ class Menu:
         func()
 
     def menu_loop(self):
-        """Show the menu."""
+        """Show the menu, and the menus its options lead to, until quit."""
+        stack = [self]
         while True:
-            func = self._loop()
-            self._run(func)
+            try:
+                self._run(stack[-1]._loop())
+            except Navigate as move:
+                move.apply(stack)
 
     def _loop(self):
         self._print_heading()
@@ -40,13 +97,31 @@ class Menu:
 
     def _print_heading(self):
         """Display the heading"""
-        utils.clear()
-        print(self.heading)
+        screen = terminal.renderer()
+        screen.clear()
+        screen.line(self.heading)
+        if self.show_total:
+            screen.line("{} entries logged".format(utils.count_tasks()))
+
+    @staticmethod
+    def _export(results):
+        """Ask for a file name and export results to it."""
+        while True:
+            path = input("Export to (.csv, .jsonl or .wlc file):  ")
+            try:
+                stats = transfer.export_results(results, path)
+            except (OSError, ValueError) as err:
+                print("{}  Try again.".format(err))
+            else:
+                print("Exported {} entries to {}.".format(
+                    stats['exported'], path))
+                time.sleep(1)
+                return
 
     def _print_info(self):
         """Print menu options info."""
-        for k, v in self.menu.items():
-            print('{} - {}'.format(k, v.__doc__))
+        terminal.renderer().lines('{} - {}'.format(k, v.__doc__)
+                                  for k, v in self.menu.items())
 
     def _choose_option(self):
         """Make choice among menu options."""
@@ -58,6 +133,7 @@ class Menu:
 
 class MainMenu(Menu):
     """Main menu"""
+    show_total = True
 
     def __init__(self):
         super().__init__(
@@ -76,17 +152,15 @@ class MainMenu(Menu):
     @staticmethod
     def search_menu():
         """Search entries."""
-        SearchMenu().menu_loop()
-#        search_menu()
+        raise Open(SearchMenu())
 
     @staticmethod
     def quit():
         """Quit."""
+        instrument.print_summary()
         utils.quit()
 
 
-
-
 class ReducedMainMenu(Menu):
     """Main menu without search menu because db is empty"""
 
@@ -102,16 +176,18 @@ class ReducedMainMenu(Menu):
         """Add an entry."""
         dict = utils.enter_task()
         utils.create_task(dict)
-        MainMenu().menu_loop()
+        raise Restart(MainMenu())
 
     @staticmethod
     def quit():
         """Quit."""
+        instrument.print_summary()
         utils.quit()
 
 
 class SearchMenu(Menu):
     """Result menu"""
+    show_total = True
 
     def __init__(self):
         super().__init__(
@@ -121,24 +197,42 @@ class SearchMenu(Menu):
                 ('r', self.find_date_range),
                 ('t', self.find_time_spent),
                 ('s', self.find_search_term),
+                ('c', self.find_combined),
+                ('p', self.report),
+                ('x', self.export),
                 ('m', self.main_menu)]),
             "Search Menu")
 
     @staticmethod
     def main_menu():
         """Go to main menu."""
-        MainMenu().menu_loop()
+        raise Back(MainMenu)
+
+    def _find_employees(self):
+        """Get the employees whose names start with what the user types,
+        or failing that look like it."""
+        while True:
+            name = input("Enter employee name, or its start "
+                         "(Enter for everyone):  ").strip()
+            employees = (utils.find_employees_by_prefix(name) or
+                         utils.find_similar_employees(name))
+            if employees:
+                return employees
+            print("No employee matches.  Try again.")
 
     def _employee_ids(self):
         """Get employee ids relating to ids in database"""
-        employees = utils.find_unique_employees()
-        employee = utils.item_table(employees, "Employees")
-        return utils.find_by_employee(employee)
+        employees = self._find_employees()
+        if len(employees) == 1:
+            employee = employees[0]
+        else:
+            employee = utils.item_table(employees, "Employees")
+        return utils.find_by_employee(utils.choose_employee(employee))
 
-    def _show_results(self, ids):
+    def _show_results(self, results):
         """Show results menu or tell the user there is no entries."""
-        if ids:
-            ResultMenu(ids).menu_loop()
+        if results:
+            raise Open(ResultMenu(results))
         else:
             print("No entries.")
             time.sleep(1)
@@ -188,22 +282,39 @@ class SearchMenu(Menu):
         ids = self._get_dates_ids()
         self._show_results(ids)
 
+    # answers to _get_time_spent: (least, most, top) for each pattern
+    MINUTES = [
+        (re.compile(r'^(\d+)$'), lambda n: (n, n, None)),
+        (re.compile(r'^(\d+)-(\d+)$'), lambda low, high: (low, high, None)),
+        (re.compile(r'^>=(\d+)$'), lambda n: (n, None, None)),
+        (re.compile(r'^<=(\d+)$'), lambda n: (None, n, None)),
+        (re.compile(r'^top([1-9]\d*)$'), lambda n: (None, None, n)),
+    ]
+
     def _get_time_spent(self):
-        """Get minutes from user."""
+        """Get minutes from user: exactly, a range, a bound or top N.
+
+        Returns the least and most minutes, None where unbounded, and
+        how many of the longest tasks to keep, None for all of them.
+        """
         while True:
-            minutes = input("Enter minutes:  ")
-            try:
-                minutes = int(minutes)
-            except Exception:
-                print("Try again.")
-                continue
-            else:
-                return minutes
+            answer = str(input("Enter minutes (240, 30-90, >=240, <=15 "
+                               "or top 10):  ")).lower().replace(' ', '')
+            for pattern, bounds in self.MINUTES:
+                match = pattern.match(answer)
+                if match:
+                    return bounds(*map(int, match.groups()))
+            print("Try again.")
 
     def _time_spent_ids(self):
         """Get time spent ids relating to ids in database"""
-        minutes = self._get_time_spent()
-        return utils.find_by_time_spent(minutes)
+        least, most, top = self._get_time_spent()
+        if top is None and least == most:
+            return utils.find_by_time_spent(least)
+        search = query.Search().minutes(least, most)
+        if top is not None:
+            search = search.longest(top)
+        return search.results()
 
     def find_time_spent(self):
         """Find by minutes spent."""
@@ -212,48 +323,136 @@ class SearchMenu(Menu):
 
     def _search_term_ids(self):
         """Obtain search term ids relating to ids in database"""
-        query = input("Enter search term:  ")
-        return utils.find_by_search_term(query)
+        query = input('Enter search term ("quote" phrases):  ')
+        return utils.find_by_full_text(query)
 
     def find_search_term(self):
         """Find by search term."""
         ids = self._search_term_ids()
         self._show_results(ids)
 
+    def _get_optional_minutes(self, question):
+        """Get minutes, or None if the user just presses Enter."""
+        while True:
+            minutes = input(question).strip()
+            if not minutes:
+                return None
+            try:
+                return int(minutes)
+            except ValueError:
+                print("Try again.")
+
+    def _combined_search(self):
+        """Ask for each criterion in turn, skipping those left blank."""
+        search = query.Search()
+        employee = input("Enter employee (Enter for any):  ").strip()
+        if employee:
+            search = search.for_employee(employee)
+        search = search.between(
+            self._get_optional_date(
+                "Enter start date (YYYYMMDD) or press Enter for any:  "),
+            self._get_optional_date(
+                "Enter end date (YYYYMMDD) or press Enter for any:  "))
+        search = search.minutes(
+            self._get_optional_minutes(
+                "Enter least minutes (Enter for any):  "),
+            self._get_optional_minutes(
+                "Enter most minutes (Enter for any):  "))
+        term = input('Enter search term ("quote" phrases, '
+                     'Enter for any):  ').strip()
+        if term:
+            search = search.matching(term)
+        return search
+
+    def find_combined(self):
+        """Find by several criteria at once."""
+        search = self._combined_search()
+        if query.DEBUG:
+            terminal.renderer().lines(search.explain())
+            input("Press Enter to see the results.  ")
+        self._show_results(search.results())
+
+    def _get_optional_date(self, question):
+        """Get a date, or None if the user just presses Enter."""
+        while True:
+            date = input(question).strip()
+            if not date:
+                return None
+            try:
+                return datetime.datetime.strptime(date, fmt).date()
+            except ValueError:
+                print("Try again.")
+
+    def report(self):
+        """Report time spent."""
+        by = utils.item_table(list(reports.GROUPS) + ['minutes histogram'],
+                              "Report by")
+        width = None
+        while by == 'minutes histogram' and not width:
+            width = self._get_optional_minutes(
+                "Enter band width in minutes (Enter for 60):  ")
+            if width is None:
+                width = 60
+            elif width < 1:
+                print("Try again.")
+                width = None
+        start = self._get_optional_date(
+            "Enter start date (YYYYMMDD) or press Enter for all:  ")
+        end = self._get_optional_date(
+            "Enter end date (YYYYMMDD) or press Enter for all:  ")
+        screen = terminal.renderer()
+        screen.clear()
+        if width:
+            screen.lines(reports.histogram_lines(
+                reports.minutes_histogram(width, start, end)))
+        else:
+            screen.lines(reports.report_lines(
+                reports.report(by, start, end), by))
+        input("Press Enter to continue.  ")
+
+    def export(self):
+        """Export all entries."""
+        self._export(utils.find_all())
+
 
 class ResultMenu(Menu):
     """Result menu"""
 
-    def __init__(self, ids):
+    def __init__(self, results):
         super().__init__(
             OrderedDict([
                 ('n', self.next),
                 ('p', self.prev),
                 ('e', self.edit),
                 ('d', self.delete),
+                ('a', self.delete_all),
+                ('r', self.reassign_all),
+                ('t', self.shift_all),
+                ('x', self.export),
                 ('s', self.search_menu),
                 ('m', self.main_menu)]),
             "Result Menu")
-        self.ids = ids
+        self.results = results
         self.index = 0
+        self.cache = cache.PageCache(results)
 
     @staticmethod
     def search_menu():
         """Go to search menu."""
-        SearchMenu().menu_loop()
+        raise Back(SearchMenu)
 
     @staticmethod
     def main_menu():
         """Go to main menu."""
-        MainMenu().menu_loop()
+        raise Back(MainMenu)
 
     @staticmethod
     def reduced_main_menu():
-        ReducedMainMenu().menu_loop()
+        raise Restart(ReducedMainMenu())
 
     def check(self):
-        """Check if no ids left or database is empty."""
-        if not self.ids:
+        """Check if no results left or database is empty."""
+        if not self.results:
             if not utils.test_empty_database():
                 self.search_menu()
             else:
@@ -263,17 +462,17 @@ class ResultMenu(Menu):
         """Show the result menu."""
         self.check()
         self._print_heading()
-        print(str(self))
+        terminal.renderer().line(str(self))
         self._print_info()
         return self._choose_option()
 
     def __len__(self):
-        return len(self.ids)
+        return len(self.results)
 
     def __str__(self):
         """Display a result including
         employee, task, minutes, notes, and date."""
-        task = utils.get_task(self.ids[self.index])
+        task = self.cache.get(self.index)
         return """
 Entry {} out of {}
 
@@ -284,8 +483,8 @@ Notes:     {}
 Date:      {}
 """.format(self.index + 1,
            len(self),
-            task.employee,
-            task.taskname,
+            task.employee.name,
+            task.taskname.name,
             task.minutes,
             task.notes,
             task.date.strftime(fmt))
@@ -308,20 +507,77 @@ Date:      {}
              minutes=None,
              notes=None,
              date=None):
-        """Edit current task."""
-        old_id = self.ids[self.index]
+        """Edit current task.
+
+        The results are searched again afterwards: the edit can move
+        the task out of the search that found it, or within its order.
+        """
+        old_id = self.cache.get(self.index).id
         new_task = utils.enter_task()
         utils.save_task(old_id, new_task)
+        self.results.recount()
+        self.cache.clear()
+        self.index = min(self.index, max(0, len(self) - 1))
+        self.check()
+
+    def export(self):
+        """Export these results."""
+        self._export(self.results)
 
     def delete(self):
         """Delete current task."""
-        utils.delete_task(self.ids[self.index])
-        del self.ids[self.index]
+        utils.delete_task(self.cache.get(self.index).id)
+        self.results.discard()
+        self.cache.remove(self.index)
         # if deleting last one, loop around
         # otherwise, maintain index
         if self.index >= len(self):
             self.index = 0
 
+    def _change_all(self, question, change, done):
+        """Apply change to every result at once, once the user agrees.
+
+        The results are searched again afterwards: a change can take
+        tasks out of the search that found them.
+        """
+        answer = input("{} all {} entries? [y/N]  ".format(
+            question, len(self))).strip().lower()
+        if answer != 'y':
+            return
+        with models.db.atomic(utils.WRITE):
+            count = change(self.results)
+        print("{} {} entries.".format(done, count))
+        time.sleep(1)
+        self.results.recount()
+        self.cache.clear()
+        self.index = 0
+        self.check()
+
+    def delete_all(self):
+        """Delete all of these entries."""
+        self._change_all("Delete", utils.delete_results, "Deleted")
+
+    def reassign_all(self):
+        """Give all of these entries to another employee."""
+        employee = utils.choose_employee(utils.enter_employee())
+        self._change_all(
+            "Give {}".format(getattr(employee, 'name', employee)),
+            lambda results: utils.reassign_results(results, employee),
+            "Reassigned")
+
+    def shift_all(self):
+        """Move the dates of all of these entries."""
+        while True:
+            try:
+                days = int(input("Move by how many days (- for earlier)?  "))
+                break
+            except ValueError:
+                print("Try again.")
+        self._change_all(
+            "Move by {} days".format(days),
+            lambda results: utils.shift_results(results, days),
+            "Moved")
+
 
 def run():
     models.initialize()
@@ -331,5 +587,17 @@ def run():
         ReducedMainMenu().menu_loop()
 
 
+def main(argv=None):
+    args = cli.parser().parse_args(argv)
+    if args.profile or instrument.PROFILE:
+        instrument.enable()
+    if args.command is None:
+        run()
+    else:
+        models.initialize()
+        args.func(args)
+        instrument.print_summary()
+
+
 if __name__ == '__main__':
-    run()
+    main()
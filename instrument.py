@@ -0,0 +1,293 @@
+"""
+instrument.py
+-------------
+Opt-in timing of the work log's database work.
+
+While enabled, every utils finder and get_task, create_task,
+create_tasks, save_task and delete_task call is timed, and so is every SQL
+statement peewee runs.  Finders return lazy result sets, whose queries
+run later, so those are timed as each result set counts its matches
+and fetches a page, under the finder's name.  Each gets a latency
+histogram and a count of rows; anything slower than a threshold is also
+written to a rotating slow query log, with ids and field names but no
+task text.  Set WORKLOG_PROFILE to enable it for a session, and
+a summary is printed on quit:
+
+    WORKLOG_PROFILE=1 WORKLOG_SLOW_MS=50 python dbworklog.py
+
+Tests and benchmarks can record a block instead:
+
+    with instrument.recording() as recorder:
+        utils.find_by_employee('beth')
+    print(recorder.summary())
+"""
+
+import bisect
+import contextlib
+import datetime
+import functools
+import logging
+import logging.handlers
+import os
+import sys
+import threading
+import time
+
+import models
+import results
+import utils
+
+
+# time every run, as --profile does for a single one
+PROFILE = bool(os.environ.get('WORKLOG_PROFILE'))
+SLOW_LOG = 'slow_queries.log'
+# upper bounds of the histogram buckets, in milliseconds
+BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000,
+           2500, 5000, 10000, float('inf'))
+UTILS_CALLS = ('get_task', 'create_task', 'create_tasks', 'save_task',
+               'delete_task')
+# the result set methods that query, and what they are timed as
+RESULT_CALLS = {'__len__': 'count', '__bool__': 'exists', 'after': 'page',
+                'before': 'page', 'at': 'page'}
+
+slow_log = logging.getLogger('worklog.slow')
+
+
+class Timings:
+    """Count, total, worst and histogram of one call's latencies."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.worst = 0.0
+        self.rows = 0
+        self.buckets = [0] * len(BUCKETS)
+
+    def add(self, seconds, rows):
+        self.count += 1
+        self.seconds += seconds
+        self.worst = max(self.worst, seconds)
+        self.rows += rows or 0
+        self.buckets[bisect.bisect_left(BUCKETS, seconds * 1000)] += 1
+
+    def percentile(self, share):
+        """Return the bucket bound share of the latencies fall within."""
+        wanted, seen = share * self.count, 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= wanted:
+                return min(bound, self.worst * 1000)
+        return self.worst * 1000
+
+
+class Recorder:
+    """Timings of calls and statements, by name."""
+
+    def __init__(self, slow_ms=100):
+        self.slow_ms = slow_ms
+        self.timings = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, rows=None, detail=None):
+        """Add a latency, and log it if it was slow."""
+        with self._lock:
+            timings = self.timings.get(name)
+            if timings is None:
+                timings = self.timings[name] = Timings()
+            timings.add(seconds, rows)
+        if seconds * 1000 >= self.slow_ms:
+            slow_log.warning('%.1fms rows=%s %s %s', seconds * 1000, rows,
+                             name, detail or '')
+
+    def summary(self, limit=15):
+        """Lay out the timings that took longest in total as lines."""
+        lines = ['{:<44} {:>7} {:>10} {:>9} {:>9} {:>9} {:>8}'.format(
+            'call or statement', 'count', 'total ms', 'mean ms', 'p95 ms',
+            'max ms', 'rows')]
+        with self._lock:
+            ranked = sorted(self.timings.items(),
+                            key=lambda item: item[1].seconds, reverse=True)
+        for name, timings in ranked[:limit]:
+            lines.append('{:<44} {:>7} {:>10.1f} {:>9.3f} {:>9.3f} '
+                         '{:>9.3f} {:>8}'.format(
+                             ' '.join(name.split())[:44], timings.count,
+                             timings.seconds * 1000,
+                             timings.seconds * 1000 / timings.count,
+                             timings.percentile(0.95),
+                             timings.worst * 1000, timings.rows))
+        return lines
+
+
+def _describe(values):
+    """Describe call arguments or SQL parameters for the slow log.
+
+    Numbers, dates and row ids are kept; a task dict is reduced to its
+    field names and text to its length, so no notes reach the log.
+    """
+    described = []
+    for value in values or ():
+        if isinstance(value, (bool, int, float, datetime.date)):
+            described.append(repr(value))
+        elif isinstance(value, models.Model):
+            described.append('{}#{}'.format(type(value).__name__,
+                                            value.get_id()))
+        elif isinstance(value, dict):
+            described.append('dict({})'.format(', '.join(map(str, value))))
+        elif isinstance(value, (str, bytes)):
+            described.append('{}[{}]'.format(type(value).__name__,
+                                             len(value)))
+        elif isinstance(value, (list, tuple)):
+            described.append('{} of {}'.format(type(value).__name__,
+                                               len(value)))
+        else:
+            described.append(type(value).__name__)
+    return '({})'.format(', '.join(described))
+
+
+def _rows(result):
+    """Count the rows a call returned, where that costs nothing."""
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    return None
+
+
+def _timed_call(recorder, name, func):
+    @functools.wraps(func)
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+        if isinstance(result, results.ResultSet):
+            result.finder = name  # timed as it runs its queries
+        else:
+            recorder.record(name, seconds, _rows(result), _describe(args))
+        return result
+    return timed
+
+
+# statements run on this thread, and whether a result set call is
+# already being timed, so calls it makes itself are not counted twice
+_local = threading.local()
+
+
+def _timed_result_call(recorder, kind, method):
+    @functools.wraps(method)
+    def timed(self, *args, **kwargs):
+        finder = getattr(self, 'finder', None)
+        if finder is None or getattr(_local, 'timing', False):
+            return method(self, *args, **kwargs)
+        statements = getattr(_local, 'statements', 0)
+        _local.timing = True
+        start = time.perf_counter()
+        try:
+            result = method(self, *args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            _local.timing = False
+        if getattr(_local, 'statements', 0) > statements:  # not cached
+            rows = len(result) if kind == 'page' else (
+                result if kind == 'count' else None)
+            recorder.record('{} {}'.format(finder, kind), seconds, rows,
+                            _describe(args))
+        return result
+    return timed
+
+
+def _timed_sql(recorder, execute_sql):
+    @functools.wraps(execute_sql)
+    def timed(sql, params=None, *args, **kwargs):
+        start = time.perf_counter()
+        cursor = execute_sql(sql, params, *args, **kwargs)
+        seconds = time.perf_counter() - start
+        _local.statements = getattr(_local, 'statements', 0) + 1
+        # SQLite only knows the rows a statement changed, not selected
+        rows = cursor.rowcount if cursor.rowcount >= 0 else None
+        recorder.record(sql, seconds, rows, _describe(params))
+        return cursor
+    return timed
+
+
+def _result_classes():
+    """Return ResultSet and every subclass of it."""
+    classes = [results.ResultSet]
+    for cls in classes:
+        classes.extend(cls.__subclasses__())
+    return classes
+
+
+_recorder = None
+_originals = {}
+
+
+def enabled():
+    """Tell whether calls are being recorded."""
+    return _recorder is not None
+
+
+def enable(slow_ms=None, log_path=None):
+    """Start recording; return the Recorder the timings go to.
+
+    slow_ms defaults to WORKLOG_SLOW_MS, or 100, and the slow query
+    log to SLOW_LOG, kept to three files of a megabyte each.
+    """
+    global _recorder
+    if _recorder is not None:
+        raise RuntimeError("instrumentation is already enabled")
+    if slow_ms is None:
+        slow_ms = float(os.environ.get('WORKLOG_SLOW_MS', 100))
+    _recorder = Recorder(slow_ms)
+    handler = logging.handlers.RotatingFileHandler(
+        log_path or SLOW_LOG, maxBytes=2 ** 20, backupCount=3, delay=True)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    slow_log.addHandler(handler)
+    slow_log.setLevel(logging.WARNING)
+    slow_log.propagate = False
+    names = [name for name in vars(utils) if name.startswith('find_')]
+    for name in names + list(UTILS_CALLS):
+        _originals[name] = getattr(utils, name)
+        setattr(utils, name, _timed_call(
+            _recorder, 'utils.{}'.format(name), _originals[name]))
+    for cls in _result_classes():
+        for name, kind in RESULT_CALLS.items():
+            if name in vars(cls):
+                _originals[cls, name] = vars(cls)[name]
+                setattr(cls, name, _timed_result_call(
+                    _recorder, kind, _originals[cls, name]))
+    models.db.execute_sql = _timed_sql(_recorder, models.db.execute_sql)
+    return _recorder
+
+
+def disable():
+    """Stop recording; return the Recorder the timings went to."""
+    global _recorder
+    recorder, _recorder = _recorder, None
+    for name, func in _originals.items():
+        if isinstance(name, tuple):
+            cls, method = name
+            setattr(cls, method, func)
+        else:
+            setattr(utils, name, func)
+    _originals.clear()
+    vars(models.db).pop('execute_sql', None)
+    for handler in list(slow_log.handlers):
+        slow_log.removeHandler(handler)
+        handler.close()
+    return recorder
+
+
+@contextlib.contextmanager
+def recording(slow_ms=None, log_path=None):
+    """Record the calls made inside the block."""
+    recorder = enable(slow_ms, log_path)
+    try:
+        yield recorder
+    finally:
+        disable()
+
+
+def print_summary(stream=None):
+    """Print the summary of what has been recorded, if anything has."""
+    if _recorder is not None:
+        print('\n'.join(_recorder.summary()), file=stream or sys.stderr)
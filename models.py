@@ -7,30 +7,743 @@ minutes spent working on it, and any additional notes I want
 to record.
 """
 
+import atexit
 import datetime
+import os
+import zlib
 
 from peewee import *
+from peewee import FieldAccessor
+from playhouse.pool import PooledSqliteDatabase
+from playhouse.sqlite_ext import FTS5Model, SearchField
 
 
-db = SqliteDatabase('tasks.db')
+DATABASE = 'tasks.db'
+# Settings for a work log many people write to at once.  In WAL mode
+# readers carry on while someone writes, and a writer kept waiting by
+# another retries for busy_timeout milliseconds before giving up with
+# "database is locked".
+PRAGMAS = {
+    'busy_timeout': 10000,
+    'journal_mode': 'wal',
+    'synchronous': 'normal',  # with WAL, loses nothing on a process crash
+    'cache_size': -64000,  # negative means KiB: 64 MB of page cache
+    'mmap_size': 268435456,  # read through 256 MB of memory mapping
+}
 
 
-class Task(Model):
+# Notes of at least this many bytes, such as pasted logs, are stored
+# zlib-compressed; 0 stores every note as text.
+COMPRESS_NOTES_AT = int(os.environ.get('WORKLOG_COMPRESS_NOTES', 2048))
+
+
+def settings(environ=os.environ):
+    """Return the database file and pragmas to use.
+
+    WORKLOG_DB names the file, and WORKLOG_PRAGMAS changes pragmas as
+    comma separated name=value pairs, e.g. "mmap_size=0,cache_size=-2000".
+    """
+    pragmas = dict(PRAGMAS)
+    for pair in environ.get('WORKLOG_PRAGMAS', '').split(','):
+        name, _, value = pair.partition('=')
+        if name.strip():
+            pragmas[name.strip().lower()] = value.strip()
+    return environ.get('WORKLOG_DB', DATABASE), pragmas
+
+
+# Connections are pooled and shared between threads, so the page
+# cache's prefetch threads reuse them instead of opening their own.
+db = PooledSqliteDatabase(None, max_connections=16, stale_timeout=300)
+
+
+def configure(database=None, pragmas=None):
+    """Point db at a database file, by default the one settings() gives.
+
+    Pooled connections to the previous file are closed first.
+    """
+    default_database, default_pragmas = settings()
+    pragmas = default_pragmas if pragmas is None else pragmas
+    if not db.deferred:
+        db.close()
+        db.close_all()
+    db.init(database or default_database, pragmas=pragmas,
+            timeout=int(pragmas.get('busy_timeout', 5000)) / 1000,
+            check_same_thread=False)
+
+
+configure()
+# close idle connections on the way out, so the WAL is checkpointed
+atexit.register(db.close_all)
+
+
+def unpack_notes(packed):
+    """Return notes stored compressed as text; None stays None."""
+    if packed is None:
+        return None
+    return zlib.decompress(packed).decode('utf-8')
+
+
+def pack_notes(notes):
+    """Return the notes and notes_zip values to store notes with.
+
+    Notes of COMPRESS_NOTES_AT bytes or more go to notes_zip
+    compressed, leaving notes empty.
+    """
+    data = notes.encode('utf-8')
+    if COMPRESS_NOTES_AT and len(data) >= COMPRESS_NOTES_AT:
+        packed = zlib.compress(data)
+        if len(packed) < len(data):
+            return {'notes': '', 'notes_zip': packed}
+    return {'notes': notes, 'notes_zip': None}
+
+
+# Searches in this process decompress notes with unpack_notes() in SQL.
+# The schema never calls it, so other SQLite clients can still write.
+db.register_function(unpack_notes, 'unpack_notes', 1, deterministic=True)
+
+
+class NotesAccessor(FieldAccessor):
+    """Read a task's notes from notes_zip when they are kept there.
+
+    Rows hold the compressed bytes; they are decompressed each time
+    the notes are read, and only then.
+    """
+
+    def __get__(self, instance, instance_type=None):
+        if instance is None:
+            return self.field
+        packed = instance.__data__.get('notes_zip')
+        if packed is not None:
+            return unpack_notes(packed)
+        return instance.__data__.get(self.name)
+
+
+class NotesField(TextField):
+    """Task notes, read back from notes_zip when stored compressed"""
+    accessor_class = NotesAccessor
+
+
+class TriggerMixin:
+    """Create and drop a model's triggers along with its table.
+
+    `triggers` maps trigger names to their CREATE TRIGGER statements.
+    """
+    triggers = {}
+
+    @classmethod
+    def create_table(cls, safe=True, **options):
+        """Create the table, then the triggers that write to it."""
+        super().create_table(safe, **options)
+        for trigger in cls.triggers.values():
+            cls._meta.database.execute_sql(trigger)
+
+    @classmethod
+    def drop_table(cls, safe=True, **options):
+        """Drop the triggers before the table they write to."""
+        for name in cls.triggers:
+            cls._meta.database.execute_sql(
+                'DROP TRIGGER IF EXISTS {}'.format(name))
+        super().drop_table(safe, **options)
+
+
+class NamedMixin:
+    """Find a model's rows by their `name`, adding any that are missing."""
+
+    @classmethod
+    def named(cls, name):
+        """Return the row called name, creating one if none is.
+
+        Given a row, return it: callers that know which of several
+        namesakes they mean pass that one.
+        """
+        if isinstance(name, cls):
+            return name
+        row = cls.select().where(cls.name == name).order_by(cls.id).first()
+        return row or cls.create(name=name)
+
+    @classmethod
+    def ids(cls, names):
+        """Map each of names to a row id, as named() would."""
+        names = set(names)
+        ids = {name: name.id for name in names if isinstance(name, cls)}
+        # a row per name: one pass over the table beats a query a name
+        for name, first in cls.select(cls.name, fn.MIN(cls.id)).group_by(
+                cls.name).tuples():
+            if name in names:
+                ids[name] = first
+        for name in names - set(ids):
+            ids[name] = cls.create(name=name).id
+        return ids
+
+
+class Employee(NamedMixin, Model):
+    """Employee Model; two employees may share a name"""
+    name = CharField(max_length=100, index=True)
+
+    class Meta:
+        database = db
+
+
+# Names match exactly, but prefix lookups ignore case: "be" finds Ben
+# and Beth.  Meta.indexes cannot name an index over an expression.
+Employee.add_index(Employee.index(Employee.name.collate('NOCASE'),
+                                  name='employee_name_nocase'))
+
+
+class TaskName(NamedMixin, Model):
+    """Task names, each stored once, with how often and lately it is used"""
+    name = CharField(max_length=100, unique=True)
+    # a default in the schema too, for names added by plain SQL
+    uses = IntegerField(default=0, constraints=[SQL('DEFAULT 0')])
+    last_used = DateField(null=True)
+
+    class Meta:
+        database = db
+        table_name = 'task_name'
+
+    @classmethod
+    def recount(cls):
+        """Recompute every name's uses and last use from the task table."""
+        cls.update(
+            uses=Task.select(fn.COUNT(Task.id)).where(Task.taskname == cls.id),
+            last_used=Task.select(fn.MAX(Task.date)).where(
+                Task.taskname == cls.id)).execute()
+
+
+class Task(TriggerMixin, Model):
     """Task Model"""
-    employee = CharField(max_length=100)
-    taskname = CharField(max_length=100)
+    employee = ForeignKeyField(Employee, backref='tasks', index=False)
+    taskname = ForeignKeyField(TaskName, backref='tasks', index=False)
     minutes = IntegerField(.0)
-    notes = TextField(default='')
-    date = DateTimeField()  # need a date like 2018-11-16 rather than a timestamp
+    notes = NotesField(default='')
+    date = DateField()
+    # large notes, zlib-compressed by pack_notes(); notes is empty then
+    notes_zip = BlobField(null=True)
+
+    # A task name's uses and last use follow every write to task.  The
+    # last use is looked up again when a task leaves a name, from the
+    # (taskname, date) index.
+    triggers = {
+        'task_name_insert': """
+            CREATE TRIGGER IF NOT EXISTS task_name_insert
+            AFTER INSERT ON task
+            BEGIN
+                UPDATE task_name
+                SET uses = uses + 1,
+                    last_used = max(coalesce(last_used, new.date), new.date)
+                WHERE id = new.taskname_id;
+            END""",
+        'task_name_delete': """
+            CREATE TRIGGER IF NOT EXISTS task_name_delete
+            AFTER DELETE ON task
+            BEGIN
+                UPDATE task_name
+                SET uses = uses - 1,
+                    last_used = (SELECT MAX(date) FROM task
+                                 WHERE taskname_id = old.taskname_id)
+                WHERE id = old.taskname_id;
+            END""",
+        'task_name_update': """
+            CREATE TRIGGER IF NOT EXISTS task_name_update
+            AFTER UPDATE OF taskname_id, date ON task
+            BEGIN
+                UPDATE task_name
+                SET uses = uses - 1,
+                    last_used = (SELECT MAX(date) FROM task
+                                 WHERE taskname_id = old.taskname_id)
+                WHERE id = old.taskname_id;
+                UPDATE task_name
+                SET uses = uses + 1,
+                    last_used = (SELECT MAX(date) FROM task
+                                 WHERE taskname_id = new.taskname_id)
+                WHERE id = new.taskname_id;
+            END""",
+    }
 
     class Meta:
         database = db
+        # one index per search path in utils
+        indexes = (
+            (('employee',), False),
+            (('date', 'id'), False),
+            (('minutes', 'id'), False),
+            (('employee', 'date'), False),
+            (('taskname', 'date'), False),
+        )
+
+    @classmethod
+    def create_table(cls, safe=True, **options):
+        """Create the table, rebuilding an older one that kept names."""
+        if 'employee' in table_columns(cls._meta.table_name):
+            _rebuild_task_table()
+        super().create_table(safe, **options)
+
+
+def table_columns(table):
+    """List the columns a table has in the database; none if it is missing."""
+    return [row[1] for row in db.execute_sql(
+        'PRAGMA table_info("{}")'.format(table))]
+
+
+def _rebuild_task_table():
+    """Rebuild a task table that keeps names as text.
+
+    Older tables keep each task's employee and task name in text
+    columns; the rebuilt one refers to an employee and a task_name row
+    instead, the first of those called that name.  Ids are kept.
+    Dropping the old table drops its triggers and indexes; creating the
+    tables puts them back, and recomputes the full-text index and the
+    daily totals, which were kept by employee name.
+    """
+    with db.atomic():
+        Employee.create_table(safe=True)
+        TaskName.create_table(safe=True)
+        references = {}
+        for column, model in [('employee', Employee),
+                              ('taskname', TaskName)]:
+            table = model._meta.table_name
+            db.execute_sql(
+                'INSERT INTO {0} (name) SELECT DISTINCT {1} FROM task '
+                'WHERE {1} NOT IN (SELECT name FROM {0}) '
+                'ORDER BY {1}'.format(table, column))
+            references[column] = (
+                '(SELECT MIN(id) FROM {} WHERE name = old.{})'.format(
+                    table, column))
+        # renaming the table would point the view at task_old
+        db.execute_sql('DROP VIEW IF EXISTS task_text')
+        db.execute_sql('ALTER TABLE task RENAME TO task_old')
+        for name, in db.execute_sql(
+                "SELECT name FROM sqlite_master WHERE type = 'index' "
+                "AND tbl_name = 'task_old' AND sql IS NOT NULL").fetchall():
+            db.execute_sql('DROP INDEX "{}"'.format(name))
+        Task._schema.create_table()
+        db.execute_sql(
+            'INSERT INTO task (id, employee_id, taskname_id, minutes, notes, '
+            'date) SELECT old.id, {employee}, {taskname}, old.minutes, '
+            'old.notes, old.date FROM task_old AS old'.format(**references))
+        db.execute_sql('DROP TABLE task_old')
+        db.execute_sql('DROP TABLE IF EXISTS task_fts')
+        db.execute_sql('DROP TABLE IF EXISTS daily_total')
+        TaskName.recount()
+
+
+# Task names live in task_name, so the full-text index reads the text
+# it covers through a view joining them back to their tasks.  Tasks
+# with compressed notes are indexed in note_fts instead.
+TASK_TEXT = """
+    CREATE VIEW IF NOT EXISTS task_text AS
+    SELECT task.id AS id, task_name.name AS taskname, task.notes AS notes
+    FROM task JOIN task_name ON task_name.id = task.taskname_id
+    WHERE task.notes_zip IS NULL"""
+
+
+class TaskIndex(TriggerMixin, FTS5Model):
+    """Full-text index over task names and notes, for notes kept as text"""
+    taskname = SearchField()
+    notes = SearchField()
+
+    # Keep task_fts in step with every write to task, whoever makes it.
+    triggers = {
+        'task_fts_insert': """
+            CREATE TRIGGER IF NOT EXISTS task_fts_insert AFTER INSERT ON task
+            WHEN new.notes_zip IS NULL
+            BEGIN
+                INSERT INTO task_fts(rowid, taskname, notes)
+                SELECT new.id, name, new.notes
+                FROM task_name WHERE id = new.taskname_id;
+            END""",
+        'task_fts_delete': """
+            CREATE TRIGGER IF NOT EXISTS task_fts_delete AFTER DELETE ON task
+            WHEN old.notes_zip IS NULL
+            BEGIN
+                INSERT INTO task_fts(task_fts, rowid, taskname, notes)
+                SELECT 'delete', old.id, name, old.notes
+                FROM task_name WHERE id = old.taskname_id;
+            END""",
+        'task_fts_update': """
+            CREATE TRIGGER IF NOT EXISTS task_fts_update
+            AFTER UPDATE OF taskname_id, notes, notes_zip ON task
+            BEGIN
+                INSERT INTO task_fts(task_fts, rowid, taskname, notes)
+                SELECT 'delete', old.id, name, old.notes
+                FROM task_name WHERE id = old.taskname_id
+                AND old.notes_zip IS NULL;
+                INSERT INTO task_fts(rowid, taskname, notes)
+                SELECT new.id, name, new.notes
+                FROM task_name WHERE id = new.taskname_id
+                AND new.notes_zip IS NULL;
+            END""",
+    }
+
+    class Meta:
+        database = db
+        table_name = 'task_fts'
+        depends_on = [Task]
+        options = {'content': 'task_text',
+                   'content_rowid': 'id',
+                   'prefix': [2, 3]}
+
+    @classmethod
+    def create_table(cls, safe=True, **options):
+        """Create the index and its view, filled from the tasks if new."""
+        cls._meta.database.execute_sql(TASK_TEXT)
+        new = not cls.table_exists()
+        super().create_table(safe, **options)
+        if new:
+            cls.rebuild()
+
+    @classmethod
+    def drop_table(cls, safe=True, **options):
+        """Drop the index, then the view it reads."""
+        super().drop_table(safe, **options)
+        cls._meta.database.execute_sql('DROP VIEW IF EXISTS task_text')
+
+
+class NoteChange(Model):
+    """Tasks to add to or take from note_fts, with the text to index"""
+    task_id = IntegerField()
+    taskname = CharField()
+    body = BlobField()
+    added = BooleanField()
+
+    class Meta:
+        database = db
+        table_name = 'note_change'
+
+
+class NoteIndex(TriggerMixin, FTS5Model):
+    """Full-text index over task names and notes, for compressed notes
+
+    Each task is one document, in task_fts or here, so a search finds
+    it the same way whichever way its notes are stored.  SQL cannot
+    read compressed notes, so triggers only queue each task that comes
+    or goes in note_change, whoever makes the change, and catch_up()
+    indexes them.  The index keeps no copy of the text.
+    """
+    taskname = SearchField()
+    notes = SearchField()
+
+    triggers = {
+        'note_change_insert': """
+            CREATE TRIGGER IF NOT EXISTS note_change_insert
+            AFTER INSERT ON task WHEN new.notes_zip IS NOT NULL
+            BEGIN
+                INSERT INTO note_change(task_id, taskname, body, added)
+                SELECT new.id, name, new.notes_zip, 1
+                FROM task_name WHERE id = new.taskname_id;
+            END""",
+        'note_change_delete': """
+            CREATE TRIGGER IF NOT EXISTS note_change_delete
+            AFTER DELETE ON task WHEN old.notes_zip IS NOT NULL
+            BEGIN
+                INSERT INTO note_change(task_id, taskname, body, added)
+                SELECT old.id, name, old.notes_zip, 0
+                FROM task_name WHERE id = old.taskname_id;
+            END""",
+        'note_change_update': """
+            CREATE TRIGGER IF NOT EXISTS note_change_update
+            AFTER UPDATE OF taskname_id, notes_zip ON task
+            WHEN old.notes_zip IS NOT new.notes_zip
+              OR old.taskname_id IS NOT new.taskname_id
+            BEGIN
+                INSERT INTO note_change(task_id, taskname, body, added)
+                SELECT old.id, name, old.notes_zip, 0
+                FROM task_name WHERE id = old.taskname_id
+                AND old.notes_zip IS NOT NULL;
+                INSERT INTO note_change(task_id, taskname, body, added)
+                SELECT new.id, name, new.notes_zip, 1
+                FROM task_name WHERE id = new.taskname_id
+                AND new.notes_zip IS NOT NULL;
+            END""",
+    }
+
+    class Meta:
+        database = db
+        table_name = 'note_fts'
+        depends_on = [Task, NoteChange]
+        options = {'content': "''", 'prefix': [2, 3]}
+
+    @classmethod
+    def create_table(cls, safe=True, **options):
+        """Create the index, filled from the tasks if new."""
+        new = not cls.table_exists()
+        super().create_table(safe, **options)
+        if new:
+            NoteChange.insert_from(
+                Task.select(Task.id, TaskName.name, Task.notes_zip,
+                            True).join(TaskName).where(
+                                Task.notes_zip.is_null(False)),
+                [NoteChange.task_id, NoteChange.taskname, NoteChange.body,
+                 NoteChange.added]).execute()
+            cls.catch_up()
+
+    @classmethod
+    def catch_up(cls, batch=1000):
+        """Index the queued note changes, oldest first; return how many."""
+        change, database = NoteChange, cls._meta.database
+        if not change.select().exists():  # nearly always: nothing to do
+            return 0
+        done = 0
+        with database.atomic('IMMEDIATE'):
+            while True:
+                rows = list(change.select().order_by(change.id).limit(
+                    batch).tuples())
+                if not rows:
+                    return done
+                for _, task_id, taskname, body, added in rows:
+                    # a contentless index is told the text it drops
+                    database.execute_sql(
+                        'INSERT INTO note_fts(rowid, taskname, notes) '
+                        'VALUES (?, ?, ?)'
+                        if added else
+                        "INSERT INTO note_fts(note_fts, rowid, taskname, "
+                        "notes) VALUES ('delete', ?, ?, ?)",
+                        (task_id, taskname, unpack_notes(body)))
+                change.delete().where(change.id <= rows[-1][0]).execute()
+                done += len(rows)
+
+
+class Counter(TriggerMixin, Model):
+    """Row counts kept current by triggers, so totals need no scan"""
+    name = CharField(primary_key=True)
+    value = IntegerField(default=0)
+
+    triggers = {
+        'counter_task_insert': """
+            CREATE TRIGGER IF NOT EXISTS counter_task_insert
+            AFTER INSERT ON task
+            BEGIN
+                UPDATE counter SET value = value + 1 WHERE name = 'task';
+            END""",
+        'counter_task_delete': """
+            CREATE TRIGGER IF NOT EXISTS counter_task_delete
+            AFTER DELETE ON task
+            BEGIN
+                UPDATE counter SET value = value - 1 WHERE name = 'task';
+            END""",
+        # 'task_writes' goes up with every change to task, so caches of
+        # what it holds can tell they are stale, whoever made the change
+        'counter_task_writes_insert': """
+            CREATE TRIGGER IF NOT EXISTS counter_task_writes_insert
+            AFTER INSERT ON task
+            BEGIN
+                UPDATE counter SET value = value + 1
+                WHERE name = 'task_writes';
+            END""",
+        'counter_task_writes_update': """
+            CREATE TRIGGER IF NOT EXISTS counter_task_writes_update
+            AFTER UPDATE ON task
+            BEGIN
+                UPDATE counter SET value = value + 1
+                WHERE name = 'task_writes';
+            END""",
+        'counter_task_writes_delete': """
+            CREATE TRIGGER IF NOT EXISTS counter_task_writes_delete
+            AFTER DELETE ON task
+            BEGIN
+                UPDATE counter SET value = value + 1
+                WHERE name = 'task_writes';
+            END""",
+    }
+
+    class Meta:
+        database = db
+        depends_on = [Task]
+
+    @classmethod
+    def create_table(cls, safe=True, **options):
+        """Create the counters, seeded from the tables they count."""
+        super().create_table(safe, **options)
+        cls.insert_many([
+            {'name': 'task', 'value': Task.select().count()},
+            {'name': 'task_writes', 'value': 0},
+        ]).on_conflict_ignore().execute()
+
+    @classmethod
+    def value_of(cls, name):
+        """Return the current value of a counter."""
+        # plain SQL: menus ask on every redraw, faster than building a query
+        return cls._meta.database.execute_sql(
+            'SELECT value FROM counter WHERE name = ?', (name,)).fetchone()[0]
+
+
+class DailyTotal(TriggerMixin, Model):
+    """Entries and minutes per employee per day, kept current by triggers"""
+    employee = ForeignKeyField(Employee, index=False)
+    day = DateField()
+    entries = IntegerField(default=0)
+    minutes = IntegerField(default=0)
+
+    # A task adds to the total of its employee and day; a day with no
+    # entries left is dropped.  Every write to task goes through these,
+    # in the same transaction as the write itself.
+    triggers = {
+        'daily_total_insert': """
+            CREATE TRIGGER IF NOT EXISTS daily_total_insert
+            AFTER INSERT ON task
+            BEGIN
+                INSERT INTO daily_total(employee_id, day, entries, minutes)
+                VALUES (new.employee_id, date(new.date), 1, new.minutes)
+                ON CONFLICT(employee_id, day) DO UPDATE
+                SET entries = entries + 1,
+                    minutes = minutes + excluded.minutes;
+            END""",
+        'daily_total_delete': """
+            CREATE TRIGGER IF NOT EXISTS daily_total_delete
+            AFTER DELETE ON task
+            BEGIN
+                UPDATE daily_total
+                SET entries = entries - 1, minutes = minutes - old.minutes
+                WHERE employee_id = old.employee_id
+                AND day = date(old.date);
+                DELETE FROM daily_total
+                WHERE employee_id = old.employee_id
+                AND day = date(old.date) AND entries = 0;
+            END""",
+        'daily_total_update': """
+            CREATE TRIGGER IF NOT EXISTS daily_total_update
+            AFTER UPDATE OF employee_id, minutes, date ON task
+            BEGIN
+                UPDATE daily_total
+                SET entries = entries - 1, minutes = minutes - old.minutes
+                WHERE employee_id = old.employee_id
+                AND day = date(old.date);
+                DELETE FROM daily_total
+                WHERE employee_id = old.employee_id
+                AND day = date(old.date) AND entries = 0;
+                INSERT INTO daily_total(employee_id, day, entries, minutes)
+                VALUES (new.employee_id, date(new.date), 1, new.minutes)
+                ON CONFLICT(employee_id, day) DO UPDATE
+                SET entries = entries + 1,
+                    minutes = minutes + excluded.minutes;
+            END""",
+    }
+
+    class Meta:
+        database = db
+        table_name = 'daily_total'
+        depends_on = [Task]
+        primary_key = CompositeKey('employee', 'day')
+
+    @classmethod
+    def from_tasks(cls):
+        """Select the daily totals as the task table has them now."""
+        return Task.select(
+            Task.employee,
+            fn.date(Task.date).alias('day'),
+            fn.COUNT(Task.id).alias('entries'),
+            fn.SUM(Task.minutes).alias('minutes')).group_by(
+                Task.employee, fn.date(Task.date))
+
+    @classmethod
+    def create_table(cls, safe=True, **options):
+        """Create the totals, seeded from the tasks already logged."""
+        super().create_table(safe, **options)
+        if not cls.select().exists():
+            cls.rebuild()
+
+    @classmethod
+    def rebuild(cls):
+        """Recompute every daily total from the task table."""
+        with cls._meta.database.atomic():
+            cls.delete().execute()
+            cls.insert_from(cls.from_tasks(), [
+                cls.employee, cls.day, cls.entries, cls.minutes]).execute()
+
+    @classmethod
+    def mismatches(cls):
+        """Compare the stored totals with the task table.
+
+        Returns the totals the tasks add up to that are not stored, and
+        the stored totals the tasks do not add up to.
+        """
+        stored = cls.select(cls.employee, cls.day, cls.entries, cls.minutes)
+        return (list((cls.from_tasks() - stored).dicts()),
+                list((stored - cls.from_tasks()).dicts()))
+
+
+class ImportProgress(Model):
+    """How many rows of each imported file are already in the database
+
+    `fingerprint` tells the file apart from another one written to the
+    same path since.
+    """
+    source = CharField(primary_key=True)
+    fingerprint = CharField(default='')
+    rows = IntegerField(default=0)
+
+    class Meta:
+        database = db
+        table_name = 'import_progress'
+
+
+# Some SQLite builds ship without FTS5; searches fall back to LIKE there.
+FTS_AVAILABLE = FTS5Model.fts5_installed()
+
+MODELS = [Employee, TaskName, Task, Counter, DailyTotal, ImportProgress]
+if FTS_AVAILABLE:
+    MODELS.extend([TaskIndex, NoteChange, NoteIndex])
+
+
+def _add_task_indexes():
+    """Create the search indexes on a tasks.db made before they existed."""
+    Task._schema.create_indexes(safe=True)
+    db.execute_sql('ANALYZE')
+
+
+def _add_search_index():
+    """Index the tasks that were logged before task_fts existed."""
+    if FTS_AVAILABLE:
+        TaskIndex.rebuild()
+
+
+def _store_task_dates_as_days():
+    """Drop the time of day older versions stored with each task date."""
+    db.execute_sql('UPDATE task SET date = date(date) '
+                   'WHERE date <> date(date)')
+
+
+def _compress_large_notes():
+    """Move the large notes stored before compression into notes_zip."""
+    if not COMPRESS_NOTES_AT:
+        return
+    large = Task.select(Task.id, Task.notes).where(
+        fn.length(Task.notes.cast('BLOB')) >= COMPRESS_NOTES_AT)
+    for task_id, notes in list(large.tuples()):
+        Task.update(**pack_notes(notes)).where(Task.id == task_id).execute()
+    if FTS_AVAILABLE:
+        NoteIndex.catch_up()
+
+
+# Schema migrations, applied in order.  The database remembers how many
+# have run in PRAGMA user_version.
+MIGRATIONS = [
+    _add_task_indexes,
+    _add_search_index,
+    _store_task_dates_as_days,
+    _compress_large_notes,
+]
+
+
+def schema_version():
+    """Return the number of migrations applied to the database."""
+    return db.execute_sql('PRAGMA user_version').fetchone()[0]
+
+
+def migrate():
+    """Apply any migrations the database has not seen yet."""
+    version = schema_version()
+    for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+        with db.atomic():
+            migration()
+            db.execute_sql('PRAGMA user_version = {:d}'.format(number))
 
 
 def initialize():
     """Connect to the database and create tables"""
     db.connect()
-    db.create_tables([Task], safe=True)
+    db.create_tables(MODELS, safe=True)
+    migrate()
 
 
 if __name__ == '__main__':
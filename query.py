@@ -0,0 +1,216 @@
+"""
+query.py
+--------
+Searches that combine criteria: an employee, a date range, a range of
+minutes and a search term, in any mix.
+
+A Search is built up a criterion at a time and runs as one SQL query.
+Before it runs, a small planner picks the criterion that drives it:
+each criterion with an index of its own is probed for up to
+PROBE_ROWS matches, and the one with the fewest is looked up by its
+index while the others are checked against the rows it finds.  The
+results come in the order the driving index keeps them.
+"""
+
+import copy
+import os
+
+from peewee import SQL, NodeList, Tuple
+
+import models
+import results
+import utils
+
+
+# Print the plan of combined searches in the menus.
+DEBUG = bool(os.environ.get('WORKLOG_DEBUG'))
+
+PROBE_ROWS = 1000
+# Access paths, preferred in this order when probes tie, each with the
+# task columns its index covers and the order it gives the results.
+PATHS = ('employee', 'date', 'minutes', 'term')
+INDEXED = {
+    'employee': ('employee', 'date'),  # task_employee_date
+    'date': ('date',),  # task_date_id
+    'minutes': ('minutes',),  # task_minutes_id
+    'term': (),  # task_fts
+    None: (),
+}
+
+
+def unindexed(field):
+    """Return field as an expression SQLite will not use an index for."""
+    return NodeList((SQL('+'), field), glue='')
+
+
+class Search:
+    """Tasks matching every criterion given, built up a criterion at a time.
+
+    Each method returns a new Search, so a partly built one can be
+    reused:
+
+        Search().for_employee('beth').between(start, end).minutes(240)
+    """
+
+    def __init__(self):
+        self.employee = None
+        self.start = None
+        self.end = None
+        self.least = None
+        self.most = None
+        self.term = None
+        self.count = None
+
+    def _with(self, **criteria):
+        search = copy.copy(self)
+        search.__dict__.update(criteria)
+        return search
+
+    def for_employee(self, employee):
+        """Only tasks logged by employee."""
+        return self._with(employee=employee)
+
+    def between(self, start=None, end=None):
+        """Only tasks dated from start through end, either optional."""
+        return self._with(start=start, end=end)
+
+    def on(self, date):
+        """Only tasks on date."""
+        return self.between(date, date)
+
+    def minutes(self, least=None, most=None):
+        """Only tasks that took from least through most minutes."""
+        return self._with(least=least, most=most)
+
+    def matching(self, term):
+        """Only tasks whose task name or notes match a search term."""
+        return self._with(term=term)
+
+    def longest(self, count):
+        """Only the count matching tasks that took longest, longest first."""
+        return self._with(count=count)
+
+    def _expression(self):
+        """The term as an FTS5 MATCH expression, if FTS5 can serve it."""
+        if self.term is None or not models.FTS_AVAILABLE:
+            return ''
+        return utils.match_expression(self.term)
+
+    def paths(self):
+        """List the access paths this search could be driven by."""
+        given = {'employee': self.employee is not None,
+                 'date': self.start is not None or self.end is not None,
+                 'minutes': self.least is not None or self.most is not None,
+                 'term': bool(self._expression())}
+        return [path for path in PATHS if given[path]]
+
+    def _where(self, query, path, only=None):
+        """Add the conditions, indexed only where path's index covers.
+
+        With only, add just the conditions that path's index covers.
+        """
+        task = models.Task
+
+        def column(field):
+            if field.name in INDEXED[path]:
+                return field
+            return unindexed(field)
+
+        def wanted(field):
+            return only is None or field.name in INDEXED[only]
+
+        if self.employee is not None and wanted(task.employee):
+            query = query.where(utils.employee_is(column(task.employee),
+                                                  self.employee))
+        if self.start is not None and wanted(task.date):
+            query = query.where(column(task.date) >= self.start)
+        if self.end is not None and wanted(task.date):
+            query = query.where(column(task.date) <= self.end)
+        if self.least is not None and wanted(task.minutes):
+            query = query.where(column(task.minutes) >= self.least)
+        if self.most is not None and wanted(task.minutes):
+            query = query.where(column(task.minutes) <= self.most)
+        if self.term is not None and only is None and path != 'term':
+            query = query.where(self._term_condition())
+        return query
+
+    def _term_condition(self):
+        """Check the term against one task at a time."""
+        task, expression = models.Task, self._expression()
+        if not expression:
+            return (utils.taskname_contains(task.taskname, self.term) |
+                    utils.notes_contain(task, self.term))
+        return task.id.in_(utils.full_text_hits(expression).select(
+            SQL('task_id')))
+
+    def _probe(self, path):
+        """Count the matches of path's own criteria, up to PROBE_ROWS."""
+        if path == 'term':
+            query = utils.full_text_hits(self._expression())
+        else:
+            query = self._where(models.Task.select(models.Task.id),
+                                path, only=path)
+        return query.limit(PROBE_ROWS).count()
+
+    def plan(self):
+        """Choose the driving access path.
+
+        Returns the path, None when there are no criteria, and the
+        probed match counts; a count of PROBE_ROWS means at least that.
+        """
+        estimates = {path: self._probe(path) for path in self.paths()}
+        if not estimates:
+            return None, estimates
+        path = min(estimates, key=lambda path: (estimates[path],
+                                                PATHS.index(path)))
+        return path, estimates
+
+    def _query(self, path):
+        """Return the query for path and the order it gives results in."""
+        task = models.Task
+        query = self._where(task.select(), path)
+        if path == 'term':
+            best = utils.full_text_hits(self._expression()).alias('best')
+            query = query.join(best, on=(best.c.task_id == task.id))
+            return query, (best.c.rank, task.id)
+        if path == 'minutes':
+            return query, (task.minutes, task.id)
+        return query, (task.date, task.id)
+
+    def _longest(self, query):
+        """Cut query down to its count longest tasks, longest first.
+
+        The last of them is found first, then every task at or above
+        its (minutes, id) is a match, so pages need no OFFSET.
+        """
+        task = models.Task
+        last = query.select(task.minutes, task.id).order_by(
+            task.minutes.desc(), task.id.desc()).offset(
+                self.count - 1).limit(1).tuples().first()
+        if last is not None:
+            query = query.where(Tuple(task.minutes, task.id) >= last)
+        return results.ResultSet(query, (task.minutes, task.id),
+                                 descending=True)
+
+    def results(self):
+        """Run the search as planned, a page at a time."""
+        path, _ = self.plan()
+        query, order = self._query(path)
+        if self.count is not None:
+            return self._longest(query)
+        if path == 'term':
+            return results.RankedResultSet(query, order)
+        return results.ResultSet(query, order)
+
+    def explain(self):
+        """Describe the plan: the path, the probes and SQLite's own plan."""
+        path, estimates = self.plan()
+        query, order = self._query(path)
+        sql, params = query.order_by(*order).sql()
+        lines = ['driving path: {}'.format(path or 'all tasks')]
+        lines.extend('probe {}: {}{} matches'.format(
+            name, count, '+' if count >= PROBE_ROWS else '')
+            for name, count in estimates.items())
+        lines.extend(row[-1] for row in models.db.execute_sql(
+            'EXPLAIN QUERY PLAN ' + sql, params))
+        return lines
@@ -0,0 +1,179 @@
+"""
+reports.py
+----------
+Time reports for managers: how many entries and minutes each
+employee, day, week, month or task name accounts for.
+
+All of the arithmetic, percentiles included, runs as one GROUP BY
+query in SQLite; Python only receives one row per group.  Reports
+without percentiles add up models.DailyTotal, a row per employee per
+day, instead of reading every task.
+"""
+
+import collections
+
+from peewee import SQL, Case, Select, fn
+
+import models
+
+
+GROUPS = {
+    'employee': lambda: models.Task.employee,
+    'taskname': lambda: models.Task.taskname,
+    'day': lambda: fn.strftime('%Y-%m-%d', models.Task.date),
+    'week': lambda: fn.strftime('%Y-W%W', models.Task.date),
+    'month': lambda: fn.strftime('%Y-%m', models.Task.date),
+}
+# the same groups over the daily totals; task names are not kept there
+DAILY_GROUPS = {
+    'employee': lambda: models.DailyTotal.employee,
+    'day': lambda: fn.strftime('%Y-%m-%d', models.DailyTotal.day),
+    'week': lambda: fn.strftime('%Y-W%W', models.DailyTotal.day),
+    'month': lambda: fn.strftime('%Y-%m', models.DailyTotal.day),
+}
+# the groups of ids, and the tables holding the names they stand for
+NAMED_BY = {
+    'employee': lambda: models.Employee,
+    'taskname': lambda: models.TaskName,
+}
+PERCENTILES = (50, 90, 99)
+
+
+def date_bounds(query, field, start=None, end=None):
+    """Limit query to rows whose field falls from start through end."""
+    if start is not None:
+        query = query.where(field >= start)
+    if end is not None:
+        query = query.where(field <= end)
+    return query
+
+
+def daily_report(by='employee', start=None, end=None):
+    """Return entries, total and average minutes per group of daily totals.
+
+    by is one of DAILY_GROUPS.  Costs a row per employee per day in
+    the date bounds, however many entries each day holds.
+    """
+    daily = models.DailyTotal
+    group = DAILY_GROUPS[by]()
+    query = daily.select(
+        group.alias(by),
+        fn.SUM(daily.entries).alias('entries'),
+        fn.SUM(daily.minutes).alias('total'),
+        fn.ROUND(fn.SUM(daily.minutes) * 1.0 / fn.SUM(daily.entries),
+                 1).alias('average'))
+    # totals are kept for whole days, so day bounds need no raw tasks
+    query = date_bounds(query, daily.day, start, end)
+    return _put_names(
+        list(query.group_by(group).order_by(group).dicts()), by)
+
+
+def report(by='employee', start=None, end=None, percentiles=True):
+    """Return entries, total, average and percentiles of minutes per group.
+
+    by is one of GROUPS.  Each row is a dict keyed by the group name,
+    'entries', 'total', 'average' and 'p50', 'p90', 'p99'; a percentile
+    is the smallest minutes value at or above that share of entries.
+    Without percentiles, groups the daily totals keep come from those.
+    """
+    if not percentiles and by in DAILY_GROUPS:
+        return daily_report(by, start, end)
+    task = models.Task
+    group = GROUPS[by]()
+    ranked = date_bounds(task.select(
+        group.alias('grp'),
+        task.minutes,
+        fn.ROW_NUMBER().over(partition_by=[group],
+                             order_by=[task.minutes]).alias('position'),
+        fn.COUNT(task.id).over(partition_by=[group]).alias('size')),
+        task.date, start, end).alias('ranked')
+    percentiles = [
+        fn.MIN(Case(None, [(ranked.c.position * 100 >= ranked.c.size * p,
+                            ranked.c.minutes)])).alias('p{}'.format(p))
+        for p in PERCENTILES] if percentiles else []
+    return _put_names(list(Select([ranked], [
+        ranked.c.grp.alias(by),
+        fn.COUNT(SQL('*')).alias('entries'),
+        fn.SUM(ranked.c.minutes).alias('total'),
+        fn.ROUND(fn.AVG(ranked.c.minutes), 1).alias('average'),
+        *percentiles]).group_by(ranked.c.grp).order_by(
+            ranked.c.grp).bind(models.db).dicts()), by)
+
+
+def _put_names(rows, by):
+    """Put names in place of the employee or task name ids rows are
+    grouped by.
+
+    Namesakes stay apart, each shown with its id; rows come back in
+    order of name.
+    """
+    model = NAMED_BY.get(by)
+    if model is None:
+        return rows
+    model = model()  # a row per person or name: small enough to read
+    names = dict(model.select(model.id, model.name).tuples())
+    shared = collections.Counter(names.values())
+    for row in rows:
+        name = names[row[by]]
+        row[by] = name if shared[name] == 1 else '{} (#{})'.format(
+            name, row[by])
+    return sorted(rows, key=lambda row: row[by])
+
+
+COLUMNS = ['entries', 'total', 'average'] + [
+    'p{}'.format(p) for p in PERCENTILES]
+
+
+def report_lines(rows, by):
+    """Lay report rows out as lines of a table."""
+    width = max([len(by)] + [len(str(row[by])) for row in rows])
+    columns = [column for column in COLUMNS if not rows or column in rows[0]]
+    yield '{:<{}}'.format(by, width) + ''.join(
+        '{:>9}'.format(column) for column in columns)
+    for row in rows:
+        yield '{:<{}}'.format(row[by], width) + ''.join(
+            '{:>9}'.format(row[column]) for column in columns)
+
+
+def minutes_histogram(width=60, start=None, end=None):
+    """Count tasks per band of minutes, width minutes wide.
+
+    Each row is a dict of the band's 'least' and 'most' minutes and
+    its 'entries'; bands without entries are left out.  A width
+    under one minute raises ValueError.
+    """
+    if width < 1:
+        raise ValueError("band width must be at least 1, not {}".format(
+            width))
+    task = models.Task
+    band = task.minutes / width  # integer division in SQLite
+    query = date_bounds(task.select(
+        (band * width).alias('least'),
+        fn.COUNT(task.id).alias('entries')), task.date, start, end)
+    return [{'least': least, 'most': least + width - 1, 'entries': entries}
+            for least, entries in query.group_by(band).order_by(
+                band).tuples()]
+
+
+def histogram_lines(rows, bar_width=50):
+    """Lay histogram rows out as lines of a bar chart."""
+    largest = max([row['entries'] for row in rows] or [1])
+    for row in rows:
+        yield '{:>6}-{:<6} {:>9} {}'.format(
+            row['least'], row['most'], row['entries'],
+            '#' * max(1, round(bar_width * row['entries'] / largest)))
+
+
+def verify_daily_totals():
+    """Return the daily totals that disagree with the task table.
+
+    The first list holds what the tasks add up to, the second what is
+    stored; both are empty when the triggers have kept up.
+    """
+    return models.DailyTotal.mismatches()
+
+
+def rebuild_daily_totals():
+    """Recompute the daily totals; return how many there are."""
+    models.DailyTotal.rebuild()
+    return models.DailyTotal.select().count()
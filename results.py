@@ -0,0 +1,211 @@
+"""
+results.py
+----------
+Lazy result sets for the Database Work Log searches.
+"""
+
+import threading
+
+from peewee import NodeList, Tuple, chunked
+
+import models
+
+
+class ResultSet:
+    """The tasks a search matched, read from the database a page at a time.
+
+    `query` selects the matching tasks and `order` lists the expressions
+    they sort by, ending with Task.id so every row has a unique key;
+    with `descending` they sort the other way, largest key first.
+    Pages are found by keyset: the page after a row starts where its
+    order key leaves off, so no page costs more than its own rows and
+    the ids never all sit in memory at once.
+    """
+
+    def __init__(self, query, order, descending=False):
+        self.query = query
+        self.order = tuple(order)
+        self.descending = descending
+        self._count = None
+
+    def __len__(self):
+        """Count matches with one COUNT query, remembered afterwards."""
+        if self._count is None:
+            self._count = self.query.count()
+        return self._count
+
+    def __bool__(self):
+        if self._count is None:
+            return self.query.exists()
+        return self._count > 0
+
+    def __iter__(self):
+        """Stream the ids of every match in order."""
+        key = None
+        while True:
+            page = self._after(key, 50, ids_only=True)
+            for task in page:
+                yield task.id
+            if not page:
+                return
+            key = page[-1].key
+
+    def tasks(self):
+        """Stream every matching task in order on one cursor.
+
+        Rows are handed over as they come off the cursor and never
+        cached, so memory stays flat however many there are.
+        """
+        return self._select().iterator()
+
+    def __getitem__(self, index):
+        """Return the id at index, found with OFFSET; prefer paging."""
+        if index < 0:
+            index += len(self)
+        page = self.at(index, 1) if index >= 0 else []
+        if not page:
+            raise IndexError('result index out of range')
+        return page[0].id
+
+    def _select(self, forward=True, ids_only=False):
+        """Select whole tasks, employees and task names, plus the order
+        key's values.
+
+        With ids_only, select just the ids and keys, and skip the joins.
+        """
+        keys = [NodeList((node,)).alias('key{}'.format(number))
+                for number, node in enumerate(self.order)]
+        if forward != self.descending:
+            order = self.order
+        else:
+            order = [node.desc() for node in self.order]
+        if ids_only:
+            return self.query.select(models.Task.id, *keys).order_by(*order)
+        return self.query.select(
+            models.Task, models.Employee, models.TaskName, *keys).join_from(
+                models.Task, models.Employee).join_from(
+                    models.Task, models.TaskName).order_by(*order)
+
+    def _past(self, key, forward=True):
+        """The condition for rows past key going forward or back."""
+        if forward != self.descending:
+            return Tuple(*self.order) > key
+        return Tuple(*self.order) < key
+
+    def _page(self, query, forward=True):
+        tasks = list(query)
+        for task in tasks:
+            task.key = tuple(getattr(task, 'key{}'.format(number))
+                             for number in range(len(self.order)))
+        if not forward:
+            tasks.reverse()
+        return tasks
+
+    def after(self, key=None, size=50):
+        """Return the size tasks following key, or the first ones."""
+        return self._after(key, size)
+
+    def _after(self, key, size, ids_only=False):
+        query = self._select(ids_only=ids_only)
+        if key is not None:
+            query = query.where(self._past(key))
+        return self._page(query.limit(size))
+
+    def before(self, key=None, size=50):
+        """Return the size tasks preceding key, or the last ones."""
+        query = self._select(forward=False)
+        if key is not None:
+            query = query.where(self._past(key, forward=False))
+        return self._page(query.limit(size), forward=False)
+
+    def at(self, index, size=50):
+        """Return the size tasks from position index on."""
+        return self._page(self._select().offset(index).limit(size))
+
+    def discard(self):
+        """Note that one of the matches was deleted."""
+        if self._count:
+            self._count -= 1
+
+    def recount(self):
+        """Forget the count after many matches changed at once."""
+        self._count = None
+
+
+class RankedResultSet(ResultSet):
+    """Matches in an order computed for the whole search, such as bm25.
+
+    Paging by keyset on a computed rank would rank every match again
+    for each page, so the matches are ranked once, on first use, and
+    their ids kept in order; pages then fetch their tasks by id.  A
+    row's key is its position.  `query` and `order` are as for a
+    ResultSet, and running the whole search again after a change costs
+    one more ranking.
+    """
+
+    def __init__(self, query, order):
+        super().__init__(query, order)
+        self._ids = None
+        self._ranking = threading.Lock()  # pages load from several threads
+
+    def ids(self):
+        """Return the ids of every match in order, ranking them once."""
+        with self._ranking:
+            if self._ids is None:
+                self._ids = [task_id for task_id, in self.query.select(
+                    models.Task.id).order_by(*self.order).tuples()]
+            return self._ids
+
+    def __len__(self):
+        return len(self.ids())
+
+    def __bool__(self):
+        return bool(self.ids())
+
+    def __iter__(self):
+        return iter(self.ids())
+
+    def __getitem__(self, index):
+        return self.ids()[index]
+
+    def tasks(self):
+        """Stream every matching task in order, a page of ids at a time."""
+        for start in range(0, len(self), 500):
+            yield from self.at(start, 500)
+
+    def _fetch(self, start, stop):
+        """Return the tasks from position start up to stop, in order."""
+        ids = self.ids()
+        start, stop = max(0, start), min(stop, len(ids))
+        position = {task_id: number for number, task_id in enumerate(
+            ids[start:stop], start)}
+        tasks = []
+        for batch in chunked(list(position), 500):
+            tasks.extend(models.Task.select(
+                models.Task, models.Employee, models.TaskName).join_from(
+                    models.Task, models.Employee).join_from(
+                        models.Task, models.TaskName).where(
+                            models.Task.id.in_(batch)))
+        for task in tasks:
+            task.key = (position[task.id],)
+        return sorted(tasks, key=lambda task: task.key)
+
+    def after(self, key=None, size=50):
+        start = 0 if key is None else key[0] + 1
+        return self._fetch(start, start + size)
+
+    def before(self, key=None, size=50):
+        stop = len(self) if key is None else key[0]
+        return self._fetch(stop - size, stop)
+
+    def at(self, index, size=50):
+        return self._fetch(index, index + size)
+
+    def discard(self):
+        """Note that one of the matches was deleted: rank them again."""
+        self.recount()
+
+    def recount(self):
+        """Forget the ranking after matches changed."""
+        with self._ranking:
+            self._ids = None
@@ -0,0 +1,80 @@
+"""
+terminal.py
+-----------
+Screen drawing for the Database Work Log menus.
+
+The menus, item tables and entry prompts all draw through one
+renderer.  On a terminal it clears the screen with ANSI escape
+sequences written in-process; when output goes to a file or a pipe
+there is no screen to clear, so clearing does nothing.
+"""
+
+import os
+import sys
+
+
+class Renderer:
+    """Write screens to a stream, sys.stdout unless told otherwise."""
+
+    def __init__(self, stream=None):
+        self._stream = stream
+
+    @property
+    def stream(self):
+        # looked up on every write so a swapped sys.stdout is followed
+        return self._stream or sys.stdout
+
+    def clear(self):
+        """Start a new screen."""
+
+    def line(self, text=''):
+        """Write a line of text."""
+        self.stream.write('{}\n'.format(text))
+
+    def lines(self, texts):
+        """Write several lines with a single write."""
+        self.stream.write(''.join('{}\n'.format(text) for text in texts))
+
+
+class AnsiRenderer(Renderer):
+    """Clear the screen with ANSI escape sequences."""
+    CLEAR = '\033[H\033[2J\033[3J'  # home, erase screen, erase scrollback
+
+    def __init__(self, stream=None):
+        super().__init__(stream)
+        if os.name == 'nt':
+            os.system('')  # once, so the Windows console honours ANSI
+
+    def clear(self):
+        """Clear the screen and move to its top left corner."""
+        self.stream.write(self.CLEAR)
+        self.stream.flush()
+
+
+def default_renderer(stream=None):
+    """Choose a renderer that suits stream, and writes to it.
+
+    Without a stream the renderer writes to sys.stdout, whatever it is
+    at the time.
+    """
+    target = stream or sys.stdout
+    if hasattr(target, 'isatty') and target.isatty():
+        return AnsiRenderer(stream)
+    return Renderer(stream)
+
+
+_renderer = None
+
+
+def renderer():
+    """Return the renderer every screen is drawn with."""
+    global _renderer
+    if _renderer is None:
+        _renderer = default_renderer()
+    return _renderer
+
+
+def set_renderer(new_renderer):
+    """Draw every screen with new_renderer from now on; None resets."""
+    global _renderer
+    _renderer = new_renderer
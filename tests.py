@@ -6,9 +6,16 @@ for DB Work Log project.
 """
 
 import datetime
+import io
+import json
+import multiprocessing
+import os
+import sqlite3
 import sys
+import tempfile
 import time
 import unittest
+import zlib
 
 from collections import OrderedDict
 from unittest.mock import patch
@@ -17,6 +24,16 @@ from peewee import *
 import utils
 import models
 import dbworklog
+import benchmarks
+import cache
+import cli
+import instrument
+import query
+import reports
+import results
+import terminal
+import transfer
+import writer
 
 from utils import fmt
 from models import Task
@@ -24,7 +41,7 @@ from models import Task
 test_db = SqliteDatabase(':memory:')
 
 
-MODELS = [Task]
+MODELS = models.MODELS
 
 
 class BaseTestCase(unittest.TestCase):
@@ -69,6 +86,7 @@ class BaseTestCase(unittest.TestCase):
         }  # no minutes
         test_db.connect()
         test_db.create_tables(MODELS)
+        cache.task_values.clear()  # the tables are new for every test
         utils.create_task(self.task1)
         utils.create_task(self.task2)
         utils.create_task(self.task3)
@@ -99,6 +117,163 @@ class ModelsTestCases(BaseTestCase):
             models.initialize()
             models.initialize()
 
+    def test_migrate(self):
+        """Test migrate brings the schema version up to date"""
+        models.migrate()
+        models.migrate()
+        assert models.schema_version() == len(models.MIGRATIONS)
+
+    def test_store_task_dates_as_days(self):
+        """Test the migration drops times of day stored with task dates"""
+        task_id = utils.find_by_employee(self.emp)[0]
+        models.db.execute_sql("UPDATE task SET date = date || ' 09:30:00' "
+                              "WHERE id = ?", (task_id,))
+        models._store_task_dates_as_days()
+        assert utils.get_task(task_id).date == self.date
+        assert utils.find_by_date(self.date)[0] == task_id
+
+    def test_move_employees_to_own_table(self):
+        """Test a task table keeping names is rebuilt around employee ids"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        models.configure(os.path.join(directory.name, 'old.db'))
+        self.addCleanup(models.configure)
+        models.db.execute_sql(
+            'CREATE TABLE task (id INTEGER NOT NULL PRIMARY KEY, '
+            'employee VARCHAR(100) NOT NULL, taskname VARCHAR(100) NOT NULL, '
+            'minutes INTEGER NOT NULL, notes TEXT NOT NULL, '
+            'date DATETIME NOT NULL)')
+        models.db.execute_sql(
+            "INSERT INTO task VALUES (7, 'beth', 'a', 5, '', "
+            "'2018-12-05 00:00:00'), (9, 'ben', 'b', 6, 'note', "
+            "'2018-12-06 00:00:00'), (11, 'beth', 'c', 7, '', '2018-12-06')")
+        models.db.close()
+        models.initialize()
+        assert 'employee' not in models.table_columns('task')
+        assert 'taskname' not in models.table_columns('task')
+        assert utils.find_tasknames() == ['b', 'c', 'a']  # latest first
+        assert list(utils.find_by_taskname('c')) == [11]
+        assert list(utils.find_by_full_text('b')) == [9]
+        assert utils.find_unique_employees.__wrapped__() == ['ben', 'beth']
+        assert list(utils.find_by_employee('beth')) == [7, 11]
+        assert utils.get_task(9).employee.name == 'ben'
+        assert list(utils.find_by_full_text('note')) == [9]
+        assert models.DailyTotal.mismatches() == ([], [])
+        assert utils.count_tasks() == 3
+
+    def test_compressed_notes(self):
+        """Test large notes are stored compressed and read back as text"""
+        log = ''.join('worker {} timed out\n'.format(number % 7)
+                      for number in range(500))
+        task_id = utils.create_task(dict(self.task1, notes=log))
+        utils.create_tasks([dict(self.task1, notes=log + 'crashed')])
+        stored = models.db.execute_sql(
+            'SELECT notes, length(notes_zip) FROM task WHERE id = ?',
+            (task_id,)).fetchone()
+        assert stored[0] == '' and stored[1] < len(log) / 10
+        task = utils.get_task(task_id)
+        assert isinstance(task.__data__['notes_zip'], bytes)  # not yet read
+        assert task.notes == log
+        assert len(utils.find_by_search_term('timed out')) == 2
+        assert len(utils.find_by_full_text('crashed')) == 1
+        assert len(utils.find_by_full_text('worker')) == 2
+        utils.save_task(task_id, self.task1)
+        assert utils.get_task(task_id).notes == self.notes1
+        assert len(utils.find_by_full_text('worker')) == 1
+        assert utils.get_task(task_id + 1).notes == log + 'crashed'
+
+    def test_compressed_notes_match_like_text(self):
+        """Test a search finds tasks the same whatever their notes' size"""
+        log = 'request timeout\n' * 1000
+        short, long = [utils.create_task(dict(
+            self.task1, taskname='release', notes=notes))
+            for notes in ['request timeout', log]]
+        assert set(utils.find_by_full_text('release timeout')) == {
+            short, long}
+        utils.save_task(long, dict(self.task1, taskname='deploy',
+                                   notes=log))
+        assert list(utils.find_by_full_text('release timeout')) == [short]
+        assert list(utils.find_by_full_text('deploy timeout')) == [long]
+        utils.save_task(long, dict(self.task1, taskname='deploy',
+                                   notes='request timeout'))
+        assert list(utils.find_by_full_text('deploy timeout')) == [long]
+
+    def test_compress_large_notes(self):
+        """Test notes stored as text before compression get compressed"""
+        log = 'disk full\n' * 1000
+        task_id = self.ids[0]
+        models.db.execute_sql('UPDATE task SET notes = ? WHERE id = ?',
+                              (log, task_id))
+        models._compress_large_notes()
+        assert models.db.execute_sql(
+            'SELECT notes, typeof(notes_zip) FROM task WHERE id = ?',
+            (task_id,)).fetchone() == ('', 'blob')
+        assert utils.get_task(task_id).notes == log
+        assert list(utils.find_by_full_text('disk')) == [task_id]
+        utils.delete_task(task_id)
+        assert list(utils.find_by_full_text('disk')) == []
+
+    def test_compressed_notes_other_clients(self):
+        """Test clients without the app's SQL functions can write tasks"""
+        log = 'disk full\n' * 1000
+        task_id = utils.create_task(dict(self.task1, notes=log))
+        other = sqlite3.connect(models.db.database)
+        with other:
+            other.execute("UPDATE task SET minutes = 1, notes = 'moved', "
+                          "notes_zip = NULL WHERE id = ?", (task_id,))
+            other.execute("INSERT INTO task (employee_id, taskname_id, "
+                          "minutes, notes, notes_zip, date) SELECT "
+                          "employee_id, taskname_id, 2, '', ?, date "
+                          "FROM task WHERE id = ?",
+                          (zlib.compress(b'printer jammed'), task_id))
+            other.execute('DELETE FROM task WHERE id = ?', (self.ids[0],))
+        other.close()
+        assert list(utils.find_by_full_text('disk')) == []
+        assert list(utils.find_by_full_text('moved')) == [task_id]
+        assert len(utils.find_by_full_text('printer')) == 1
+
+    def test_settings(self):
+        """Test the database file and pragmas can come from the environment"""
+        assert models.settings({}) == (models.DATABASE, models.PRAGMAS)
+        database, pragmas = models.settings({
+            'WORKLOG_DB': 'other.db',
+            'WORKLOG_PRAGMAS': 'MMAP_SIZE=0, cache_size=-2000,'})
+        assert database == 'other.db'
+        assert pragmas['mmap_size'] == '0'
+        assert pragmas['cache_size'] == '-2000'
+        assert pragmas['journal_mode'] == 'wal'
+
+    def test_pragmas(self):
+        """Test connections are opened with the configured pragmas"""
+        for name, value in [('journal_mode', 'wal'), ('synchronous', 1),
+                            ('busy_timeout', 10000)]:
+            assert models.db.execute_sql(
+                'PRAGMA {}'.format(name)).fetchone()[0] == value, name
+
+    def test_daily_totals(self):
+        """Test the daily totals follow every add, edit and delete"""
+        task_id = utils.find_by_employee(self.emp)[0]
+        utils.save_task(task_id, dict(self.task1, employee='other'))
+        utils.delete_task(utils.find_by_employee(self.emp)[0])
+        assert models.DailyTotal.mismatches() == ([], [])
+        daily = models.DailyTotal.get(
+            employee=models.Employee.named(self.emp), day=self.date)
+        assert (daily.entries, daily.minutes) == (1, int(self.min1))
+
+    def test_daily_totals_rebuild(self):
+        """Test rebuild puts right daily totals that were wrong"""
+        models.DailyTotal.update(minutes=0).execute()
+        expected, stored = models.DailyTotal.mismatches()
+        assert expected and stored
+        models.DailyTotal.rebuild()
+        assert models.DailyTotal.mismatches() == ([], [])
+
+    def test_finders_use_indexes(self):
+        """Test every finder is served by an index"""
+        for name, func, args in benchmarks.finder_calls():
+            plan = ' '.join(benchmarks.query_plan(func, *args))
+            self.assertIn('INDEX', plan, name)
+
 
 class UtilsTestCase(BaseTestCase):
     """Test utils"""
@@ -106,26 +281,49 @@ class UtilsTestCase(BaseTestCase):
     def test_find_by_date_range(self):
         """Test find by date range"""
         out = utils.find_by_date_range(self.date, self.date)
-        self.assertIsInstance(out, list)
+        self.assertIsInstance(out, results.ResultSet)
         self.assertIsInstance(out[0], int)
 
     def test_find_by_time_spent(self):
         """Test find by time spent"""
         out = utils.find_by_time_spent(self.min1)
-        self.assertIsInstance(out, list)
+        self.assertIsInstance(out, results.ResultSet)
         self.assertIsInstance(out[0], int)
 
     def test_find_by_search_term(self):
         """Test find by search term"""
         out = utils.find_by_search_term(self.task)
-        self.assertIsInstance(out, list)
+        self.assertIsInstance(out, results.ResultSet)
         out = utils.find_by_search_term(self.notes2)
-        self.assertIsInstance(out, list)
+        self.assertIsInstance(out, results.ResultSet)
+
+    def test_match_expression(self):
+        """Test match expression quotes phrases and prefixes words"""
+        out = utils.match_expression('pyth "unit test" o"k*')
+        assert out == '"pyth"* "unit test" "o""k"*'
+        assert utils.match_expression('  ') == ''
+
+    def test_find_by_full_text(self):
+        """Test find by full text"""
+        out = utils.find_by_full_text('pyth')
+        assert sorted(out) == sorted(utils.find_by_search_term('pyth'))
+        out = utils.find_by_full_text('"test python"')
+        self.assertIsInstance(out[0], int)
+        out = utils.find_by_full_text(self.notes2)
+        assert len(out) == 2
+
+    def test_full_text_follows_edits(self):
+        """Test the search index follows saves and deletes"""
+        task_id = utils.find_by_full_text(self.notes1)[0]
+        utils.save_task(task_id, self.task2)
+        assert not utils.find_by_full_text(self.notes1)
+        utils.delete_task(task_id)
+        assert len(utils.find_by_full_text(self.notes2)) == 2
 
     def test_find_by_employee(self):
         """Test find by employees"""
         out = utils.find_by_employee(self.emp)
-        self.assertIsInstance(out, list)
+        self.assertIsInstance(out, results.ResultSet)
         self.assertIsInstance(out[0], int)
 
     def test_find_unique_employees(self):
@@ -134,6 +332,35 @@ class UtilsTestCase(BaseTestCase):
         self.assertIsInstance(out, list)
         self.assertIsInstance(out[0], str)
 
+    def test_find_employees_by_prefix(self):
+        """Test prefix lookup finds each matching employee once, in order"""
+        for employee in ['tess', 'tessa', 'tex', 'tf']:
+            utils.create_task(dict(self.task1, employee=employee))
+        assert utils.find_employees_by_prefix('tes') == [
+            'tess', 'tessa', 'test']
+        assert utils.find_employees_by_prefix('te', 2) == ['tess', 'tessa']
+        assert utils.find_employees_by_prefix('tz') == []
+        assert utils.find_employees_by_prefix('') == (
+            utils.find_unique_employees())
+
+    def test_find_employees_ignoring_case(self):
+        """Test prefix and fuzzy lookups ignore the case of names"""
+        for employee in ['Beth', 'Ben', 'bert', 'Bo']:
+            utils.create_task(dict(self.task1, employee=employee))
+        assert utils.find_employees_by_prefix('be') == ['Ben', 'bert', 'Beth']
+        assert utils.find_employees_by_prefix('BE', 2) == ['Ben', 'bert']
+        assert utils.find_employees_by_prefix('beth') == ['Beth']
+        assert utils.find_similar_employees('bteh')[0] == 'Beth'
+        plan = models.db.execute_sql(
+            'EXPLAIN QUERY PLAN ' + utils.EMPLOYEES_BY_PREFIX,
+            ('be', 'bf', 10)).fetchall()
+        assert 'employee_name_nocase' in plan[0][-1]
+
+    def test_find_similar_employees(self):
+        """Test fuzzy lookup finds employees despite a typo"""
+        assert utils.find_similar_employees('tset') == [self.emp]
+        assert utils.find_similar_employees('nobody') == []
+
     def test_find_unique_dates(self):
         """Test find unique dates"""
         out = utils.find_unique_dates()
@@ -143,19 +370,32 @@ class UtilsTestCase(BaseTestCase):
     def test_find_by_date(self):
         """Test find by date"""
         out = utils.find_by_date(self.date)
-        self.assertIsInstance(out, list)
+        self.assertIsInstance(out, results.ResultSet)
         self.assertIsInstance(out[0], int)
 
     def test_empty_database(self):
         """Test empty datebase"""
         assert not utils.test_empty_database()
 
+    def test_empty_database_probe(self):
+        """Test the emptiness check reads at most one row"""
+        with benchmarks.recording_sql() as statements:
+            utils.test_empty_database()
+        assert 'LIMIT' in statements[-1][0]
+
+    def test_count_tasks(self):
+        """Test the task counter follows inserts and deletes"""
+        assert utils.count_tasks() == models.Task.select().count()
+        utils.create_task(self.task1)
+        assert utils.count_tasks() == models.Task.select().count()
+        utils.delete_task(utils.find_by_employee(self.emp)[0])
+        assert utils.count_tasks() == models.Task.select().count()
+
     def test_get_task(self):
         """Test get task"""
         out = utils.find_by_date(self.date)
         task = utils.get_task(out[0])
-        self.assertEqual(task.date,
-            datetime.datetime.strptime(self.date.strftime(fmt), fmt))
+        self.assertEqual(task.date, self.date)
 
     def test_table_evaluation(self):
         """Test table_evaluation"""
@@ -171,6 +411,17 @@ class UtilsTestCase(BaseTestCase):
             out = utils.item_table(item_list)
             assert out == item_list[0]
 
+    def test_item_table_pages(self):
+        """Test item_table shows a page at a time and pages both ways"""
+        item_list = ['item{}'.format(number) for number in range(45)]
+        with patch('builtins.input', side_effect=['n', 'n', 'n', 'p', '30']), \
+                patch('sys.stdout', new=io.StringIO()) as out:
+            assert utils.item_table(item_list, page_size=20) == 'item29'
+        screens = out.getvalue()
+        assert '41 - item40' in screens
+        assert '41-45 of 45' in screens
+        assert screens.count('1 - item0\n') == 1
+
     def test_enter_item(self):
         """Test enter_item"""
         item = 'a'
@@ -247,6 +498,849 @@ class UtilsTestCase(BaseTestCase):
         with self.assertRaises(Exception):
             utils.delete_task(9999999999999999)
 
+    def test_single_statement_writes(self):
+        """Test edits and deletes are one statement, missing ids raise"""
+        task_id = self.ids[0]
+        with benchmarks.recording_sql() as statements:
+            utils.save_task(task_id, dict(self.task1, notes='edited'))
+            utils.delete_task(task_id)
+        # the edit takes the write lock, looks the employee's and task
+        # name's ids up by name and checks for notes to index; the task
+        # is not read
+        assert [sql.split()[0] for sql, _ in statements
+                if 'FROM "employee"' not in sql
+                and 'FROM "task_name"' not in sql
+                and 'FROM "note_change"' not in sql] == [
+                    'BEGIN', 'UPDATE', 'DELETE']
+        with self.assertRaises(Task.DoesNotExist):
+            utils.save_task(task_id, self.task1)
+        with self.assertRaises(Task.DoesNotExist):
+            utils.delete_task(task_id)
+
+    def test_namesakes(self):
+        """Test employees who share a name are kept apart"""
+        namesake = models.Employee.create(name=self.emp)
+        other_id = utils.create_task(dict(self.task1, employee=namesake))
+        first = models.Employee.named(self.emp)
+        assert first != namesake
+        assert len(utils.find_by_employee(first)) == 3
+        assert list(utils.find_by_employee(namesake)) == [other_id]
+        assert len(utils.find_by_employee(self.emp)) == 4
+        assert utils.find_unique_employees() == [self.emp]
+        assert utils.find_employees_named(self.emp) == [first, namesake]
+        with patch('builtins.input', side_effect=['2']):
+            assert utils.choose_employee(self.emp) == namesake
+        assert [row['employee'] for row in reports.report()] == [
+            '{} (#{})'.format(self.emp, employee.id)
+            for employee in (first, namesake)]
+
+    def test_employees_without_tasks(self):
+        """Test employees whose tasks are all gone are not offered"""
+        task_id = utils.create_task(dict(self.task1, employee='gone'))
+        assert utils.find_employees_by_prefix('go') == ['gone']
+        utils.delete_task(task_id)
+        assert utils.find_employees_by_prefix('go') == []
+        assert 'gone' not in utils.find_unique_employees()
+        assert utils.choose_employee('gone') == 'gone'
+
+    def test_taskname_catalog(self):
+        """Test task names are stored once, with their uses and last use"""
+        catalog = models.TaskName
+        before = self.date - datetime.timedelta(days=3)
+        task_id = utils.create_task(dict(self.task1, taskname='review',
+                                         date=before))
+        utils.create_tasks([dict(self.task1, taskname='review',
+                                 date=before - datetime.timedelta(days=1))])
+        review = catalog.get(catalog.name == 'review')
+        assert (review.uses, review.last_used) == (2, before)
+        utils.save_task(task_id, dict(self.task1, taskname='review',
+                                      date=self.date))
+        assert catalog.get_by_id(review.id).last_used == self.date
+        utils.save_task(task_id, self.task1)
+        review = catalog.get_by_id(review.id)
+        assert (review.uses, review.last_used) == (
+            1, before - datetime.timedelta(days=1))
+        assert catalog.get(catalog.name == self.task).uses == 4
+        assert utils.find_tasknames() == [self.task, 'review']
+        assert utils.find_tasknames('rev') == ['review']
+        assert len(utils.find_by_taskname(self.task)) == 4
+        assert len(utils.find_by_taskname('missing')) == 0
+        assert len(utils.find_by_search_term('view')) == 1
+        utils.delete_results(utils.find_by_taskname('review'))
+        assert catalog.get_by_id(review.id).uses == 0
+        assert utils.find_tasknames() == [self.task]
+        assert [row['taskname'] for row in reports.report('taskname')] == [
+            self.task]
+
+    def test_enter_taskname_suggestions(self):
+        """Test a suggestion is picked by number, near duplicates caught"""
+        utils.create_task(dict(self.task1, taskname='review'))
+        with patch('builtins.input', side_effect=['2']):
+            assert utils.enter_taskname() == 'review'
+        with patch('builtins.input', side_effect=['test pyton', '1']):
+            assert utils.enter_taskname() == self.task
+        with patch('builtins.input', side_effect=['test pyton', '2']):
+            assert utils.enter_taskname() == 'test pyton'
+        with patch('builtins.input', side_effect=['design']):
+            assert utils.enter_taskname() == 'design'
+
+    def test_concurrent_writers(self):
+        """Test processes adding tasks at once wait for each other"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'shared.db')
+        models.configure(path)
+        self.addCleanup(models.configure)
+        models.initialize()
+        models.db.close_all()
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(4) as pool:
+            locked = pool.starmap(benchmarks._write_tasks, [
+                (path, models.PRAGMAS, 50, seed) for seed in range(4)])
+        assert locked == [0, 0, 0, 0]
+        assert utils.count_tasks() == 200
+
+    def test_bulk_changes(self):
+        """Test reassign, shift and delete act on exactly the results"""
+        other = utils.create_task(dict(self.task1, employee='other'))
+        found = utils.find_by_employee(self.emp)
+        assert utils.shift_results(found, -2) == 3
+        shifted = self.date - datetime.timedelta(days=2)
+        assert {utils.get_task(i).date for i in found} == {shifted}
+        assert utils.get_task(other).date == self.date
+        assert utils.reassign_results(found, 'renamed') == 3
+        assert not utils.find_by_employee(self.emp)
+        assert utils.delete_results(utils.find_by_employee('renamed')) == 3
+        assert list(utils.find_all()) == [other]
+        assert models.DailyTotal.mismatches() == ([], [])
+
+
+class ResultsTestCases(BaseTestCase):
+    """Test results"""
+
+    def test_result_set_len(self):
+        """Test len counts once and bool needs no count"""
+        out = utils.find_by_employee(self.emp)
+        assert out
+        assert len(out) == 3
+        with benchmarks.recording_sql() as statements:
+            assert len(out) == 3
+        assert statements == []
+
+    def test_result_set_keyset(self):
+        """Test paging forwards and backwards by key"""
+        out = utils.find_by_employee(self.emp)
+        ids = list(out)
+        first = out.after(None, 2)
+        assert [task.id for task in first] == ids[:2]
+        rest = out.after(first[-1].key, 2)
+        assert [task.id for task in rest] == ids[2:]
+        back = out.before(rest[0].key, 5)
+        assert [task.id for task in back] == ids[:2]
+        assert [task.id for task in out.before(None, 1)] == ids[-1:]
+
+    def test_result_set_ranked(self):
+        """Test ranked full text results page by their score"""
+        out = utils.find_by_full_text('test')
+        with benchmarks.recording_sql() as statements:
+            ids = list(out)
+            page = out.after(None, 1)
+            assert [task.id for task in out.after(page[-1].key)] == ids[1:]
+            assert [task.id for task in out.before(page[-1].key)] == []
+            assert [task.id for task in out.at(1, 1)] == ids[1:2]
+            assert [task.id for task in out.tasks()] == ids
+        # ranked once, then paged by id
+        assert len([sql for sql, _ in statements if 'MATCH' in sql]) == 1
+        utils.delete_task(ids[0])
+        out.discard()
+        assert list(out) == ids[1:]
+
+    def test_result_set_getitem(self):
+        """Test indexing past the end raises IndexError"""
+        out = utils.find_by_employee(self.emp)
+        assert out[-1] == list(out)[-1]
+        with self.assertRaises(IndexError):
+            out[3]
+
+
+    def test_descending(self):
+        """Test a descending result set pages from the largest key down"""
+        ids = results.ResultSet(Task.select().where(
+            Task.employee == models.Employee.named(self.emp)),
+                                (Task.id,), descending=True)
+        ascending = list(self.ids)
+        assert list(ids) == ascending[::-1]
+        assert [task.id for task in ids.before(None, 2)] == (
+            ascending[1::-1])
+        first = ids.after(None, 1)[0]
+        assert [task.id for task in ids.after(first.key)] == (
+            ascending[::-1][1:])
+
+
+class CacheTestCases(BaseTestCase):
+    """Test cache"""
+
+    def test_page_cache_get(self):
+        """Test get loads a whole window with one query"""
+        page_cache = cache.PageCache(self.ids, size=2, prefetch=False)
+        with benchmarks.recording_sql() as statements:
+            first = page_cache.get(0)
+            second = page_cache.get(1)
+        assert len(statements) == 1
+        assert [first.id, second.id] == list(self.ids)[:2]
+        assert page_cache.get(2).id == self.ids[2]
+        assert len(page_cache) == 2
+
+    def test_page_cache_lru(self):
+        """Test the least recently used window is evicted"""
+        page_cache = cache.PageCache(self.ids, size=1, max_windows=2,
+                                     prefetch=False)
+        for index in range(3):
+            page_cache.get(index)
+        assert len(page_cache) == 2
+        with benchmarks.recording_sql() as statements:
+            page_cache.get(0)
+        assert len(statements) == 1
+
+    def test_page_cache_prefetch(self):
+        """Test reading the edge of a window prefetches the next one"""
+        page_cache = cache.PageCache(self.ids, size=2)
+        page_cache.get(1)
+        for _ in range(100):
+            if len(page_cache) == 2:
+                break
+            time.sleep(0.01)
+        with benchmarks.recording_sql() as statements:
+            page_cache.get(2)
+        assert statements == []
+
+    def test_page_cache_refresh(self):
+        """Test refresh picks up an edited row"""
+        page_cache = cache.PageCache(self.ids, prefetch=False)
+        page_cache.get(0)
+        utils.save_task(self.ids[0], dict(self.task1, notes='edited'))
+        page_cache.refresh(0)
+        assert page_cache.get(0).notes == 'edited'
+
+    def test_page_cache_remove(self):
+        """Test remove follows ids shifting after a delete"""
+        page_cache = cache.PageCache(self.ids, prefetch=False)
+        page_cache.get(0)
+        utils.delete_task(self.ids[0])
+        self.ids.discard()
+        page_cache.remove(0)
+        assert page_cache.get(0).id == self.ids[0]
+        assert len(self.ids) == 2
+
+
+class TaskValueCacheTestCases(BaseTestCase):
+    """Test cache.task_values"""
+
+    def test_cached(self):
+        """Test the pickers' lists are read once while nothing changes"""
+        utils.find_unique_employees()
+        with benchmarks.recording_sql() as statements:
+            utils.find_unique_employees()
+        assert len(statements) == 1  # the counter, not the table
+        assert len(cache.task_values) == 1
+
+    def test_writes_invalidate(self):
+        """Test add, edit and delete all bring the lists up to date"""
+        assert 'other' not in utils.find_unique_employees()
+        task_id = utils.create_task(dict(self.task1, employee='other'))
+        assert 'other' in utils.find_unique_employees()
+        utils.save_task(task_id, dict(self.task1, employee='renamed'))
+        assert 'other' not in utils.find_unique_employees()
+        utils.delete_task(task_id)
+        assert 'renamed' not in utils.find_unique_employees()
+
+    def test_other_writers_invalidate(self):
+        """Test writes that bypass utils still bring the lists up to date"""
+        before = utils.find_unique_dates()
+        Task.update(date=datetime.date(2001, 2, 3)).execute()
+        assert utils.find_unique_dates() != before
+        assert utils.find_unique_dates() == ['20010203']
+
+
+class InstrumentTestCases(BaseTestCase):
+    """Test instrument"""
+
+    def setUp(self):
+        super().setUp()
+        self.log = os.path.join(tempfile.mkdtemp(), 'slow.log')
+
+    def test_recording(self):
+        """Test utils calls and their SQL are both timed"""
+        with instrument.recording(log_path=self.log) as recorder:
+            found = utils.find_by_employee(self.emp)
+            assert len(found) == len(found) == 3
+            found.after(None, 2)
+            employees = utils.find_unique_employees()
+            utils.get_task(self.ids[0])
+        timings = recorder.timings
+        # a result set is timed as its queries run, once for the count
+        assert 'utils.find_by_employee' not in timings
+        assert timings['utils.find_by_employee count'].count == 1
+        assert timings['utils.find_by_employee count'].rows == 3
+        assert timings['utils.find_by_employee page'].rows == 2
+        assert timings['utils.find_unique_employees'].rows == len(employees)
+        assert timings['utils.get_task'].count == 1
+        assert any(name.startswith('SELECT') for name in timings)
+        assert recorder.summary()[0].startswith('call or statement')
+        assert len(recorder.summary()) == len(timings) + 1
+
+    def test_disable_restores(self):
+        """Test the originals are back once recording stops"""
+        original = utils.find_by_employee
+        with instrument.recording(log_path=self.log):
+            assert utils.find_by_employee is not original
+            assert instrument.enabled()
+            with self.assertRaises(RuntimeError):
+                instrument.enable()
+        assert utils.find_by_employee is original
+        assert 'execute_sql' not in vars(models.db)
+        assert not instrument.enabled()
+
+    def test_slow_log(self):
+        """Test calls over the threshold are written to the slow log"""
+        with instrument.recording(slow_ms=0, log_path=self.log):
+            len(utils.find_by_employee(self.emp))
+            utils.save_task(self.ids[0], dict(self.task1, notes='secret'))
+        with open(self.log) as log:
+            logged = log.read()
+        assert 'utils.find_by_employee count' in logged
+        assert 'dict(employee, taskname' in logged
+        assert 'secret' not in logged
+
+    def test_percentile(self):
+        """Test percentiles are bucket bounds, never above the worst"""
+        timings = instrument.Timings()
+        for seconds in [0.0002] * 19 + [0.003]:
+            timings.add(seconds, None)
+        assert timings.percentile(0.5) == 0.25
+        assert timings.percentile(1) == 3.0
+        assert timings.rows == 0
+
+
+class WriterTestCases(BaseTestCase):
+    """Test writer"""
+
+    def test_create_tasks(self):
+        """Test many tasks are added at once"""
+        before = utils.count_tasks()
+        assert utils.create_tasks([self.task1] * 250) == 250
+        assert utils.count_tasks() == before + 250
+
+    def test_size_threshold(self):
+        """Test tasks wait until a batch is full"""
+        before = utils.count_tasks()
+        with writer.TaskWriter(max_tasks=3, max_delay=60) as tasks:
+            tasks.add(self.task1)
+            tasks.add(self.task2)
+            assert len(tasks) == 2
+            assert utils.count_tasks() == before
+            tasks.add(self.task3)
+            assert len(tasks) == 0
+            assert utils.count_tasks() == before + 3
+
+    def test_time_threshold(self):
+        """Test a batch is written once its oldest task has waited"""
+        before = utils.count_tasks()
+        with writer.TaskWriter(max_tasks=100, max_delay=0.05) as tasks:
+            tasks.add(self.task1)
+            for _ in range(100):
+                if tasks.written:
+                    break
+                time.sleep(0.01)
+            assert tasks.written == 1
+        assert utils.count_tasks() == before + 1
+
+    def test_close(self):
+        """Test closing writes the queue, then tasks go one at a time"""
+        before = utils.count_tasks()
+        tasks = writer.TaskWriter(max_tasks=100, max_delay=60)
+        tasks.add(self.task1)
+        tasks.close()
+        assert utils.count_tasks() == before + 1
+        task_id = tasks.add(self.task2)
+        assert utils.get_task(task_id).minutes == int(self.min2)
+
+    def test_failed_batch(self):
+        """Test a batch that fails stays queued for the next try"""
+        with writer.TaskWriter(max_tasks=2, max_delay=60) as tasks:
+            tasks.add(self.task1)
+            with patch('utils.create_tasks',
+                       side_effect=OperationalError('locked')):
+                with self.assertRaises(OperationalError):
+                    tasks.add(self.task2)
+            assert len(tasks) == 2 and tasks.error
+            assert tasks.flush() == 2
+            assert tasks.error is None
+
+    def test_bad_tasks(self):
+        """Test bad tasks are refused and failed batches dropped"""
+        before = utils.count_tasks()
+        errors = io.StringIO()
+        with writer.TaskWriter(max_tasks=100, max_delay=0.05,
+                               errors=errors) as tasks:
+            for bad in [dict(self.task1, minutes=None),
+                        {'employee': self.emp, 'minutes': 5}]:
+                with self.assertRaises(ValueError):
+                    tasks.add(bad)
+            tasks.add(self.task1)
+            with patch('utils.create_tasks',
+                       side_effect=IntegrityError('NOT NULL')):
+                with self.assertRaises(IntegrityError):
+                    tasks.flush()
+            assert len(tasks) == 0 and tasks.dropped == 1
+            assert 'dropped 1 tasks' in errors.getvalue()
+            with patch('utils.create_tasks', side_effect=KeyError('x')):
+                tasks.add(self.task2)
+                for _ in range(100):
+                    if tasks.dropped == 2:
+                        break
+                    time.sleep(0.01)
+            assert tasks.dropped == 2
+            tasks.add(self.task3)
+            for _ in range(100):
+                if tasks.written:
+                    break
+                time.sleep(0.01)
+            assert tasks.written == 1
+        assert utils.count_tasks() == before + 1
+
+
+class QueryTestCases(BaseTestCase):
+    """Test query"""
+
+    def test_search_combines_criteria(self):
+        """Test a search finds only tasks matching every criterion"""
+        utils.create_task(dict(self.task1, employee='other'))
+        search = query.Search().for_employee(self.emp).on(self.date)
+        found = list(search.minutes(200).matching(self.notes2).results())
+        assert [utils.get_task(task_id).minutes for task_id in found] == [
+            int(self.min2)]
+        assert len(query.Search().minutes(180, 180).results()) == 3
+
+    def test_search_is_immutable(self):
+        """Test adding a criterion leaves the search it came from alone"""
+        search = query.Search().for_employee(self.emp)
+        search.minutes(1000)
+        assert search.least is None
+        assert len(search.results()) == 3
+
+    def test_plan_picks_fewest_matches(self):
+        """Test the planner drives the search by its most selective index"""
+        for _ in range(3):
+            utils.create_task(dict(self.task1, employee='other'))
+        search = query.Search().for_employee(self.emp).minutes(240, 240)
+        path, estimates = search.plan()
+        assert path == 'minutes'
+        assert estimates == {'employee': 3, 'minutes': 1}
+        assert query.Search().plan() == (None, {})
+
+    def test_longest(self):
+        """Test longest keeps the longest tasks, longest first"""
+        utils.create_task(dict(self.task1, minutes=500))
+        found = query.Search().for_employee(self.emp).longest(2).results()
+        assert len(found) == 2
+        assert [utils.get_task(task_id).minutes for task_id in found] == [
+            500, 240]
+        assert len(query.Search().for_employee(self.emp).longest(
+            100).results()) == 4
+
+    def test_minute_bounds(self):
+        """Test minute searches with only a lower or an upper bound"""
+        search = query.Search().for_employee(self.emp)
+        assert len(search.minutes(least=200).results()) == 1
+        assert len(search.minutes(most=200).results()) == 2
+
+    def test_explain(self):
+        """Test explain shows the chosen path and the index SQLite uses"""
+        lines = query.Search().for_employee(self.emp).minutes(
+            240, 240).explain()
+        assert lines[0] == 'driving path: minutes'
+        assert any('task_minutes_id' in line for line in lines)
+        assert not any('task_employee' in line for line in lines)
+
+
+class ReportsTestCases(BaseTestCase):
+    """Test reports"""
+
+    def test_report_by_employee(self):
+        """Test report totals, averages and percentiles per employee"""
+        row = {row['employee']: row for row in reports.report()}[self.emp]
+        assert row['entries'] == 3
+        assert row['total'] == 600
+        assert row['average'] == 200.0
+        assert (row['p50'], row['p90'], row['p99']) == (180, 240, 240)
+
+    def test_report_groups(self):
+        """Test report groups by every period and by task name"""
+        day = self.date.isoformat()
+        keys = {'day': day, 'week': self.date.strftime('%Y-W%W'),
+                'month': day[:7], 'taskname': self.task}
+        for by, key in keys.items():
+            rows = {row[by]: row for row in reports.report(by)}
+            assert rows[key]['entries'] >= 3, by
+
+    def test_report_date_bounds(self):
+        """Test report keeps to the dates given, both ends included"""
+        rows = reports.report('day', self.date, self.date)
+        assert [row['day'] for row in rows] == [self.date.isoformat()]
+        tomorrow = self.date + datetime.timedelta(days=1)
+        assert reports.report('day', start=tomorrow) == []
+
+    def test_report_without_percentiles(self):
+        """Test totals from the daily totals match those from the tasks"""
+        for by in reports.GROUPS:
+            full = reports.report(by, self.date, self.date)
+            for row in full:
+                for column in ['p{}'.format(p) for p in reports.PERCENTILES]:
+                    del row[column]
+            assert reports.report(by, self.date, self.date,
+                                  percentiles=False) == full, by
+
+    def test_minutes_histogram(self):
+        """Test the histogram counts tasks per band of minutes"""
+        rows = reports.minutes_histogram(60, self.date, self.date)
+        assert rows == [{'least': 180, 'most': 239, 'entries': 2},
+                        {'least': 240, 'most': 299, 'entries': 1}]
+        lines = list(reports.histogram_lines(rows, bar_width=10))
+        assert lines[0].endswith(' ' + '#' * 10)
+        assert lines[1].endswith(' ' + '#' * 5)
+        for width in [0, -60]:
+            with self.assertRaises(ValueError):
+                reports.minutes_histogram(width)
+
+    def test_report_lines(self):
+        """Test report_lines lays out a heading and a line per row"""
+        lines = list(reports.report_lines(reports.report(), 'employee'))
+        assert lines[0].split() == ['employee'] + reports.COLUMNS
+        assert len(lines) == len(reports.report()) + 1
+
+
+class TransferTestCases(BaseTestCase):
+    """Test transfer"""
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.rows = [{'employee': 'beth', 'taskname': 'import',
+                      'minutes': str(minutes), 'notes': '',
+                      'date': self.date.strftime(fmt)}
+                     for minutes in range(1, 6)]
+
+    def tearDown(self):
+        self.directory.cleanup()
+        super().tearDown()
+
+    def _write_jsonl(self, rows):
+        path = os.path.join(self.directory.name, 'tasks.jsonl')
+        with open(path, 'w') as target:
+            for row in rows:
+                target.write(json.dumps(row) + '\n')
+        return path
+
+    def test_clean_task(self):
+        """Test clean_task validates like the entry prompts"""
+        out = utils.clean_task(self.rows[0])
+        assert out['minutes'] == 1
+        assert out['date'] == self.date
+        with self.assertRaises(ValueError):
+            utils.clean_task(dict(self.rows[0], minutes='ten'))
+        with self.assertRaises(ValueError):
+            utils.clean_task(dict(self.rows[0], date='2018-12-05'))
+        with self.assertRaises(ValueError):
+            utils.clean_task(dict(self.rows[0], employee=' '))
+
+    def test_import_csv(self):
+        """Test importing a CSV file"""
+        path = os.path.join(self.directory.name, 'tasks.csv')
+        with open(path, 'w') as target:
+            target.write('employee,taskname,minutes,notes,date\n')
+            target.write('beth,csv,30,,{}\n'.format(self.date.strftime(fmt)))
+            target.write('beth,csv,thirty,,{}\n'.format(
+                self.date.strftime(fmt)))
+        errors = io.StringIO()
+        stats = transfer.import_file(path, errors=errors)
+        assert stats['imported'] == 1
+        assert stats['rejected'] == 1
+        assert 'row 2' in errors.getvalue()
+        assert len(utils.find_by_employee('beth')) == 1
+
+    def test_import_resumes(self):
+        """Test a failed import carries on without duplicating rows"""
+        path = self._write_jsonl(self.rows)
+        insert_chunk = transfer._insert_chunk
+        calls = []
+
+        def failing_insert(*args):
+            calls.append(args)
+            if len(calls) == 3:
+                raise OSError("disk full")
+            insert_chunk(*args)
+
+        with patch('transfer._insert_chunk', side_effect=failing_insert):
+            with self.assertRaises(OSError):
+                transfer.import_file(path, chunk_size=2)
+        assert len(utils.find_by_employee('beth')) == 4
+        stats = transfer.import_file(path, chunk_size=2)
+        assert stats['skipped'] == 4
+        assert len(utils.find_by_employee('beth')) == 5
+        stats = transfer.import_file(path)
+        assert stats['imported'] == 0
+        assert len(utils.find_by_employee('beth')) == 5
+
+    def test_import_new_file_at_same_path(self):
+        """Test a different file written to an imported path is imported"""
+        path = self._write_jsonl(self.rows)
+        assert transfer.import_file(path)['imported'] == 5
+        self._write_jsonl([dict(self.rows[0], minutes='7')])
+        stats = transfer.import_file(path)
+        assert (stats['skipped'], stats['imported']) == (0, 1)
+        assert len(utils.find_by_employee('beth')) == 6
+
+    def test_export_round_trip(self):
+        """Test every format exports and imports back unchanged"""
+        tasks = [(task.employee.name, task.taskname.name, task.minutes,
+                  task.notes)
+                 for task in utils.find_by_employee(self.emp).tasks()]
+        for kind in transfer.WRITERS:
+            path = os.path.join(self.directory.name, 'out.' + kind)
+            stats = transfer.export_results(
+                utils.find_by_employee(self.emp), path)
+            assert stats['exported'] == 3
+            rows = [utils.clean_task(row)
+                    for row in transfer.READERS[kind](path)]
+            assert [(row['employee'], row['taskname'], row['minutes'],
+                     row['notes']) for row in rows] == tasks
+            assert rows[0]['date'] == self.date
+
+    def test_read_wlc_rejects_other_files(self):
+        """Test reading a file that is not WLC raises ValueError"""
+        path = self._write_jsonl(self.rows)
+        with self.assertRaises(ValueError):
+            list(transfer.read_wlc(path))
+
+    def test_export_command(self):
+        """Test the export command applies the search options"""
+        path = os.path.join(self.directory.name, 'out.jsonl')
+        with patch('sys.stdout', new=io.StringIO()):
+            cli.export_file(cli.parser().parse_args(
+                ['export', path, '--minutes', self.min2]))
+        assert len(list(transfer.read_jsonl(path))) == 1
+
+
+class CLITestCases(BaseTestCase):
+    """Test cli"""
+
+    def _run(self, *argv):
+        """Run a command and return the JSON records it prints."""
+        args = cli.parser().parse_args(argv)
+        with patch('sys.stdout', new=io.StringIO()) as out:
+            args.func(args)
+        return [json.loads(line) for line in out.getvalue().splitlines()]
+
+    def test_add(self):
+        """Test add creates an entry without any prompts"""
+        with patch('utils.clear') as clear:
+            out = self._run('add', '--employee', 'cron', '--taskname', 'ci',
+                            '--minutes', '3', '--date', '20181205')
+        assert not clear.called
+        task = utils.get_task(out[0]['id'])
+        assert (task.employee.name, task.minutes) == ('cron', 3)
+
+    def test_add_invalid(self):
+        """Test add refuses minutes that are not a number"""
+        with self.assertRaises(SystemExit):
+            self._run('add', '--employee', 'cron', '--taskname', 'ci',
+                      '--minutes', 'three')
+
+    def test_search(self):
+        """Test search prints one record per entry"""
+        out = self._run('search', '--employee', self.emp)
+        assert len(out) == 3
+        assert out[0]['date'] == self.date.strftime(fmt)
+        assert len(self._run('search', '--limit', '1')) == 1
+
+    def test_edit(self):
+        """Test edit changes only the fields given"""
+        task_id = utils.find_by_employee(self.emp)[0]
+        self._run('edit', str(task_id), '--minutes', '5')
+        task = utils.get_task(task_id)
+        assert task.minutes == 5
+        assert task.employee.name == self.emp
+        with self.assertRaises(SystemExit):
+            self._run('edit', '9999999', '--minutes', '5')
+
+    def test_edit_keeps_namesake(self):
+        """Test edit leaves a task with its employee, not a namesake"""
+        namesake = models.Employee.create(name=self.emp)
+        task_id = utils.create_task(dict(self.task1, employee=namesake))
+        self._run('edit', str(task_id), '--minutes', '9')
+        task = utils.get_task(task_id)
+        assert (task.minutes, task.employee) == (9, namesake)
+
+    def test_delete(self):
+        """Test delete reports which ids it deleted"""
+        task_id = utils.find_by_employee(self.emp)[0]
+        out = self._run('delete', str(task_id), '9999999')
+        assert out == [{'deleted': [task_id]}]
+
+    def test_stats(self):
+        """Test stats totals the work log"""
+        out = self._run('stats')[0]
+        assert out['entries'] == 3
+        assert out['minutes'] == 600
+        assert out['first_date'] == self.date.strftime(fmt)
+
+    def test_search_combined(self):
+        """Test search options combine, and --explain shows the plan"""
+        out = self._run('search', '--employee', self.emp,
+                        '--minutes-range', '200', '300', '--term', 'abcdef')
+        assert [record['minutes'] for record in out] == [int(self.min2)]
+        plan = self._run('search', '--employee', self.emp, '--explain')[0]
+        assert plan['path'] == 'employee'
+        assert plan['probes'] == {'employee': 3}
+
+    def test_search_minutes(self):
+        """Test searches by minute bounds and for the longest entries"""
+        out = self._run('search', '--employee', self.emp, '--at-least', '200')
+        assert [record['minutes'] for record in out] == [int(self.min2)]
+        out = self._run('search', '--employee', self.emp, '--at-most', '200')
+        assert len(out) == 2
+        out = self._run('search', '--employee', self.emp, '--longest', '1')
+        assert [record['minutes'] for record in out] == [int(self.min2)]
+
+    def test_histogram(self):
+        """Test histogram prints a record per band of minutes"""
+        date = self.date.strftime(fmt)
+        out = self._run('histogram', '--width', '120', '--from', date)
+        assert out == [{'least': 120, 'most': 239, 'entries': 2},
+                       {'least': 240, 'most': 359, 'entries': 1}]
+        for width in ['0', '-60', 'wide']:
+            with self.assertRaises(SystemExit), \
+                    patch('sys.stderr', new=io.StringIO()):
+                self._run('histogram', '--width', width)
+
+    def test_import_export(self):
+        """Test import and export print their counts as JSON records"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'out.jsonl')
+            out = self._run('export', path, '--employee', self.emp)
+            assert out[0]['path'] == path and out[0]['exported'] == 3
+            out = self._run('import', path)
+            assert out[0]['path'] == path and out[0]['imported'] == 3
+        assert len(utils.find_by_employee(self.emp)) == 6
+
+    def test_employees(self):
+        """Test employees prints matches for a prefix or a misspelling"""
+        assert self._run('employees', 'te') == [{'employee': self.emp}]
+        assert self._run('employees', 'tset') == [{'employee': self.emp}]
+
+    def test_tasknames(self):
+        """Test task names are listed by prefix, most used first"""
+        assert self._run('tasknames', 'te') == [
+            {'taskname': self.task, 'uses': 3,
+             'last_used': self.date.strftime(fmt)}]
+        assert self._run('tasknames', 'x') == []
+
+    def test_report(self):
+        """Test report prints a record per group within the dates"""
+        date = self.date.strftime(fmt)
+        out = self._run('report', '--by', 'taskname',
+                        '--from', date, '--to', date)
+        row = {row['taskname']: row for row in out}[self.task]
+        assert (row['entries'], row['total']) == (3, 600)
+        out = self._run('report', '--no-percentiles')
+        assert 'p50' not in out[0]
+
+    def test_daily_totals(self):
+        """Test daily-totals verify fails until rebuild fixes the totals"""
+        self._run('daily-totals', 'verify')
+        models.DailyTotal.update(entries=7).execute()
+        with self.assertRaises(SystemExit):
+            self._run('daily-totals', 'verify')
+        out = self._run('daily-totals', 'rebuild')
+        assert out[0]['daily_totals'] >= 1
+        self._run('daily-totals', 'verify')
+
+
+class BenchmarksTestCases(unittest.TestCase):
+    """Test benchmarks"""
+
+    def test_synthetic_tasks(self):
+        """Test the same seed gives the same skewed tasks"""
+        tasks = list(benchmarks.synthetic_tasks(2000, seed=3))
+        assert tasks == list(benchmarks.synthetic_tasks(2000, seed=3))
+        employees = [task[0] for task in tasks]
+        assert employees.count('beth') > employees.count('staff100') * 10
+        assert max(len(task[3].split()) for task in tasks) > 100
+
+    def test_tasks_with_logs(self):
+        """Test a share of tasks get logs large enough to be compressed"""
+        tasks = list(benchmarks.tasks_with_logs(400, seed=3, share=0.1))
+        assert [task[:3] for task in tasks] == [
+            task[:3] for task in benchmarks.synthetic_tasks(400, seed=3)]
+        logs = [task for task in tasks
+                if len(task[3]) >= models.COMPRESS_NOTES_AT]
+        assert 20 < len(logs) < 60
+
+    def test_compare(self):
+        """Test only timings well past their baseline are regressions"""
+        baseline = {'seconds': {'10': {'a': 1.0, 'b': 1.0, 'c': 0.0001}}}
+        current = {'seconds': {'10': {'a': 1.1, 'b': 2.0, 'c': 0.0004,
+                                      'new': 1.0}}}
+        lines = list(benchmarks.compare(baseline, current))
+        assert len(lines) == 3
+        assert [line.split()[1] for line in lines
+                if line.endswith('REGRESSION')] == ['b']
+
+
+class TerminalTestCases(unittest.TestCase):
+    """Test terminal"""
+
+    def tearDown(self):
+        terminal.set_renderer(None)
+
+    def test_ansi_clear(self):
+        """Test the ANSI renderer clears with escape codes"""
+        out = io.StringIO()
+        terminal.AnsiRenderer(out).clear()
+        assert out.getvalue() == terminal.AnsiRenderer.CLEAR
+
+    def test_plain_clear(self):
+        """Test the plain renderer writes nothing to clear"""
+        out = io.StringIO()
+        screen = terminal.Renderer(out)
+        screen.clear()
+        screen.lines(['a', 'b'])
+        assert out.getvalue() == 'a\nb\n'
+
+    def test_default_renderer(self):
+        """Test only a terminal gets the ANSI renderer"""
+        tty = io.StringIO()
+        tty.isatty = lambda: True
+        screen = terminal.default_renderer(tty)
+        self.assertIsInstance(screen, terminal.AnsiRenderer)
+        out = io.StringIO()
+        plain = terminal.default_renderer(out)
+        assert type(plain) is terminal.Renderer
+        with patch('sys.stdout', new=io.StringIO()) as stdout:
+            screen.line('tty')
+            plain.line('file')
+            terminal.default_renderer().line('stdout')
+        assert (tty.getvalue(), out.getvalue(), stdout.getvalue()) == (
+            'tty\n', 'file\n', 'stdout\n')
+
+    def test_clear_runs_no_command(self):
+        """Test utils.clear does not start a process"""
+        terminal.set_renderer(terminal.AnsiRenderer(io.StringIO()))
+        with patch('os.system') as system:
+            utils.clear()
+        assert not system.called
+
 
 class DBWorkLogTestCases(BaseTestCase):
     """Test dbworklog"""
@@ -322,6 +1416,65 @@ class DBWorkLogTestCases(BaseTestCase):
             idx2=self.result_menu.index
             assert idx2 == idx
 
+    def test_result_menu_edit_out_of_search(self):
+        """Test editing a task out of its search leaves the rest showing"""
+        day = datetime.date(2020, 1, 1)
+        for minutes in (10, 20, 30):
+            utils.create_task(dict(self.task1, minutes=minutes, date=day))
+        menu = dbworklog.ResultMenu(utils.find_by_date(day))
+        menu.index = 2
+        # enter_task dates the edited task today
+        with patch('builtins.input', side_effect=[
+                self.emp, self.task, self.min1, self.notes1]):
+            menu.edit()
+        assert len(menu) == 2
+        assert menu.index == 1
+        assert 'Entry 2 out of 2' in str(menu)
+
+    def test_result_menu_delete_all(self):
+        """Test delete_all empties the results once confirmed"""
+        with patch('builtins.input', side_effect=['n']):
+            self.result_menu.delete_all()
+        assert len(self.result_menu) == 3
+        with patch('builtins.input', side_effect=['y']), \
+                patch('time.sleep'):
+            with self.assertRaises(dbworklog.Restart):
+                self.result_menu.delete_all()
+        assert utils.test_empty_database()
+
+    def test_result_menu_reassign_and_shift_all(self):
+        """Test reassign_all and shift_all change every result"""
+        self.result_menu.index = 2
+        with patch('builtins.input', side_effect=['x', '1', 'y']), \
+                patch('time.sleep'):
+            self.result_menu.shift_all()
+        assert self.result_menu.index == 0
+        assert {task.date for task in Task.select()} == {
+            self.date + datetime.timedelta(days=1)}
+        with patch('builtins.input', side_effect=['other', 'y']), \
+                patch('time.sleep'):
+            self.result_menu.reassign_all()
+        assert utils.find_unique_employees() == ['other']
+
+    def test_result_menu_pages_through_windows(self):
+        """Test next and prev walk every result across windows"""
+        self.result_menu.cache = cache.PageCache(
+            self.ids, size=1, max_windows=1, prefetch=False)
+        seen = []
+        for _ in range(len(self.result_menu)):
+            seen.append(self.result_menu.cache.get(
+                self.result_menu.index).id)
+            self.result_menu.next()
+        assert seen == list(self.ids)
+        self.result_menu.index = 2
+        self.result_menu.prev()
+        assert self.result_menu.cache.get(
+            self.result_menu.index).id == seen[1]
+        self.result_menu.delete()
+        assert len(self.result_menu) == 2
+        assert self.result_menu.cache.get(
+            self.result_menu.index).id == seen[2]
+
     def test_result_menu___len__(self):
         """Test __len__ in ResultMenu"""
         assert len(self.result_menu) == len(self.ids)
@@ -390,11 +1543,30 @@ class DBWorkLogTestCases(BaseTestCase):
 
     def test_search_menu__employee_ids(self):
         """Test _employee_ids in SearchMenu"""
-        with patch('builtins.input', side_effect=['0', '1']):
+        with patch('builtins.input', side_effect=['', '0', '1']):
             ids=self.search_menu._employee_ids()
-            self.assertIsInstance(ids, list)
+            self.assertIsInstance(ids, results.ResultSet)
             self.assertIsInstance(ids[0], int)
 
+    def test_search_menu__find_employees(self):
+        """Test the employee picker narrows by prefix, then by likeness"""
+        utils.create_task(dict(self.task1, employee='tessa'))
+        with patch('builtins.input', side_effect=['zzz', 'tes']), \
+                patch('sys.stdout', new=io.StringIO()) as out:
+            assert self.search_menu._find_employees() == ['tessa', 'test']
+        assert 'No employee matches' in out.getvalue()
+        with patch('builtins.input', side_effect=['test']):
+            ids = self.search_menu._employee_ids()  # one match, no table
+        assert utils.get_task(ids[0]).employee.name == self.emp
+
+    def test_search_menu_find_combined(self):
+        """Test the combined search asks for each criterion, blanks skipped"""
+        with patch('builtins.input',
+                   side_effect=[self.emp, '', '', '200', '', '']):
+            with self.assertRaises(dbworklog.Open) as opened:
+                self.search_menu.find_combined()
+        assert len(opened.exception.menu.results) == 1
+
     def test_search_menu__show_results(self):
         """Test _show_results in SearchMenu"""
         out=self.search_menu._show_results([])
@@ -442,9 +1614,18 @@ class DBWorkLogTestCases(BaseTestCase):
         """Test _date_ids in SearchMenu"""
         with patch('builtins.input', side_effect=['1']):
             ids=self.search_menu._date_ids()
-            self.assertIsInstance(ids, list)
+            self.assertIsInstance(ids, results.ResultSet)
             self.assertIsInstance(ids[0], int)
 
+    def test_search_menu_report(self):
+        """Test report in SearchMenu shows a table for the choices made"""
+        date = self.date.strftime(fmt)
+        with patch('builtins.input', side_effect=['1', 'x', '', date, '']), \
+                patch('sys.stdout', new=io.StringIO()) as out:
+            self.search_menu.report()
+        assert 'p90' in out.getvalue()
+        assert self.emp in out.getvalue()
+
     def test_search_menu__get_dates_ids(self):
         """Test _get_dates in SearchMenu"""
         date=datetime.datetime.now().date()
@@ -454,29 +1635,96 @@ class DBWorkLogTestCases(BaseTestCase):
         date_max_str=date_max.strftime(fmt)
         with patch('builtins.input', side_effect=['s', date_min_str, '1', date_max_str]):
             ids=self.search_menu._get_dates_ids()
-            self.assertIsInstance(ids, list)
+            self.assertIsInstance(ids, results.ResultSet)
             self.assertIsInstance(ids[0], int)
 
     def test_search_menu__search_term_ids(self):
         """Test _search_term_ids in SearchMenu"""
         with patch('builtins.input', side_effect='task'):
             ids=self.search_menu._search_term_ids()
-            self.assertIsInstance(ids, list)
+            self.assertIsInstance(ids, results.ResultSet)
             self.assertIsInstance(ids[0], int)
 
     def test_search_menu__time_spent_ids(self):
         """Test _time_spent_ids in SearchMenu"""
         with patch('builtins.input', side_effect=['b', 15, '15', str(self.min2), str(self.min1)]):
             ids=self.search_menu._time_spent_ids()
-            self.assertIsInstance(ids, list)
+            self.assertIsInstance(ids, results.ResultSet)
             # self.assertIsInstance(ids[0], int)
 
+    def test_search_menu__time_spent_bounds(self):
+        """Test _time_spent_ids takes ranges, bounds and top N"""
+        for answer, expected in [('180-240', 3), ('>= 200', 1),
+                                 ('<=200', 2), ('TOP 1', 1)]:
+            with patch('builtins.input', side_effect=[answer]):
+                ids = self.search_menu._time_spent_ids()
+            found = [task_id for task_id in ids
+                     if utils.get_task(task_id).employee.name == self.emp]
+            assert len(found) == expected, answer
+        with patch('builtins.input', side_effect=['top 0', '>240', '1-']), \
+                self.assertRaises(StopIteration):
+            self.search_menu._get_time_spent()
+
+    def test_search_menu_histogram(self):
+        """Test the report menu can show a histogram of minutes"""
+        date = self.date.strftime(fmt)
+        histogram = str(len(dbworklog.reports.GROUPS) + 1)
+        with patch('builtins.input',
+                   side_effect=[histogram, '', date, date, '']), \
+                patch('sys.stdout', new=io.StringIO()) as out:
+            self.search_menu.report()
+        assert '180-239' in out.getvalue()
+        with patch('builtins.input',
+                   side_effect=[histogram, '0', '-5', '120', date, date,
+                                '']), \
+                patch('sys.stdout', new=io.StringIO()) as out:
+            self.search_menu.report()
+        assert out.getvalue().count('Try again.') == 2
+        assert '120-239' in out.getvalue()
+
     def test_menu__run(self):
         """Test _run in Menu"""
         with patch('builtins.input', side_effect='15'):
             out=self.menu._run(utils.enter_minutes)
             assert type(out) == type(None)
 
+    def test_navigate(self):
+        """Test each move changes the stack of open menus"""
+        stack = [self.main_menu]
+        dbworklog.Open(self.search_menu).apply(stack)
+        dbworklog.Open(self.result_menu).apply(stack)
+        assert stack == [self.main_menu, self.search_menu, self.result_menu]
+        dbworklog.Back(dbworklog.SearchMenu).apply(stack)
+        assert stack == [self.main_menu, self.search_menu]
+        dbworklog.Restart(self.result_menu).apply(stack)
+        dbworklog.Back(dbworklog.MainMenu).apply(stack)
+        assert len(stack) == 1
+        self.assertIsInstance(stack[0], dbworklog.MainMenu)
+
+    def test_menu_loop_stays_flat(self):
+        """Test 100k menu changes run at one constant call depth"""
+
+        class DepthRecorder(terminal.Renderer):
+            """Note how deep in calls each screen is drawn."""
+            depths = set()
+
+            def clear(self):
+                frame, depth = sys._getframe(), 0
+                while frame:
+                    frame, depth = frame.f_back, depth + 1
+                self.depths.add(depth)
+
+        # 92k changes between main and search, then 8k through results
+        keys = ['s', 'm'] * 46000 + ['s', 't', self.min1, 'n', 's', 'm'] * 2000
+        terminal.set_renderer(DepthRecorder(io.StringIO()))
+        try:
+            with patch('builtins.input', side_effect=keys + ['q']):
+                with self.assertRaises(SystemExit):
+                    self.main_menu.menu_loop()
+        finally:
+            terminal.set_renderer(None)
+        assert len(DepthRecorder.depths) == 1
+
     def test_main_menu_enter_task(self):
         """Test enter_task in MainMenu"""
         with patch('builtins.input', side_effect=[self.emp, self.task, self.min1, self.notes2, self.date]):
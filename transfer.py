@@ -0,0 +1,246 @@
+"""
+transfer.py
+-----------
+Bulk import and export of work log entries as CSV, JSON Lines or
+WLC, a compact columnar format of our own.
+
+A WLC file is the magic bytes WLC1 followed by blocks of up to
+BLOCK_ROWS tasks.  Each block is its row count, then one
+zlib-compressed column per field: minutes as 64-bit integers, dates
+as day ordinals and text as a table of UTF-8 lengths followed by the
+bytes.  A block of zero rows ends the file.
+"""
+
+from array import array
+import csv
+import datetime
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+
+from peewee import chunked
+
+import models
+import utils
+
+
+FIELDS = ['employee', 'taskname', 'minutes', 'notes', 'date']
+
+
+def read_csv(path):
+    """Yield each row of a CSV file with a header line as a dict."""
+    with open(path, newline='') as source:
+        yield from csv.DictReader(source)
+
+
+def read_jsonl(path):
+    """Yield each line of a JSON Lines file as a dict."""
+    with open(path) as source:
+        for line in source:
+            if line.strip():
+                yield json.loads(line)
+
+
+MAGIC = b'WLC1'
+BLOCK_ROWS = 65536
+_COUNT = struct.Struct('<I')
+
+
+def _pack_text(values):
+    data = [value.encode('utf-8') for value in values]
+    return array('I', map(len, data)).tobytes() + b''.join(data)
+
+
+def _unpack_text(raw, rows):
+    lengths = array('I')
+    lengths.frombytes(raw[:rows * lengths.itemsize])
+    values, start = [], rows * lengths.itemsize
+    for length in lengths:
+        values.append(raw[start:start + length].decode('utf-8'))
+        start += length
+    return values
+
+
+def _pack_numbers(typecode, values):
+    return array(typecode, values).tobytes()
+
+
+def _unpack_numbers(typecode, raw):
+    values = array(typecode)
+    values.frombytes(raw)
+    return values
+
+
+def _write_column(target, raw):
+    packed = zlib.compress(raw)
+    target.write(_COUNT.pack(len(packed)))
+    target.write(packed)
+
+
+def _read_column(source):
+    size, = _COUNT.unpack(source.read(_COUNT.size))
+    return zlib.decompress(source.read(size))
+
+
+def read_wlc(path):
+    """Yield each task of a WLC file as a dict."""
+    with open(path, 'rb') as source:
+        if source.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not a WLC file".format(path))
+        while True:
+            rows, = _COUNT.unpack(source.read(_COUNT.size))
+            if not rows:
+                return
+            employees = _unpack_text(_read_column(source), rows)
+            tasknames = _unpack_text(_read_column(source), rows)
+            minutes = _unpack_numbers('q', _read_column(source))
+            notes = _unpack_text(_read_column(source), rows)
+            dates = _unpack_numbers('i', _read_column(source))
+            for row in zip(employees, tasknames, minutes, notes, dates):
+                task = dict(zip(FIELDS, row))
+                task['date'] = datetime.date.fromordinal(task['date'])
+                yield task
+
+
+READERS = {
+    'csv': read_csv,
+    'jsonl': read_jsonl,
+    'wlc': read_wlc,
+}
+
+
+def record(task):
+    """Return a task as a dict of the values the readers give back."""
+    return {'employee': task.employee.name,
+            'taskname': task.taskname.name,
+            'minutes': task.minutes,
+            'notes': task.notes,
+            'date': task.date.strftime(utils.fmt)}
+
+
+def write_csv(tasks, path):
+    """Write tasks to a CSV file with a header line; return the count."""
+    count = 0
+    with open(path, 'w', newline='') as target:
+        writer = csv.DictWriter(target, FIELDS)
+        writer.writeheader()
+        for count, task in enumerate(tasks, 1):
+            writer.writerow(record(task))
+    return count
+
+
+def write_jsonl(tasks, path):
+    """Write tasks to a JSON Lines file; return the count."""
+    count = 0
+    with open(path, 'w') as target:
+        for count, task in enumerate(tasks, 1):
+            target.write(json.dumps(record(task)) + '\n')
+    return count
+
+
+def write_wlc(tasks, path):
+    """Write tasks to a WLC file a block at a time; return the count."""
+    count = 0
+    with open(path, 'wb') as target:
+        target.write(MAGIC)
+        for block in chunked(tasks, BLOCK_ROWS):
+            target.write(_COUNT.pack(len(block)))
+            _write_column(target, _pack_text(t.employee.name for t in block))
+            _write_column(target, _pack_text(t.taskname.name for t in block))
+            _write_column(target, _pack_numbers(
+                'q', (t.minutes for t in block)))
+            _write_column(target, _pack_text(t.notes for t in block))
+            _write_column(target, _pack_numbers(
+                'i', (t.date.toordinal() for t in block)))
+            count += len(block)
+        target.write(_COUNT.pack(0))
+    return count
+
+
+WRITERS = {
+    'csv': write_csv,
+    'jsonl': write_jsonl,
+    'wlc': write_wlc,
+}
+
+
+def file_format(path):
+    """Guess a file's format from its extension."""
+    extension = os.path.splitext(path)[1].lstrip('.').lower()
+    if extension not in READERS:
+        raise ValueError("Unknown file format: {}".format(path))
+    return extension
+
+
+def fingerprint(path):
+    """Return what tells the file at path apart: its size and mtime."""
+    status = os.stat(path)
+    return '{}:{}'.format(status.st_size, status.st_mtime_ns)
+
+
+def _insert_chunk(source, tasks, rows_done, identity=''):
+    """Insert tasks and record the progress in one transaction."""
+    with models.db.atomic(utils.WRITE):
+        utils.create_tasks(tasks)
+        models.ImportProgress.replace(source=source, fingerprint=identity,
+                                      rows=rows_done).execute()
+
+
+def import_file(path, kind=None, chunk_size=10000, restart=False,
+                errors=sys.stderr):
+    """Import every valid row of a file, a chunk per transaction.
+
+    Rows that fail utils.clean_task are reported to errors and skipped.
+    The number of rows read is saved with each chunk, so importing the
+    same file again carries on after the last committed chunk instead
+    of adding its rows twice.  A different file at the same path, told
+    apart by fingerprint(), is imported from the top.  Returns a dict
+    of counts and timings.
+    """
+    source = os.path.realpath(path)
+    identity = fingerprint(path)
+    reader = READERS[kind or file_format(path)]
+    progress = models.ImportProgress.get_or_none(source=source)
+    skip = 0
+    if not restart and progress and progress.fingerprint == identity:
+        skip = progress.rows
+    stats = {'skipped': skip, 'imported': 0, 'rejected': 0}
+    start = time.perf_counter()
+    tasks = []
+    rows_done = skip
+    for number, row in enumerate(reader(path), 1):
+        if number <= skip:
+            continue
+        rows_done = number
+        try:
+            tasks.append(utils.clean_task(row))
+        except (ValueError, AttributeError) as err:
+            stats['rejected'] += 1
+            print("{}: row {}: {}".format(path, number, err), file=errors)
+        if len(tasks) >= chunk_size:
+            _insert_chunk(source, tasks, rows_done, identity)
+            stats['imported'] += len(tasks)
+            tasks = []
+    if rows_done > skip:
+        _insert_chunk(source, tasks, rows_done, identity)
+        stats['imported'] += len(tasks)
+    stats['seconds'] = time.perf_counter() - start
+    stats['rate'] = stats['imported'] / stats['seconds']
+    return stats
+
+
+def export_results(results, path, kind=None):
+    """Stream a result set to a file; returns a dict of counts and timings.
+
+    Tasks come straight off one database cursor into the writer, so an
+    export of any size runs in the same memory.
+    """
+    writer = WRITERS[kind or file_format(path)]
+    start = time.perf_counter()
+    stats = {'exported': writer(results.tasks(), path)}
+    stats['seconds'] = time.perf_counter() - start
+    stats['rate'] = stats['exported'] / stats['seconds']
+    return stats
@@ -5,13 +5,26 @@ Utility methods for the Database Work Log
 """
 
 import datetime
-import os
+import difflib
+import re
+import string
 import sys
 import time
 
+from peewee import SQL, Select, chunked, fn
+
+import cache
 import models
+import results
+import terminal
 
 fmt = '%Y%m%d'
+ROWS_PER_STATEMENT = 100  # 5 parameters a row stays under SQLite's limit
+# Writes that look names up first take the write lock up front.  A
+# deferred transaction that reads, then writes, cannot wait for another
+# writer in WAL mode: its snapshot is stale, and SQLite refuses it
+# straight away with "database is locked", whatever busy_timeout says.
+WRITE = 'IMMEDIATE'
 
 def quit():
     """Quit the program."""
@@ -19,82 +32,362 @@ def quit():
 
 
 def create_task(new_task):
-    """Create/add a new task."""
-    models.Task.create(**new_task)
+    """Create/add a new task, returning its id.
+
+    The employee is a name, the first employee of that name, or an
+    Employee, for one of several namesakes.  The task name is looked up
+    in the catalog, and added to it if new.
+    """
+    with models.db.atomic(WRITE):
+        employee = models.Employee.named(new_task['employee'])
+        taskname = models.TaskName.named(new_task['taskname'])
+        task = models.Task.create(**dict(
+            new_task, employee=employee, taskname=taskname,
+            **models.pack_notes(new_task.get('notes') or '')))
+        index_notes()
+        return task.id
+
+
+def create_tasks(new_tasks):
+    """Create/add many tasks in one transaction, returning how many."""
+    new_tasks = list(new_tasks)
+    with models.db.atomic(WRITE):
+        ids = models.Employee.ids(task['employee'] for task in new_tasks)
+        names = models.TaskName.ids(task['taskname'] for task in new_tasks)
+        for batch in chunked(new_tasks, ROWS_PER_STATEMENT):
+            models.Task.insert_many(
+                [dict(task, employee=ids[task['employee']],
+                      taskname=names[task['taskname']],
+                      **models.pack_notes(task.get('notes') or ''))
+                 for task in batch]).execute()
+        index_notes()
+    return len(new_tasks)
 
 
 def save_task(old_id, new_task):
-    """Save in place a new task, or edit it."""
-    task = models.Task.get(id=old_id)
-    task.employee = new_task['employee']
-    task.taskname = new_task['taskname']
-    task.minutes = new_task['minutes']
-    task.notes = new_task['notes']
-    task.date = new_task['date']  # don't update date
-    task.save()
+    """Save in place a new task, or edit it, with a single UPDATE.
+
+    A missing task raises DoesNotExist, and adds no employee or task
+    name either.
+    """
+    with models.db.atomic(WRITE):
+        updated = models.Task.update(
+            employee=models.Employee.named(new_task['employee']),
+            taskname=models.TaskName.named(new_task['taskname']),
+            minutes=new_task['minutes'],
+            date=new_task['date'],
+            **models.pack_notes(new_task['notes'])).where(
+                models.Task.id == old_id).execute()
+        if not updated:
+            raise models.Task.DoesNotExist("No task {}".format(old_id))
+        index_notes()
     return 0
 
 
 def delete_task(old_id):
-    """Delete a task."""
-    old_task = models.Task.get(id=old_id)
-    old_task.delete_instance()
+    """Delete a task with a single DELETE."""
+    deleted = models.Task.delete().where(
+        models.Task.id == old_id).execute()
+    if not deleted:
+        raise models.Task.DoesNotExist("No task {}".format(old_id))
+
+
+def _in_results(result_set):
+    """The condition for a task being one of result_set's matches."""
+    return models.Task.id.in_(result_set.query.select(models.Task.id))
+
+
+def delete_results(result_set):
+    """Delete every task in result_set in one statement; return how many."""
+    return models.Task.delete().where(_in_results(result_set)).execute()
+
+
+def reassign_results(result_set, employee):
+    """Give every task in result_set to employee; return how many."""
+    with models.db.atomic(WRITE):
+        return models.Task.update(
+            employee=models.Employee.named(employee)).where(
+                _in_results(result_set)).execute()
+
+
+def shift_results(result_set, days):
+    """Move every task in result_set days later, or earlier if negative.
+
+    Returns how many moved.
+    """
+    return models.Task.update(
+        date=fn.date(models.Task.date, '{:+d} days'.format(days))).where(
+            _in_results(result_set)).execute()
 
 
 def find_by_date_range(start_date, end_date):
-    """Find ids for tasks with dates in between start and end date."""
-    extended_end_date = end_date + \
-        datetime.timedelta(seconds=1)  # add one second to be inclusive
-    return [task.id for task in models.Task.select(models.Task.id).where(
-        models.Task.date.between(
-            start_date, extended_end_date)).order_by(models.Task.date)]
+    """Find tasks with dates in between start and end date."""
+    return results.ResultSet(
+        models.Task.select().where(
+            models.Task.date.between(start_date, end_date)),
+        (models.Task.date, models.Task.id))
 
 
 def find_by_time_spent(minutes):
-    """Find ids for tasks with exact minutes."""
-    return [task.id for task in
-            models.Task.select(models.Task.id).where(
-                models.Task.minutes == minutes).order_by(models.Task.id)]
+    """Find tasks with exact minutes."""
+    return results.ResultSet(
+        models.Task.select().where(models.Task.minutes == minutes),
+        (models.Task.id,))
+
+
+def taskname_contains(field, query):
+    """The condition for field naming a task with query in its name.
+
+    The LIKE runs over the catalog, a row per name; the tasks are then
+    matched by name id.
+    """
+    catalog = models.TaskName
+    return field.in_(catalog.select(catalog.id).where(
+        catalog.name.contains(query)))
+
+
+def notes_contain(task, query):
+    """The condition for task holding notes with query in them.
+
+    Compressed notes are decompressed to be searched.
+    """
+    return (task.notes.contains(query) |
+            fn.unpack_notes(task.notes_zip).contains(query))
 
 
 def find_by_search_term(query):
-    """Find ids for tasks where query wildcard in taskname or notes."""
-    return [task.id for task in
-            models.Task.select(models.Task.id).where(
-                models.Task.taskname.contains(query) |
-                models.Task.notes.contains(query)).order_by(models.Task.id)]
+    """Find tasks where query wildcard in taskname or notes."""
+    return results.ResultSet(
+        models.Task.select().where(
+            taskname_contains(models.Task.taskname, query) |
+            notes_contain(models.Task, query)),
+        (models.Task.id,))
+
+
+def find_by_taskname(taskname):
+    """Find tasks with exactly taskname, oldest first."""
+    catalog = models.TaskName
+    found = catalog.select(catalog.id).where(catalog.name == taskname)
+    return results.ResultSet(
+        models.Task.select().where(
+            models.Task.taskname == found.scalar()),
+        (models.Task.date, models.Task.id))
+
+
+def find_tasknames(prefix='', limit=None):
+    """Find task names in use that start with prefix, most used first."""
+    catalog = models.TaskName
+    query = catalog.select(catalog.name).where(catalog.uses > 0)
+    if prefix:
+        query = query.where(catalog.name >= prefix,
+                            catalog.name < _prefix_end(prefix))
+    return [name for name, in query.order_by(
+        catalog.uses.desc(), catalog.last_used.desc(),
+        catalog.name).limit(limit).tuples()]
+
+
+def match_expression(query):
+    """Turn a search term into an FTS5 MATCH expression.
+
+    Quoted text is matched as a phrase; every other word matches as
+    a prefix, so "pyth" finds python like the LIKE search does.
+    """
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', query):
+        if phrase.strip():
+            terms.append('"{}"'.format(phrase.replace('"', '""')))
+        elif word.rstrip('*'):
+            terms.append('"{}"*'.format(word.rstrip('*').replace('"', '""')))
+    return ' '.join(terms)
+
+
+def index_notes():
+    """Index the compressed notes written since they were last indexed."""
+    if models.FTS_AVAILABLE:
+        models.NoteIndex.catch_up()
+
+
+def full_text_hits(expression):
+    """Select the ids of tasks matching expression and their bm25 rank.
+
+    Each task is one document, in task_fts or, when its notes are
+    compressed, in note_fts, so the two are searched alike and their
+    matches never overlap.
+    """
+    tasks, notes = models.TaskIndex, models.NoteIndex
+    index_notes()
+    hits = tasks.select(
+        tasks.rowid.alias('task_id'),
+        tasks.bm25(10.0, 1.0).alias('rank')  # taskname outweighs notes
+    ).where(tasks.match(expression)).union_all(
+        notes.select(notes.rowid, notes.bm25(10.0, 1.0)).where(
+            notes.match(expression))).alias('hit')
+    return Select([hits], [hits.c.task_id, hits.c.rank]).bind(models.db)
+
+
+def find_by_full_text(query):
+    """Find tasks matching query, best bm25 match first.
+
+    Falls back to find_by_search_term where FTS5 is not available.
+    """
+    expression = match_expression(query)
+    if not models.FTS_AVAILABLE or not expression:
+        return find_by_search_term(query)
+    best = full_text_hits(expression).alias('best')
+    return results.RankedResultSet(
+        models.Task.select().join(
+            best, on=(best.c.task_id == models.Task.id)),
+        (best.c.rank, models.Task.id))
+
+
+def employee_is(field, employee):
+    """The condition for field holding employee.
+
+    employee is an Employee, or a name that stands for everyone with it.
+    """
+    if isinstance(employee, models.Employee):
+        return field == employee.id
+    ids = [employee_id for employee_id, in models.Employee.select(
+        models.Employee.id).where(models.Employee.name == employee).tuples()]
+    # one id keeps the (employee, date) index usable for the order
+    return field == ids[0] if len(ids) == 1 else field.in_(ids)
 
 
 def find_by_employee(query):
-    """Find ids for tasks where query exactly matches query."""
-    return [task.id for task in
-            models.Task.select(models.Task.id).where(
-                models.Task.employee == query)]
+    """Find tasks logged by query, an employee or everyone of that name."""
+    return results.ResultSet(
+        models.Task.select().where(employee_is(models.Task.employee, query)),
+        (models.Task.date, models.Task.id))
 
 
-def find_unique_employees():
-    """Find unique employees in db."""
-    return [task.employee for task in
-            models.Task.select(models.Task.employee).distinct().order_by(
-                models.Task.employee)]
+def _has_tasks():
+    """The condition for an employee having logged a task."""
+    return fn.EXISTS(models.Task.select(SQL('1')).where(
+        models.Task.employee == models.Employee.id))
 
 
+@cache.task_values
+def find_unique_employees():
+    """Find unique employees in db."""
+    employee = models.Employee
+    return [name for name, in employee.select(employee.name).where(
+        _has_tasks()).distinct().order_by(employee.name).tuples()]
+
+
+def find_employees_named(name):
+    """Find every employee called name who has logged a task, oldest first."""
+    employee = models.Employee
+    return list(employee.select().where(
+        employee.name == name, _has_tasks()).order_by(employee.id))
+
+
+def _prefix_end(prefix):
+    """Return a value after every string starting with prefix."""
+    prefix = prefix.rstrip(chr(sys.maxunicode))
+    if not prefix:
+        return b''  # SQLite sorts any blob after all text
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+# The name index gives the prefix's range of the employee table, a row
+# per person, and each name's first task is one index probe away, so
+# the cost grows with the names returned rather than with the tasks
+# logged for them.  Plain SQL: it runs as the user types, and peewee
+# takes a hundred times longer to build it than SQLite takes to run it.
+EMPLOYEES_BY_PREFIX = """
+    SELECT DISTINCT name FROM employee
+    WHERE name COLLATE NOCASE >= ? AND name COLLATE NOCASE < ?
+    AND EXISTS (SELECT 1 FROM task WHERE task.employee_id = employee.id)
+    ORDER BY name COLLATE NOCASE, name LIMIT ?"""
+
+# NOCASE folds only ASCII letters, so only those are folded here
+_FOLD_ASCII = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def find_employees_by_prefix(prefix, limit=None):
+    """Find unique employees whose names start with prefix, in order.
+
+    Case is ignored: 'be' finds Ben and Beth.
+    """
+    prefix = prefix.translate(_FOLD_ASCII)
+    end = _prefix_end(prefix)
+    limit = -1 if limit is None else limit  # -1: no limit
+    cursor = models.db.execute_sql(EMPLOYEES_BY_PREFIX, (prefix, end, limit))
+    return [name for name, in cursor]
+
+
+def choose_employee(name):
+    """Ask which employee called name is meant, if several are.
+
+    Returns that Employee, or name itself when it is not shared.
+    """
+    namesakes = find_employees_named(name)
+    if len(namesakes) < 2:
+        return name
+    labels = ['{} (#{})'.format(employee.name, employee.id)
+              for employee in namesakes]
+    choice = item_table(labels, "Employees called {}".format(name))
+    return namesakes[labels.index(choice)]
+
+
+def find_similar_employees(name, limit=10):
+    """Find unique employees whose names look like name, closest first.
+
+    Case is ignored, as in find_employees_by_prefix.
+    """
+    spellings = {}
+    for employee in find_unique_employees():
+        spellings.setdefault(employee.lower(), []).append(employee)
+    matches = difflib.get_close_matches(name.lower(), spellings, limit,
+                                        cutoff=0.6)
+    return [employee for match in matches
+            for employee in spellings[match]][:limit]
+
+
+@cache.task_values
 def find_unique_dates():
     """Find unique dates in db."""
-    return [task.date.strftime(fmt) for task in
-            models.Task.select(models.Task.date).distinct().order_by(
-                models.Task.date)]
+    # grouping walks the date index in order, formatting once per date
+    return [date for date, in models.Task.select(
+        fn.strftime(fmt, models.Task.date)).group_by(
+            models.Task.date).order_by(models.Task.date).tuples()]
+
+
+def find_all():
+    """Find every task, oldest first."""
+    return results.ResultSet(models.Task.select(),
+                             (models.Task.date, models.Task.id))
 
 
 def find_by_date(date):
-    """Find ids for tasks with exact date in query."""
-    return [task.id for task in models.Task.select(models.Task.id).where(
-        models.Task.date == date).order_by(models.Task.id)]
+    """Find tasks with exact date in query."""
+    return results.ResultSet(
+        models.Task.select().where(models.Task.date == date),
+        (models.Task.id,))
 
 
 def test_empty_database():
     """If database is empty, return True."""
-    return len(models.Task.select()) == 0
+    return not models.Task.select().exists()
+
+
+def task_stats():
+    """Totals for the whole work log, as a dict."""
+    # a row per employee per day to add up rather than every task
+    daily = models.DailyTotal
+    employees, minutes, first, last = daily.select(
+        fn.COUNT(daily.employee.distinct()), fn.SUM(daily.minutes),
+        fn.MIN(daily.day), fn.MAX(daily.day)).tuples().get()
+    return {"entries": count_tasks(),
+            "employees": employees,
+            "minutes": minutes or 0,
+            "first_date": first and first.strftime(fmt),
+            "last_date": last and last.strftime(fmt)}
+
+
+def count_tasks():
+    """Count every task from the trigger-kept counter, without a scan."""
+    return models.Counter.value_of('task')
 
 
 def get_task(ind):
@@ -104,13 +397,13 @@ def get_task(ind):
 
 def clear():
     """Clear screen."""
-    os.system("cls" if os.name == "nt" else "clear")
+    terminal.renderer().clear()
 
 
-def item_table_list(item_list):
-    """List choices."""
-    for index, item in enumerate(item_list):
-        print('{} - {}'.format(index + 1, item))
+def item_table_list(item_list, start=0):
+    """List choices, numbered from start + 1."""
+    terminal.renderer().lines('{} - {}'.format(index + 1, item)
+                              for index, item in enumerate(item_list, start))
 
 
 def item_table_evaluation(item_list):
@@ -129,13 +422,40 @@ def item_table_evaluation(item_list):
             return item_list[choice - 1]
 
 
-def item_table(item_list, heading=None):
-    """Make an item table."""
-    clear()
-    if heading:
-        print(heading)
-    item_table_list(item_list)
-    return item_table_evaluation(item_list)
+PAGE_SIZE = 20
+
+
+def item_table(item_list, heading=None, page_size=PAGE_SIZE):
+    """Make an item table, a page of items at a time."""
+    start = 0
+    while True:
+        clear()
+        screen = terminal.renderer()
+        if heading:
+            screen.line(heading)
+        item_table_list(item_list[start:start + page_size], start)
+        if len(item_list) > page_size:
+            screen.line("{}-{} of {}   n - next page   p - previous page"
+                        .format(start + 1,
+                                min(start + page_size, len(item_list)),
+                                len(item_list)))
+        choice = input("Which option do you choose?  ").lower().strip()
+        if choice == 'n':
+            if start + page_size < len(item_list):
+                start += page_size
+            continue
+        if choice == 'p':
+            start = max(0, start - page_size)
+            continue
+        try:
+            choice = int(choice)
+            if choice not in range(1, len(item_list) + 1):
+                raise ValueError
+        except ValueError:
+            print("Try again.")
+            time.sleep(1)
+        else:
+            return item_list[choice - 1]
 
 
 def enter_item(question="Enter item:  ", item=None):
@@ -157,12 +477,32 @@ def enter_employee(employee=None):
                       employee)
 
 
+SUGGESTIONS = 9
+
+
 def enter_taskname(taskname=None):
-    """Task name entry."""
+    """Task name entry, suggesting the names used most.
+
+    A number picks that suggestion.  A new name that looks like one in
+    the catalog asks which was meant, so near duplicates stay out.
+    """
     if taskname:
         print(taskname)
-    return enter_item("Enter task name:  ",
-                      taskname)
+        return taskname
+    suggestions = find_tasknames(limit=SUGGESTIONS)
+    item_table_list(suggestions)
+    taskname = enter_item("Enter task name:  ")
+    if taskname.isdigit() and 0 < int(taskname) <= len(suggestions):
+        return suggestions[int(taskname) - 1]
+    catalog = models.TaskName
+    if catalog.select().where(catalog.name == taskname,
+                              catalog.uses > 0).exists():
+        return taskname
+    similar = difflib.get_close_matches(taskname, find_tasknames(),
+                                        SUGGESTIONS - 1, cutoff=0.8)
+    if similar:
+        return item_table(similar + [taskname], "Did you mean one of these?")
+    return taskname
 
 
 def enter_minutes(minutes=None):
@@ -197,7 +537,7 @@ def enter_task(employee=None,
     """Add an entry."""
     clear()
     if not employee:
-        employee = enter_employee(employee)
+        employee = choose_employee(enter_employee(employee))
     if not taskname:
         taskname = enter_taskname(taskname)
     if not minutes:
@@ -211,3 +551,35 @@ def enter_task(employee=None,
             "minutes": minutes,
             "notes": notes,
             "date": date}
+
+
+def clean_task(row):
+    """Check a task read from a file the way the entry prompts would.
+
+    Return it as a task dict, or raise ValueError saying what is wrong.
+    An Employee is kept as it is, as create_task takes one.
+    """
+    employee = row.get('employee')
+    if not isinstance(employee, models.Employee):
+        employee = str(employee or '').strip()
+    taskname = str(row.get('taskname') or '').strip()
+    if not employee:
+        raise ValueError("no employee")
+    if not taskname:
+        raise ValueError("no task name")
+    try:
+        minutes = int(row.get('minutes'))
+    except (TypeError, ValueError):
+        raise ValueError(
+            "minutes {!r} is not a number".format(row.get('minutes')))
+    date = row.get('date')
+    if not isinstance(date, datetime.date):
+        try:
+            date = datetime.datetime.strptime(str(date), fmt).date()
+        except ValueError:
+            raise ValueError("date {!r} is not YYYYMMDD".format(date))
+    return {"employee": employee,
+            "taskname": taskname,
+            "minutes": minutes,
+            "notes": str(row.get('notes') or ''),
+            "date": date}
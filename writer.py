@@ -0,0 +1,173 @@
+"""
+writer.py
+---------
+Buffered task writes, for tools that log entries at a high rate.
+
+utils.create_task commits each task in a transaction of its own, and
+every commit waits on the disk.  A TaskWriter queues tasks instead and
+writes them together with utils.create_tasks, one transaction for the
+lot, once max_tasks are waiting or the oldest has waited max_delay
+seconds:
+
+    with writer.TaskWriter() as tasks:
+        for entry in entries:
+            tasks.add(entry)
+
+Whatever is still queued is written when the writer closes, at the
+latest when the program exits, with a commit that reaches the disk
+before it returns.  A closed writer writes each task as it is added.
+"""
+
+import atexit
+import contextlib
+import sys
+import threading
+import time
+
+from peewee import OperationalError
+
+import models
+import utils
+
+
+@contextlib.contextmanager
+def synchronous_full():
+    """Make commits inside the block wait until they are on the disk.
+
+    In WAL mode with synchronous = NORMAL, the last commits can be lost
+    to a power cut, though never to a crash of the program.
+    """
+    previous = models.db.execute_sql('PRAGMA synchronous').fetchone()[0]
+    models.db.execute_sql('PRAGMA synchronous = FULL')
+    try:
+        yield
+    finally:
+        models.db.execute_sql('PRAGMA synchronous = {:d}'.format(previous))
+
+
+class TaskWriter:
+    """Queue tasks and write them in batches, from a background thread.
+
+    A batch is written when max_tasks tasks are queued, by the call to
+    add that queues the last of them, or when the oldest has waited
+    max_delay seconds, by the writer's thread.  Tasks are checked with
+    utils.clean_task as they are added, so a bad one raises ValueError
+    there and is never queued.
+
+    A batch that fails on a database locked too long goes back on the
+    queue, to be tried again.  One that fails for any other reason is
+    reported to errors and dropped, and counted in `dropped`.  Either
+    way its error is kept in `error` until the next batch succeeds.
+    """
+
+    def __init__(self, max_tasks=500, max_delay=1.0, errors=sys.stderr):
+        self.max_tasks = max_tasks
+        self.max_delay = max_delay
+        self.errors = errors
+        self.written = 0
+        self.dropped = 0
+        self.error = None
+        self._queue = []
+        self._since = None  # when the oldest queued task was added
+        self._closed = False
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._flushing = threading.Lock()  # batches go in the queue's order
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def __len__(self):
+        """Count the tasks waiting to be written."""
+        return len(self._queue)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, new_task):
+        """Queue a task, writing the batch if that fills it.
+
+        Once the writer is closed the task is written straight away and
+        its id returned, as utils.create_task does.  A task that
+        utils.clean_task rejects raises its ValueError.
+        """
+        new_task = utils.clean_task(new_task)
+        if self._closed:
+            return utils.create_task(new_task)
+        with self._lock:
+            if not self._queue:
+                self._since = time.monotonic()
+                self._changed.notify()
+            self._queue.append(new_task)
+            full = len(self._queue) >= self.max_tasks
+        if full:
+            self.flush()
+
+    def flush(self, durable=False):
+        """Write every queued task in one transaction; return how many.
+
+        With durable, the commit is on the disk when this returns.
+        """
+        with self._flushing:
+            with self._lock:
+                batch, self._queue = self._queue, []
+            if not batch:
+                return 0
+            commit = synchronous_full() if durable else \
+                contextlib.nullcontext()
+            try:
+                with commit:
+                    utils.create_tasks(batch)
+            except OperationalError as err:  # locked: worth another try
+                with self._lock:
+                    self._queue[:0] = batch
+                    self._since = time.monotonic()  # retry after a delay
+                self.error = err
+                raise
+            except Exception as err:  # would fail the same way again
+                self.error = err
+                self.dropped += len(batch)
+                print("dropped {} tasks: {}".format(len(batch), err),
+                      file=self.errors)
+                raise
+            self.error = None
+            self.written += len(batch)
+            return len(batch)
+
+    def _due(self):
+        """Seconds until the oldest queued task has waited max_delay."""
+        return self._since + self.max_delay - time.monotonic()
+
+    def _run(self):
+        """Write batches whose oldest task has waited long enough."""
+        while True:
+            with self._lock:
+                while not self._closed and (not self._queue or
+                                            self._due() > 0):
+                    self._changed.wait(self._due() if self._queue else None)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                pass  # kept in self.error; retried or dropped by flush
+            finally:
+                if not models.db.is_closed():
+                    models.db.close()
+
+    def close(self):
+        """Write what is queued, durably, and stop the writer's thread.
+
+        Tasks added afterwards are written one at a time.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._changed.notify()
+        self._thread.join()
+        atexit.unregister(self.close)
+        self.flush(durable=True)